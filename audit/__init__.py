@@ -0,0 +1,4 @@
+"""Journal d'audit des recherches et des accès aux fiches."""
+from .log import AuditLog, audit_log, audit_event
+
+__all__ = ["AuditLog", "audit_log", "audit_event"]
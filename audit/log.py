@@ -0,0 +1,195 @@
+"""Journal d'audit à écriture différée.
+
+Les événements sont déposés dans une file mémoire bornée ; un thread les écrit
+par lots avec ``COPY`` dans la table partitionnée ``audit_log``, sur sa propre
+connexion. Si la base est indisponible ou la file pleine, les événements sont
+ajoutés à un fichier CSV local, rejoué dès que la base répond. À l'arrêt du
+processus, la file est vidée (en base, sinon dans le fichier).
+"""
+import atexit
+import csv
+import io
+import json
+import os
+import queue
+import threading
+from datetime import date, datetime
+from time import monotonic
+
+from config import AUDIT_BATCH_SIZE, AUDIT_FLUSH_INTERVAL, AUDIT_QUEUE_SIZE, AUDIT_SPILL_FILE
+
+COLUMNS = ("created_at", "username", "action", "target", "details")
+COPY_SQL = f"COPY audit_log ({', '.join(COLUMNS)}) FROM STDIN WITH (FORMAT csv)"
+
+
+def _row(created_at, username, action, target, details):
+    return (
+        created_at.isoformat(sep=" "),
+        username,
+        action,
+        None if target is None else str(target),
+        json.dumps(details, ensure_ascii=False, default=str) if details is not None else None,
+    )
+
+
+def _month(created_at: datetime) -> date:
+    return date(created_at.year, created_at.month, 1)
+
+
+class AuditLog:
+    """File d'événements d'audit et thread d'écriture."""
+
+    def __init__(self, queue_size: int = AUDIT_QUEUE_SIZE, batch_size: int = AUDIT_BATCH_SIZE,
+                 flush_interval: float = AUDIT_FLUSH_INTERVAL, spill_file: str = AUDIT_SPILL_FILE):
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.spill_file = spill_file
+        self._conn = None
+        self._partitions = set()
+        self._spill_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def record(self, action: str, username: str = None, target=None, details: dict = None) -> None:
+        """Dépose un événement sans attendre la base."""
+        self._ensure_started()
+        row = _row(datetime.now(), username, action, target, details)
+        try:
+            self.queue.put_nowait(row)
+        except queue.Full:
+            # Mémoire bornée : le surplus part directement sur disque
+            self._spill([row])
+
+    def _ensure_started(self) -> None:
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="audit-flusher", daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            batch = self._collect()
+            if batch:
+                self._write(batch)
+            elif os.path.exists(self.spill_file) or os.path.exists(self._replay_file):
+                self._replay()
+
+    def _collect(self):
+        """Attend le premier événement, puis remplit le lot jusqu'à sa taille ou l'intervalle."""
+        try:
+            batch = [self.queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        deadline = monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _drain(self):
+        batch = []
+        while True:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                return batch
+
+    def _write(self, batch) -> bool:
+        """Écrit le lot par COPY ; en cas d'échec, il est conservé dans le fichier local."""
+        try:
+            cur = self._cursor()
+            self._ensure_partitions(cur, batch)
+            buffer = io.StringIO()
+            csv.writer(buffer).writerows(batch)
+            buffer.seek(0)
+            cur.copy_expert(COPY_SQL, buffer)
+        except Exception as e:
+            print(f"Journal d'audit : base indisponible ({e}), {len(batch)} événement(s) conservé(s) localement.")
+            self._reset_connection()
+            self._spill(batch)
+            return False
+        self._replay()
+        return True
+
+    def _cursor(self):
+        if self._conn is None or self._conn.closed:
+            from database import connect
+            self._conn = connect()
+        return self._conn.cursor()
+
+    def _reset_connection(self) -> None:
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except Exception:
+                pass
+        self._conn = None
+
+    def _ensure_partitions(self, cur, batch) -> None:
+        """Crée la partition mensuelle des événements du lot si besoin (nouvel essai au lot suivant en cas d'échec)."""
+        for month in {_month(datetime.fromisoformat(row[0])) for row in batch} - self._partitions:
+            upper = date(month.year + month.month // 12, month.month % 12 + 1, 1)
+            try:
+                cur.execute(
+                    f"CREATE TABLE IF NOT EXISTS audit_log_{month:%Y%m} PARTITION OF audit_log "
+                    "FOR VALUES FROM (%s) TO (%s)",
+                    (month, upper),
+                )
+            except Exception as e:
+                # Par exemple des lignes du mois déjà présentes dans la partition par défaut
+                print(f"Journal d'audit : partition {month:%Y-%m} non créée ({e}).")
+                continue
+            self._partitions.add(month)
+
+    @property
+    def _replay_file(self) -> str:
+        return self.spill_file + ".replay"
+
+    def _spill(self, rows) -> None:
+        with self._spill_lock:
+            with open(self.spill_file, "a", newline="", encoding="utf-8") as f:
+                csv.writer(f).writerows(rows)
+
+    def _replay(self) -> None:
+        """Recharge en un seul COPY (atomique) les événements conservés localement."""
+        with self._spill_lock:
+            if not os.path.exists(self._replay_file):
+                if not os.path.exists(self.spill_file):
+                    return
+                os.replace(self.spill_file, self._replay_file)
+        try:
+            with open(self._replay_file, encoding="utf-8") as f:
+                self._cursor().copy_expert(COPY_SQL, f)
+        except Exception as e:
+            print(f"Journal d'audit : rejeu du fichier local reporté ({e}).")
+            self._reset_connection()
+            return
+        os.remove(self._replay_file)
+
+    def close(self, timeout: float = 10.0) -> None:
+        """Arrête le thread et écrit les événements restants."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        batch = self._drain()
+        if batch:
+            self._write(batch)
+        self._reset_connection()
+
+
+audit_log = AuditLog()
+
+
+def audit_event(action: str, username: str = None, target=None, details: dict = None) -> None:
+    """Enregistre une action (recherche, export, modification) dans le journal d'audit."""
+    audit_log.record(action, username, target, details)
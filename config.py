@@ -0,0 +1,105 @@
+"""Paramètres de l'application, surchargeables par variables d'environnement."""
+import os
+
+# Cache des résultats de recherche faciale
+SEARCH_CACHE_SIZE = int(os.environ.get("DGSN_SEARCH_CACHE_SIZE", "256"))
+SEARCH_CACHE_TTL = float(os.environ.get("DGSN_SEARCH_CACHE_TTL", "900"))
+
+# Service d'identification (python -m service.server)
+SERVICE_URL = os.environ.get("DGSN_SERVICE_URL", "")
+SERVICE_WORKERS = int(os.environ.get("DGSN_SERVICE_WORKERS", "4"))
+SERVICE_QUEUE_SIZE = int(os.environ.get("DGSN_SERVICE_QUEUE_SIZE", "32"))
+SERVICE_TIMEOUT = float(os.environ.get("DGSN_SERVICE_TIMEOUT", "120"))
+# Jeton partagé entre le service et ses clients, sans valeur par défaut : le service
+# crée des fiches et renvoie des dossiers complets
+SERVICE_TOKEN = os.environ.get("DGSN_SERVICE_TOKEN", "")
+
+# Calcul des embeddings : processus x threads TensorFlow par processus <= cœurs
+CPU_COUNT = os.cpu_count() or 1
+EMBED_THREADS_PER_WORKER = int(os.environ.get("DGSN_EMBED_THREADS_PER_WORKER", "2"))
+EMBED_WORKERS = int(os.environ.get("DGSN_EMBED_WORKERS", "0")) or max(1, CPU_COUNT // EMBED_THREADS_PER_WORKER)
+EMBED_CHUNK_SIZE = int(os.environ.get("DGSN_EMBED_CHUNK_SIZE", "32"))
+EMBED_POOL_MIN_BATCH = int(os.environ.get("DGSN_EMBED_POOL_MIN_BATCH", "4"))
+EMBED_BATCH_SIZE = int(os.environ.get("DGSN_EMBED_BATCH_SIZE", "32"))
+# Chemin en ligne : attente maximale pour compléter un lot (ms)
+EMBED_BATCH_WAIT_MS = float(os.environ.get("DGSN_EMBED_BATCH_WAIT_MS", "10"))
+
+# Recherche en deux étapes : nombre minimal de criminels retenus par les gabarits
+SEARCH_SHORTLIST = int(os.environ.get("DGSN_SEARCH_SHORTLIST", "100"))
+SEARCH_SHORTLIST_FACTOR = int(os.environ.get("DGSN_SEARCH_SHORTLIST_FACTOR", "10"))
+
+# Seuils de correspondance calibrés (python -m recognition.calibration)
+THRESHOLDS_FILE = os.environ.get(
+    "DGSN_THRESHOLDS_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "thresholds.json")
+)
+# Seuil de distance cosinus utilisé tant qu'aucune calibration n'existe pour le modèle
+DEFAULT_MATCH_THRESHOLD = float(os.environ.get("DGSN_DEFAULT_MATCH_THRESHOLD", "0.40"))
+CALIBRATION_TARGET_FAR = float(os.environ.get("DGSN_CALIBRATION_TARGET_FAR", "0.001"))
+
+# Journal d'audit : file mémoire bornée, écriture différée par lots (COPY)
+AUDIT_QUEUE_SIZE = int(os.environ.get("DGSN_AUDIT_QUEUE_SIZE", "10000"))
+AUDIT_BATCH_SIZE = int(os.environ.get("DGSN_AUDIT_BATCH_SIZE", "500"))
+AUDIT_FLUSH_INTERVAL = float(os.environ.get("DGSN_AUDIT_FLUSH_INTERVAL", "2"))
+# Événements en attente quand la base est indisponible ou la file pleine
+AUDIT_SPILL_FILE = os.environ.get(
+    "DGSN_AUDIT_SPILL_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "audit_spill.csv")
+)
+
+# Enregistrement : encodage parallèle des photos et vignettes stockées avec elles
+ENCODE_WORKERS = int(os.environ.get("DGSN_ENCODE_WORKERS", "4"))
+THUMBNAIL_SIZE = int(os.environ.get("DGSN_THUMBNAIL_SIZE", "160"))
+
+# Galerie répartie en shards (python -m shards.server) : "hôte:port,hôte:port", dans l'ordre des index
+SHARD_ADDRESSES = [a for a in os.environ.get("DGSN_SHARD_ADDRESSES", "").split(",") if a.strip()]
+# Clé partagée des shards, sans valeur par défaut : les messages sont des pickles,
+# un serveur joignable avec une clé connue exécuterait du code arbitraire
+SHARD_AUTHKEY = os.environ.get("DGSN_SHARD_AUTHKEY", "").encode()
+# Délai de réponse des shards (s) : au-delà, les résultats sont partiels
+SHARD_TIMEOUT = float(os.environ.get("DGSN_SHARD_TIMEOUT", "2"))
+
+# Base de données : primaire (écritures) et réplicas en lecture, DSN libpq
+# ("host=... dbname=..." ou "postgresql://..."). Sans DGSN_PRIMARY_DSN : paramètres locaux.
+PRIMARY_DSN = os.environ.get("DGSN_PRIMARY_DSN", "")
+REPLICA_DSNS = [d for d in os.environ.get("DGSN_REPLICA_DSNS", "").split(",") if d.strip()]
+REPLICA_POOL_SIZE = int(os.environ.get("DGSN_REPLICA_POOL_SIZE", "8"))
+# Connexions au primaire réservées aux transactions explicites (database.transaction)
+PRIMARY_POOL_SIZE = int(os.environ.get("DGSN_PRIMARY_POOL_SIZE", "8"))
+# Attente maximale (s) qu'un réplica rattrape la dernière écriture de la session
+REPLICA_MAX_LAG_WAIT = float(os.environ.get("DGSN_REPLICA_MAX_LAG_WAIT", "0.2"))
+
+# Détection des visages : backend DeepFace (opencv, ssd, mtcnn, retinaface...) et
+# détection rapide sur une copie réduite (plus grand côté en pixels, 0 = pleine résolution)
+DETECTOR_BACKEND = os.environ.get("DGSN_DETECTOR_BACKEND", "opencv")
+DETECTION_MAX_SIDE = int(os.environ.get("DGSN_DETECTION_MAX_SIDE", "0"))
+
+# Embedder factice déterministe (tests de charge, scripts/load_test.py) : ni DeepFace ni
+# détection, l'image entière est le « visage » et son vecteur dérive de son empreinte
+FAKE_EMBEDDER = os.environ.get("DGSN_FAKE_EMBEDDER", "0") == "1"
+
+# Index en mémoire : quantification de la matrice (none, float16, int8) ; les vecteurs
+# pleine précision du re-classement restent sur disque dans INDEX_DIR
+INDEX_QUANTIZATION = os.environ.get("DGSN_INDEX_QUANTIZATION", "none")
+INDEX_DIR = os.environ.get(
+    "DGSN_INDEX_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "index_cache")
+)
+
+# Instantanés de l'index sur disque (partagés entre processus, projetés en mémoire) :
+# compaction dès que le journal touche SNAPSHOT_COMPACT_CHANGES criminels ; le journal
+# et les instantanés expirent après SNAPSHOT_RETENTION secondes
+INDEX_SNAPSHOTS = os.environ.get("DGSN_INDEX_SNAPSHOTS", "1") == "1"
+SNAPSHOT_COMPACT_CHANGES = int(os.environ.get("DGSN_SNAPSHOT_COMPACT_CHANGES", "500"))
+SNAPSHOT_RETENTION = float(os.environ.get("DGSN_SNAPSHOT_RETENTION", str(7 * 86400)))
+
+# Invalidation des caches par LISTEN/NOTIFY entre instances (0 = version de la galerie interrogée à chaque recherche)
+GALLERY_NOTIFY = os.environ.get("DGSN_GALLERY_NOTIFY", "1") == "1"
+
+# Recherche progressive (find_match_stream) : taille des partitions (photos) et délai par défaut
+# de l'interface en secondes (0 = aucun)
+STREAM_PARTITION_ROWS = int(os.environ.get("DGSN_STREAM_PARTITION_ROWS", "50000"))
+SEARCH_DEADLINE = float(os.environ.get("DGSN_SEARCH_DEADLINE", "0"))
+
+# Dossiers surveillés (python -m ingest.watcher) : "chemin=identify,chemin=enroll" séparés
+# par des virgules (mode identify par défaut), taille des lots et période de scrutation (s)
+WATCH_FOLDERS = os.environ.get("DGSN_WATCH_FOLDERS", "")
+WATCH_BATCH_SIZE = int(os.environ.get("DGSN_WATCH_BATCH_SIZE", "64"))
+WATCH_POLL_INTERVAL = float(os.environ.get("DGSN_WATCH_POLL_INTERVAL", "1.0"))
@@ -1,11 +1,31 @@
 """Database connection and initialization."""
+import threading
+from contextlib import contextmanager
+
 import psycopg2
+from psycopg2.pool import PoolError, ThreadedConnectionPool
+
+from config import PRIMARY_DSN, PRIMARY_POOL_SIZE, REPLICA_DSNS
+from .routing import ReplicaRouter, session_lsn, set_session_lsn
+
+DB_PARAMS = {
+    "dbname": "DGSN",
+    "user": "postgres",
+    "password": "Abdou",
+    "host": "localhost",
+    "port": "5432",
+}
+
+
+def connect(autocommit: bool = True):
+    """Ouvre une nouvelle connexion au primaire (une par processus ou thread de travail)."""
+    connection = psycopg2.connect(PRIMARY_DSN) if PRIMARY_DSN else psycopg2.connect(**DB_PARAMS)
+    connection.autocommit = autocommit
+    return connection
+
 
 try:
-    conn = psycopg2.connect(
-        dbname="DGSN", user="postgres", password="Abdou", host="localhost", port="5432"
-    )
-    conn.autocommit = True
+    conn = connect()
     cursor = conn.cursor()
 except Exception as e:
     # Gérer l'erreur de manière appropriée, par exemple en l'affichant dans Streamlit
@@ -13,6 +33,114 @@ except Exception as e:
     cursor = None  # S'assurer que le curseur est None si la connexion échoue
 
 
+router = ReplicaRouter(REPLICA_DSNS) if REPLICA_DSNS else None
+
+
+@contextmanager
+def read_cursor():
+    """Curseur pour une lecture : réplica à jour pour la session si configuré, sinon le primaire."""
+    if router is None:
+        yield cursor
+        return
+    with router.cursor(cursor, session_lsn()) as cur:
+        yield cur
+
+
+def mark_write(cur=None) -> None:
+    """Retient la position WAL après une écriture : les lectures suivantes de la session la verront."""
+    if router is None:
+        return
+    cur = cur or cursor
+    cur.execute("SELECT pg_current_wal_lsn()::text")
+    set_session_lsn(cur.fetchone()[0])
+
+
+_transaction_pool = None
+_transaction_pool_lock = threading.Lock()
+
+
+def _acquire_connection():
+    """(pool, connexion) au primaire pour une transaction ; pool None si la connexion est dédiée."""
+    global _transaction_pool
+    with _transaction_pool_lock:
+        if _transaction_pool is None:
+            args, kwargs = ((PRIMARY_DSN,), {}) if PRIMARY_DSN else ((), DB_PARAMS)
+            _transaction_pool = ThreadedConnectionPool(0, PRIMARY_POOL_SIZE, *args, **kwargs)
+        pool = _transaction_pool
+    try:
+        return pool, pool.getconn()
+    except PoolError:
+        # Pool épuisé : connexion ouverte pour cette seule transaction
+        return None, connect(autocommit=False)
+
+
+@contextmanager
+def transaction(cur=None):
+    """Exécute un bloc dans une transaction explicite et fournit son curseur.
+
+    Sans ``cur``, la transaction a sa propre connexion au primaire : le curseur
+    partagé ``cursor`` (autocommit, commun à toutes les sessions) n'y participe
+    jamais. ``cur`` permet d'utiliser une connexion dédiée de l'appelant.
+    """
+    if cur is not None:
+        cur.execute("BEGIN")
+        try:
+            yield cur
+        except Exception:
+            cur.execute("ROLLBACK")
+            raise
+        else:
+            cur.execute("COMMIT")
+            mark_write(cur)
+        return
+    pool, connection = _acquire_connection()
+    broken = True
+    try:
+        connection.autocommit = False
+        with connection.cursor() as cur:
+            try:
+                yield cur
+            except Exception:
+                connection.rollback()
+                raise
+            connection.commit()
+            mark_write(cur)
+        broken = False
+    finally:
+        if pool is None:
+            connection.close()
+        else:
+            pool.putconn(connection, close=broken or bool(connection.closed))
+
+
+def _trigger_exists(name: str, table: str) -> bool:
+    cursor.execute(
+        "SELECT 1 FROM pg_trigger WHERE tgname = %s AND tgrelid = %s::regclass AND NOT tgisinternal",
+        (name, table),
+    )
+    return cursor.fetchone() is not None
+
+
+def _create_trigger(name: str, table: str, definition: str, constraint: bool = False) -> None:
+    """Crée le trigger ``name`` sur ``table`` s'il n'existe pas encore.
+
+    Jamais de DROP/CREATE : le trigger reste actif pendant l'initialisation et les
+    tables ne sont verrouillées que lors de la toute première création.
+    """
+    if _trigger_exists(name, table):
+        return
+    try:
+        cursor.execute(f"CREATE {'CONSTRAINT ' if constraint else ''}TRIGGER {name} {definition}")
+    except psycopg2.errors.DuplicateObject:
+        pass  # Créé entre-temps par une autre instance
+
+
+def _drop_trigger(name: str, table: str) -> None:
+    """Supprime un trigger remplacé, sans verrouiller la table s'il n'existe plus."""
+    if _trigger_exists(name, table):
+        cursor.execute(f"DROP TRIGGER IF EXISTS {name} ON {table}")
+
+
 def setup_db():
     if not cursor:
         return
@@ -36,6 +164,14 @@ def setup_db():
           image BYTEA
         );
         """)
+        # Filtres de la recherche faciale (database.filters)
+        for name, expression in (
+            ("crime", "crime"),
+            ("nationalite", "LOWER(nationalite)"),
+            ("date_arrestation", "date_arrestation"),
+            ("age", "age"),
+        ):
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_criminals_{name} ON criminals({expression});")
         cursor.execute("""
         CREATE TABLE IF NOT EXISTS crime_types (
           id SERIAL PRIMARY KEY,
@@ -60,6 +196,267 @@ def setup_db():
         cursor.execute(
             "CREATE INDEX IF NOT EXISTS idx_images_criminels_criminal ON images_criminels(criminal_id);"
         )
+        cursor.execute("ALTER TABLE images_criminels ADD COLUMN IF NOT EXISTS thumbnail BYTEA;")
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS embeddings_criminels (
+          image_id INTEGER NOT NULL REFERENCES images_criminels(id) ON DELETE CASCADE,
+          model_name VARCHAR(50) NOT NULL,
+          embedding BYTEA,
+          created_at TIMESTAMP DEFAULT NOW(),
+          PRIMARY KEY (image_id, model_name)
+        );
+        """)
+        cursor.execute(
+            "ALTER TABLE embeddings_criminels ADD COLUMN IF NOT EXISTS quality REAL NOT NULL DEFAULT 1;"
+        )
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS templates_criminels (
+          criminal_id INTEGER NOT NULL REFERENCES criminals(id) ON DELETE CASCADE,
+          model_name VARCHAR(50) NOT NULL,
+          weighted_sum REAL[] NOT NULL,
+          weight_sum REAL NOT NULL,
+          photos INTEGER NOT NULL,
+          updated_at TIMESTAMP DEFAULT NOW(),
+          PRIMARY KEY (criminal_id, model_name)
+        );
+        """)
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS gallery_version (
+          id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+          version BIGINT NOT NULL DEFAULT 0
+        );
+        """)
+        cursor.execute("INSERT INTO gallery_version (id, version) VALUES (TRUE, 0) ON CONFLICT DO NOTHING;")
+        # Une incrémentation par transaction, au COMMIT (triggers différés) : le verrou de
+        # la ligne de version n'est tenu qu'entre le trigger et la fin du COMMIT, les
+        # écritures concurrentes ne s'attendent pas.
+        cursor.execute("""
+        CREATE OR REPLACE FUNCTION bump_gallery_version() RETURNS trigger AS $$
+        BEGIN
+          IF current_setting('dgsn.gallery_version_bumped', true) IS DISTINCT FROM 'on' THEN
+            UPDATE gallery_version SET version = version + 1;
+            PERFORM set_config('dgsn.gallery_version_bumped', 'on', true);
+          END IF;
+          RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+        """)
+        # Seules les modifications dont dépendent l'index et les filtres de recherche
+        # comptent : un téléphone ou une adresse modifiés ne changent pas la version.
+        for table, events in (
+            ("criminals", "INSERT OR DELETE OR UPDATE OF crime, nationalite, age, date_arrestation"),
+            ("images_criminels", "UPDATE OF criminal_id"),
+            ("embeddings_criminels", "INSERT OR UPDATE OR DELETE"),
+        ):
+            _drop_trigger(f"trg_{table}_gallery_version", table)
+            _create_trigger(
+                f"trg_{table}_gallery_bump",
+                table,
+                f"""
+                AFTER {events} ON {table}
+                DEFERRABLE INITIALLY DEFERRED
+                FOR EACH ROW EXECUTE FUNCTION bump_gallery_version();
+                """,
+                constraint=True,
+            )
+            _create_trigger(
+                f"trg_{table}_gallery_truncate",
+                table,
+                f"""
+                AFTER TRUNCATE ON {table}
+                FOR EACH STATEMENT EXECUTE FUNCTION bump_gallery_version();
+                """,
+            )
+        # Journal des criminels modifiés depuis un instantané de l'index (recognition.snapshot) ;
+        # txid situe chaque modification par rapport à l'instantané.
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS gallery_changes (
+          id BIGSERIAL PRIMARY KEY,
+          txid BIGINT NOT NULL DEFAULT txid_current(),
+          criminal_id INTEGER NOT NULL,
+          model_name VARCHAR(50),
+          created_at TIMESTAMP NOT NULL DEFAULT NOW()
+        );
+        """)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_gallery_changes_txid ON gallery_changes(txid);")
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_gallery_changes_created ON gallery_changes(created_at);"
+        )
+        cursor.execute("""
+        CREATE OR REPLACE FUNCTION log_embedding_change() RETURNS trigger AS $$
+        DECLARE
+          r embeddings_criminels%ROWTYPE;
+        BEGIN
+          IF TG_OP = 'DELETE' THEN r := OLD; ELSE r := NEW; END IF;
+          -- Photo déjà supprimée (cascade) : journalisée par log_image_change
+          INSERT INTO gallery_changes (criminal_id, model_name)
+          SELECT criminal_id, r.model_name FROM images_criminels WHERE id = r.image_id;
+          RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+        """)
+        cursor.execute("""
+        CREATE OR REPLACE FUNCTION log_image_change() RETURNS trigger AS $$
+        BEGIN
+          INSERT INTO gallery_changes (criminal_id) VALUES (OLD.criminal_id);
+          IF TG_OP = 'UPDATE' AND NEW.criminal_id <> OLD.criminal_id THEN
+            INSERT INTO gallery_changes (criminal_id) VALUES (NEW.criminal_id);
+          END IF;
+          RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+        """)
+        _create_trigger(
+            "trg_embeddings_criminels_changes",
+            "embeddings_criminels",
+            """
+            AFTER INSERT OR UPDATE OR DELETE ON embeddings_criminels
+            FOR EACH ROW EXECUTE FUNCTION log_embedding_change();
+            """,
+        )
+        _create_trigger(
+            "trg_images_criminels_changes",
+            "images_criminels",
+            """
+            AFTER DELETE OR UPDATE OF criminal_id ON images_criminels
+            FOR EACH ROW EXECUTE FUNCTION log_image_change();
+            """,
+        )
+        # Invalidation des caches des autres instances (database.notifications) ;
+        # les messages identiques d'une même transaction sont fusionnés par PostgreSQL.
+        cursor.execute("""
+        CREATE OR REPLACE FUNCTION notify_gallery_change() RETURNS trigger AS $$
+        DECLARE
+          r RECORD;
+          cid INTEGER;
+          model VARCHAR;
+        BEGIN
+          IF TG_OP = 'DELETE' THEN r := OLD; ELSE r := NEW; END IF;
+          IF TG_TABLE_NAME = 'criminals' THEN
+            cid := r.id;
+          ELSIF TG_TABLE_NAME = 'images_criminels' THEN
+            cid := r.criminal_id;
+            IF TG_OP = 'UPDATE' AND NEW.criminal_id <> OLD.criminal_id THEN
+              PERFORM pg_notify('dgsn_gallery', json_build_object(
+                'table', TG_TABLE_NAME, 'op', TG_OP, 'criminal_id', OLD.criminal_id, 'model_name', NULL)::text);
+            END IF;
+          ELSE
+            model := r.model_name;
+            SELECT criminal_id INTO cid FROM images_criminels WHERE id = r.image_id;
+          END IF;
+          IF cid IS NOT NULL THEN
+            PERFORM pg_notify('dgsn_gallery', json_build_object(
+              'table', TG_TABLE_NAME, 'op', TG_OP, 'criminal_id', cid, 'model_name', model)::text);
+          END IF;
+          RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+        """)
+        for table in ("criminals", "images_criminels", "embeddings_criminels"):
+            _create_trigger(
+                f"trg_{table}_notify",
+                table,
+                f"""
+                AFTER INSERT OR UPDATE OR DELETE ON {table}
+                FOR EACH ROW EXECUTE FUNCTION notify_gallery_change();
+                """,
+            )
+        # Dossiers supprimés par une fusion de doublons, archivés tels quels
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS criminals_merged (
+          id SERIAL PRIMARY KEY,
+          source_id INTEGER NOT NULL,
+          target_id INTEGER NOT NULL,
+          record JSONB NOT NULL,
+          merged_by VARCHAR(255),
+          merged_at TIMESTAMP DEFAULT NOW()
+        );
+        """)
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_criminals_merged_target ON criminals_merged(target_id);"
+        )
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS jobs (
+          id SERIAL PRIMARY KEY,
+          kind VARCHAR(50) NOT NULL,
+          status VARCHAR(20) NOT NULL DEFAULT 'queued',
+          payload JSONB NOT NULL DEFAULT '{}',
+          inputs BYTEA[],
+          progress REAL NOT NULL DEFAULT 0,
+          message TEXT,
+          result JSONB,
+          error TEXT,
+          cancel_requested BOOLEAN NOT NULL DEFAULT FALSE,
+          created_by VARCHAR(255),
+          worker VARCHAR(255),
+          created_at TIMESTAMP DEFAULT NOW(),
+          started_at TIMESTAMP,
+          heartbeat_at TIMESTAMP,
+          finished_at TIMESTAMP
+        );
+        """)
+        cursor.execute("ALTER TABLE jobs ADD COLUMN IF NOT EXISTS attempts INTEGER NOT NULL DEFAULT 0;")
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_jobs_queued ON jobs(id) WHERE status = 'queued';"
+        )
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_jobs_created_by ON jobs(created_by, id DESC);"
+        )
+        # Dossiers surveillés (ingest) : un fichier par empreinte SHA-256, alertes de correspondance
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS ingested_files (
+          sha256 CHAR(64) PRIMARY KEY,
+          path TEXT NOT NULL,
+          folder TEXT NOT NULL,
+          mode VARCHAR(20) NOT NULL,
+          status VARCHAR(20) NOT NULL DEFAULT 'pending',
+          criminal_id INTEGER REFERENCES criminals(id) ON DELETE SET NULL,
+          created_at TIMESTAMP DEFAULT NOW(),
+          processed_at TIMESTAMP
+        );
+        """)
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS alerts (
+          id SERIAL PRIMARY KEY,
+          created_at TIMESTAMP DEFAULT NOW(),
+          sha256 CHAR(64) NOT NULL,
+          path TEXT NOT NULL,
+          folder TEXT NOT NULL,
+          criminal_id INTEGER NOT NULL REFERENCES criminals(id) ON DELETE CASCADE,
+          image_id INTEGER REFERENCES images_criminels(id) ON DELETE SET NULL,
+          model_name VARCHAR(50) NOT NULL,
+          distance REAL NOT NULL,
+          similarity REAL NOT NULL,
+          acknowledged_by VARCHAR(255),
+          acknowledged_at TIMESTAMP
+        );
+        """)
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_alerts_open ON alerts(created_at DESC) WHERE acknowledged_at IS NULL;"
+        )
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_alerts_criminal ON alerts(criminal_id, created_at DESC);"
+        )
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS audit_log (
+          id BIGSERIAL,
+          created_at TIMESTAMP NOT NULL,
+          username VARCHAR(255),
+          action VARCHAR(50) NOT NULL,
+          target VARCHAR(255),
+          details JSONB,
+          PRIMARY KEY (id, created_at)
+        ) PARTITION BY RANGE (created_at);
+        """)
+        # Partitions mensuelles créées par le journal d'audit ; la partition par
+        # défaut reçoit les événements rejoués d'un mois sans partition.
+        cursor.execute("CREATE TABLE IF NOT EXISTS audit_log_default PARTITION OF audit_log DEFAULT;")
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_audit_log_user ON audit_log(username, created_at);"
+        )
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_audit_log_action ON audit_log(action, created_at);"
+        )
         cursor.execute("SELECT COUNT(*) FROM images_criminels;")
         count = cursor.fetchone()[0]
         if count == 0:
@@ -75,20 +472,43 @@ def setup_db():
         print(f"Attention: initialisation de la table images_criminels incomplète ({e}).")
 
 
+from .notifications import ChangeListener, get_listener
+from .filters import filter_criminal_ids, list_crime_types, normalize_filters
 from .crud import (
+    insert_criminal,
+    add_photos,
+    merge_criminals,
+    merge_differences,
     delete_photo,
     update_photo,
     search_criminals_by_text,
     get_criminal_by_id,
     update_criminal,
+    delete_criminal,
 )
 
 __all__ = [
     "cursor",
+    "connect",
+    "read_cursor",
+    "mark_write",
+    "session_lsn",
+    "set_session_lsn",
+    "transaction",
     "setup_db",
+    "ChangeListener",
+    "get_listener",
+    "filter_criminal_ids",
+    "list_crime_types",
+    "normalize_filters",
+    "insert_criminal",
+    "add_photos",
+    "merge_criminals",
+    "merge_differences",
     "delete_photo",
     "update_photo",
     "search_criminals_by_text",
     "get_criminal_by_id",
     "update_criminal",
+    "delete_criminal",
 ]
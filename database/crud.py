@@ -1,25 +1,197 @@
 """Database CRUD operations."""
 from PIL import Image
 import psycopg2
-from utils import image_to_bytes
-from . import cursor
+from psycopg2.extras import execute_values
+from recognition import embed_images, store_embeddings
+from recognition.embeddings import remove_embeddings
+from recognition.templates import merge_templates
+from utils import encode_images
+from . import cursor, mark_write, read_cursor, transaction
+
+CRIMINAL_FIELDS = [
+    "nom", "prenom", "alias", "age", "date_naissance", "lieu_naissance", "nationalite",
+    "telephone", "adresse", "date_arrestation", "implication", "crime", "description",
+]
+
+
+def insert_criminal(data: dict, images, model_name: str = "Facenet", embeddings=None, encoded=None,
+                    on_insert=None) -> int:
+    """Enregistre un criminel, ses photos (5 au maximum) et leurs embeddings. Retourne son ID.
+
+    ``embeddings`` : couples (embedding, qualité) déjà calculés (vérification des doublons),
+    dans l'ordre des images ; ``encoded`` : couples (JPEG, vignette) de ``encode_images``.
+    Tout est écrit dans une seule transaction : un échec n'enregistre rien.
+    ``on_insert(cur, criminal_id)`` est appelé dans cette transaction, avant le COMMIT.
+    """
+    if not cursor:
+        return None
+    encoded = encoded or encode_images(images[:5])
+    encoded = encoded[:5]
+    if embeddings is None:
+        embeddings = embed_images([full for full, _ in encoded], model_name, with_quality=True)
+    params = (
+        data['nom'], data['prenom'], data['alias'], data['age'], data['date_naissance'],
+        data['lieu_naissance'], data['nationalite'], data['telephone'], data['adresse'],
+        data['date_arrestation'], data['implication'], data['crime'], data['description'],
+        psycopg2.Binary(encoded[0][0]),
+    )
+    with transaction() as cur:
+        cur.execute(
+            """
+            INSERT INTO criminals (nom, prenom, alias, age, date_naissance, lieu_naissance, nationalite, telephone, adresse, date_arrestation, implication, crime, description, image)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s) RETURNING id
+            """,
+            params,
+        )
+        criminal_id = cur.fetchone()[0]
+        _insert_photos(cur, criminal_id, encoded, embeddings, model_name)
+        if on_insert is not None:
+            on_insert(cur, criminal_id)
+    return criminal_id
+
+
+def add_photos(criminal_id: int, images, model_name: str = "Facenet", embeddings=None, encoded=None) -> int:
+    """Ajoute des photos à un criminel existant (fusion d'un doublon). Retourne le nombre ajouté."""
+    if not cursor:
+        return 0
+    encoded = encoded or encode_images(images)
+    if embeddings is None:
+        embeddings = embed_images([full for full, _ in encoded], model_name, with_quality=True)
+    with transaction() as cur:
+        _insert_photos(cur, criminal_id, encoded, embeddings, model_name)
+    return len(encoded)
+
+
+def _insert_photos(cur, criminal_id: int, encoded, embeddings, model_name: str) -> None:
+    """Photos, vignettes et embeddings en un INSERT groupé (``cur`` : curseur d'une transaction)."""
+    image_ids = execute_values(
+        cur,
+        "INSERT INTO images_criminels (criminal_id, image, thumbnail) VALUES %s RETURNING id",
+        [(criminal_id, psycopg2.Binary(full), psycopg2.Binary(thumb)) for full, thumb in encoded],
+        fetch=True,
+    )
+    store_embeddings(
+        cur, model_name,
+        [(image_id, vec, quality) for (image_id,), (vec, quality) in zip(image_ids, embeddings)],
+    )
+
+
+def _empty(value) -> bool:
+    return value is None or str(value).strip() == ""
+
+
+def _normalized(value) -> str:
+    return str(value).strip().lower()
+
+
+def _differences(records: dict, target_id: int) -> dict:
+    """{champ: {id: valeur}} des champs renseignés dont la valeur diffère d'un dossier à l'autre.
+
+    ``records`` : {id: {champ: valeur}} ; le dossier cible vient en premier.
+    """
+    differences = {}
+    ordered = [target_id] + [i for i in records if i != target_id]
+    for field in CRIMINAL_FIELDS:
+        values = {i: records[i][field] for i in ordered if i in records and not _empty(records[i][field])}
+        if len({_normalized(v) for v in values.values()}) > 1:
+            differences[field] = values
+    return differences
+
+
+def _fetch_records(cur, ids, lock: bool = False) -> dict:
+    cur.execute(
+        f"SELECT id, {', '.join(CRIMINAL_FIELDS)} FROM criminals WHERE id = ANY(%s)"
+        + (" ORDER BY id FOR UPDATE" if lock else ""),
+        (list(ids),),
+    )
+    return {row[0]: dict(zip(CRIMINAL_FIELDS, row[1:])) for row in cur.fetchall()}
+
+
+def merge_differences(target_id: int, source_ids) -> dict:
+    """Champs sur lesquels des doublons et leur dossier cible divergent (revue avant fusion)."""
+    if not cursor:
+        return {}
+    with read_cursor() as cur:
+        records = _fetch_records(cur, [int(target_id), *(int(i) for i in source_ids)])
+    return _differences(records, int(target_id))
+
+
+def merge_criminals(target_id: int, source_ids, merged_by: str = None) -> int:
+    """Fusionne des doublons : leurs photos passent au dossier cible, puis ils sont supprimés.
+
+    Rien n'est perdu : chaque dossier source est archivé tel quel dans
+    ``criminals_merged``, les champs vides de la cible sont complétés par les
+    sources et les valeurs divergentes sont reportées dans sa description.
+    """
+    if not cursor:
+        return 0
+    target_id = int(target_id)
+    source_ids = [int(i) for i in source_ids if int(i) != target_id]
+    if not source_ids:
+        return 0
+    with transaction() as cur:
+        records = _fetch_records(cur, [target_id, *source_ids], lock=True)
+        target = records[target_id]
+        cur.execute(
+            """
+            INSERT INTO criminals_merged (source_id, target_id, record, merged_by)
+            SELECT id, %s, to_jsonb(c) - 'image', %s FROM criminals c WHERE id = ANY(%s)
+            """,
+            (target_id, merged_by, source_ids),
+        )
+        merged = dict(target)
+        notes = []
+        for source_id in source_ids:
+            source = records.get(source_id, {})
+            conflicts = []
+            for field, value in source.items():
+                if _empty(value):
+                    continue
+                if _empty(merged[field]):
+                    merged[field] = value
+                elif _normalized(value) != _normalized(merged[field]):
+                    conflicts.append(f"{field} : {value}")
+            if conflicts:
+                notes.append(f"Fusion du dossier #{source_id} — " + " ; ".join(conflicts))
+        if notes:
+            merged["description"] = "\n\n".join(filter(None, [merged["description"], *notes]))
+        changed = [field for field in CRIMINAL_FIELDS if merged[field] != target[field]]
+        if changed:
+            cur.execute(
+                f"UPDATE criminals SET {', '.join(f'{field} = %s' for field in changed)} WHERE id = %s",
+                [merged[field] for field in changed] + [target_id],
+            )
+        merge_templates(cur, target_id, source_ids)
+        cur.execute(
+            "UPDATE images_criminels SET criminal_id = %s WHERE criminal_id = ANY(%s)",
+            (target_id, source_ids),
+        )
+        moved = cur.rowcount
+        cur.execute("DELETE FROM criminals WHERE id = ANY(%s)", (source_ids,))
+    return moved
 
 
 def delete_photo(photo_id: int):
     if not cursor:
         return
-    cursor.execute("DELETE FROM images_criminels WHERE id = %s", (photo_id,))
+    with transaction() as cur:
+        remove_embeddings(cur, [photo_id])
+        cur.execute("DELETE FROM images_criminels WHERE id = %s", (photo_id,))
 
 
-def update_photo(photo_id: int, file):
+def update_photo(photo_id: int, file, model_name: str = "Facenet"):
     if not cursor:
         return
-    pil = Image.open(file).convert("RGB")
-    img_bytes = image_to_bytes(pil)
-    cursor.execute(
-        "UPDATE images_criminels SET image = %s WHERE id = %s",
-        (psycopg2.Binary(img_bytes), photo_id),
-    )
+    [(img_bytes, thumb)] = encode_images([Image.open(file)])
+    vec, quality = embed_images([img_bytes], model_name, with_quality=True)[0]
+    with transaction() as cur:
+        cur.execute(
+            "UPDATE images_criminels SET image = %s, thumbnail = %s WHERE id = %s",
+            (psycopg2.Binary(img_bytes), psycopg2.Binary(thumb), photo_id),
+        )
+        # Les embeddings de l'ancienne photo ne sont plus valides (tous modèles)
+        remove_embeddings(cur, [photo_id])
+        store_embeddings(cur, model_name, [(photo_id, vec, quality)])
 
 
 def search_criminals_by_text(search_query: str = ""):
@@ -44,16 +216,18 @@ def search_criminals_by_text(search_query: str = ""):
         ORDER BY nom, prenom
     """
     params = [search_term] * 9
-    cursor.execute(query, params)
-    return cursor.fetchall()
+    with read_cursor() as cur:
+        cur.execute(query, params)
+        return cur.fetchall()
 
 
 def get_criminal_by_id(criminal_id: int):
     """Récupère toutes les informations d'un criminel par son ID."""
     if not cursor:
         return None
-    cursor.execute("SELECT * FROM criminals WHERE id = %s", (criminal_id,))
-    return cursor.fetchone()
+    with read_cursor() as cur:
+        cur.execute("SELECT * FROM criminals WHERE id = %s", (criminal_id,))
+        return cur.fetchone()
 
 
 def update_criminal(criminal_id: int, data: dict):
@@ -74,3 +248,12 @@ def update_criminal(criminal_id: int, data: dict):
         criminal_id
     )
     cursor.execute(query, params)
+    mark_write()
+
+
+def delete_criminal(criminal_id: int):
+    """Supprime un criminel ; ses photos, embeddings et gabarits suivent (ON DELETE CASCADE)."""
+    if not cursor:
+        return
+    cursor.execute("DELETE FROM criminals WHERE id = %s", (criminal_id,))
+    mark_write()
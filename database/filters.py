@@ -0,0 +1,86 @@
+"""Filtres d'attributs de la recherche faciale, appliqués en SQL avant la comparaison des visages.
+
+Clés reconnues (toutes facultatives) :
+  crimes           liste de types d'infraction (table ``crime_types``)
+  nationalite      nationalité (sans tenir compte de la casse)
+  age_min, age_max âge en années, bornes incluses
+  arrested_from, arrested_to  fenêtre de date d'arrestation (ISO), bornes incluses
+"""
+from datetime import date
+
+import numpy as np
+
+FILTER_KEYS = ("crimes", "nationalite", "age_min", "age_max", "arrested_from", "arrested_to")
+
+
+def normalize_filters(filters):
+    """Forme canonique (JSON, hachable via ``filters_key``) sans les critères vides ; None si aucun."""
+    if not filters:
+        return None
+    unknown = set(filters) - set(FILTER_KEYS)
+    if unknown:
+        raise ValueError(f"Filtre inconnu : {', '.join(sorted(unknown))}")
+    normalized = {}
+    for key in FILTER_KEYS:
+        value = filters.get(key)
+        if value is None or value == "" or value == [] or value == ():
+            continue
+        if key == "crimes":
+            value = sorted({str(v) for v in value})
+        elif key in ("age_min", "age_max"):
+            value = int(value)
+        elif key in ("arrested_from", "arrested_to"):
+            value = value.isoformat() if isinstance(value, date) else date.fromisoformat(str(value)).isoformat()
+        else:
+            value = str(value).strip()
+            if not value:
+                continue
+        normalized[key] = value
+    return normalized or None
+
+
+def filters_key(filters):
+    """Clé de cache d'un jeu de filtres normalisé."""
+    if not filters:
+        return None
+    return tuple((key, tuple(value) if isinstance(value, list) else value) for key, value in sorted(filters.items()))
+
+
+def filter_clause(filters):
+    """Condition SQL sur ``criminals`` (alias ``c``) et ses paramètres."""
+    conditions, params = [], []
+    if "crimes" in filters:
+        conditions.append("c.crime = ANY(%s)")
+        params.append(list(filters["crimes"]))
+    if "nationalite" in filters:
+        conditions.append("LOWER(c.nationalite) = LOWER(%s)")
+        params.append(filters["nationalite"])
+    if "age_min" in filters:
+        conditions.append("c.age >= %s")
+        params.append(filters["age_min"])
+    if "age_max" in filters:
+        conditions.append("c.age <= %s")
+        params.append(filters["age_max"])
+    if "arrested_from" in filters:
+        conditions.append("c.date_arrestation >= %s::date")
+        params.append(filters["arrested_from"])
+    if "arrested_to" in filters:
+        conditions.append("c.date_arrestation <= %s::date")
+        params.append(filters["arrested_to"])
+    return " AND ".join(conditions) or "TRUE", params
+
+
+def filter_criminal_ids(cursor, filters):
+    """Identifiants des criminels satisfaisant ``filters`` (tableau trié), ou None sans filtre."""
+    filters = normalize_filters(filters)
+    if filters is None:
+        return None
+    clause, params = filter_clause(filters)
+    cursor.execute(f"SELECT c.id FROM criminals c WHERE {clause} ORDER BY c.id", params)
+    return np.fromiter((row[0] for row in cursor.fetchall()), dtype=np.int64)
+
+
+def list_crime_types(cursor):
+    """Noms des types d'infraction, pour les listes de choix."""
+    cursor.execute("SELECT name FROM crime_types ORDER BY name")
+    return [row[0] for row in cursor.fetchall()]
@@ -0,0 +1,106 @@
+"""Notifications de modification de la galerie (LISTEN/NOTIFY).
+
+Les triggers de ``setup_db`` publient sur le canal ``dgsn_gallery`` un message JSON
+par criminel touché : {"table", "op", "criminal_id", "model_name"}. Chaque processus
+écoute sur une connexion dédiée, dans un thread, et transmet les lots reçus aux
+abonnés. Après une (re)connexion, les abonnés reçoivent ``None`` : des messages
+ont pu être perdus, ils doivent tout invalider. Le message ``RESET`` (import en
+masse) produit le même effet sur toutes les instances.
+"""
+import json
+import select
+import threading
+from time import sleep
+
+from config import GALLERY_NOTIFY
+
+CHANNEL = "dgsn_gallery"
+RESET = {"op": "RESET"}
+
+
+class ChangeListener(threading.Thread):
+    """Thread d'écoute d'un canal NOTIFY, reconnecté automatiquement."""
+
+    def __init__(self, channel: str = CHANNEL, timeout: float = 5.0, retry: float = 2.0):
+        super().__init__(name="gallery-listener", daemon=True)
+        self.channel = channel
+        self.timeout = timeout
+        self.retry = retry
+        self.connected = threading.Event()
+        # Incrémentée à chaque (re)connexion : invalide les jetons de cache antérieurs
+        self.epoch = 0
+        self.cursor = None
+        self._subscribers = []
+        self._lock = threading.Lock()
+
+    def subscribe(self, callback) -> None:
+        """``callback(cursor, events)`` : lot de messages, ou ``events=None`` pour tout invalider."""
+        with self._lock:
+            if callback not in self._subscribers:
+                self._subscribers.append(callback)
+
+    def _dispatch(self, events) -> None:
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for callback in subscribers:
+            try:
+                callback(self.cursor, events)
+            except Exception as e:
+                print(f"Notification de la galerie non appliquée ({e})")
+
+    def run(self) -> None:
+        from . import connect
+
+        while True:
+            conn = None
+            try:
+                conn = connect()
+                self.cursor = conn.cursor()
+                self.cursor.execute(f"LISTEN {self.channel}")
+                self.epoch += 1
+                self._dispatch(None)
+                self.connected.set()
+                while True:
+                    if select.select([conn], [], [], self.timeout) == ([], [], []):
+                        continue
+                    conn.poll()
+                    if not conn.notifies:
+                        continue
+                    events = []
+                    for notify in conn.notifies:
+                        try:
+                            events.append(json.loads(notify.payload))
+                        except ValueError:
+                            continue
+                    conn.notifies.clear()
+                    if RESET in events:
+                        self.epoch += 1
+                        self._dispatch(None)
+                    elif events:
+                        self._dispatch(events)
+            except Exception as e:
+                print(f"Écoute des notifications interrompue ({e})")
+            finally:
+                self.connected.clear()
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+            sleep(self.retry)
+
+
+_listener = None
+_listener_lock = threading.Lock()
+
+
+def get_listener():
+    """Listener du processus (démarré au premier appel), ou None si DGSN_GALLERY_NOTIFY=0."""
+    global _listener
+    if not GALLERY_NOTIFY:
+        return None
+    with _listener_lock:
+        if _listener is None:
+            _listener = ChangeListener()
+            _listener.start()
+        return _listener
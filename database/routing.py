@@ -0,0 +1,108 @@
+"""Routage des lectures vers les réplicas, des écritures vers le primaire.
+
+Lecture de ses propres écritures : après une écriture, la session retient la
+position WAL du primaire (LSN). Ses lectures suivantes ne vont qu'à un réplica
+ayant rejoué au moins cette position ; sinon, elles passent par le primaire.
+"""
+import itertools
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import monotonic, sleep
+
+from psycopg2.pool import ThreadedConnectionPool
+
+from config import REPLICA_MAX_LAG_WAIT, REPLICA_POOL_SIZE
+
+_session_lsn = ContextVar("session_lsn", default=None)
+
+
+def session_lsn():
+    """Position WAL de la dernière écriture de la session courante (ou None)."""
+    return _session_lsn.get()
+
+
+def set_session_lsn(lsn) -> None:
+    """Restaure la position retenue pour la session (par exemple depuis ``st.session_state``)."""
+    _session_lsn.set(lsn)
+
+
+class ReplicaRouter:
+    """Pools de connexions vers les réplicas, choisis à tour de rôle."""
+
+    def __init__(self, dsns, pool_size: int = REPLICA_POOL_SIZE, max_lag_wait: float = REPLICA_MAX_LAG_WAIT):
+        self.dsns = list(dsns)
+        self.pool_size = pool_size
+        self.max_lag_wait = max_lag_wait
+        self._pools = {}
+        self._lock = threading.Lock()
+        self._next = itertools.count()
+
+    def _pool(self, dsn):
+        with self._lock:
+            if dsn not in self._pools:
+                self._pools[dsn] = ThreadedConnectionPool(1, self.pool_size, dsn)
+            return self._pools[dsn]
+
+    def _caught_up(self, conn, min_lsn) -> bool:
+        """Le réplica a-t-il rejoué ``min_lsn`` ? Attend au plus ``max_lag_wait``."""
+        if min_lsn is None:
+            return True
+        deadline = monotonic() + self.max_lag_wait
+        with conn.cursor() as cur:
+            while True:
+                # NULL hors réplication (instance autonome) : rien à attendre
+                cur.execute(
+                    "SELECT COALESCE(pg_last_wal_replay_lsn() >= %s::pg_lsn, TRUE)",
+                    (min_lsn,),
+                )
+                if cur.fetchone()[0]:
+                    return True
+                if monotonic() >= deadline:
+                    return False
+                sleep(0.01)
+
+    def acquire(self, min_lsn=None):
+        """(pool, connexion) d'un réplica à jour, ou None si aucun ne convient."""
+        start = next(self._next)
+        for k in range(len(self.dsns)):
+            dsn = self.dsns[(start + k) % len(self.dsns)]
+            try:
+                pool = self._pool(dsn)
+                conn = pool.getconn()
+            except Exception as e:
+                print(f"Réplica indisponible ({e})")
+                continue
+            try:
+                conn.autocommit = True
+                if self._caught_up(conn, min_lsn):
+                    return pool, conn
+                pool.putconn(conn)
+            except Exception as e:
+                print(f"Réplica indisponible ({e})")
+                pool.putconn(conn, close=True)
+        return None
+
+    @contextmanager
+    def cursor(self, fallback, min_lsn=None):
+        """Curseur sur un réplica à jour, sinon ``fallback`` (curseur du primaire)."""
+        acquired = self.acquire(min_lsn)
+        if acquired is None:
+            yield fallback
+            return
+        pool, conn = acquired
+        broken = False
+        try:
+            with conn.cursor() as cur:
+                yield cur
+        except Exception:
+            broken = bool(conn.closed)
+            raise
+        finally:
+            pool.putconn(conn, close=broken)
+
+    def close(self) -> None:
+        with self._lock:
+            for pool in self._pools.values():
+                pool.closeall()
+            self._pools.clear()
@@ -0,0 +1,368 @@
+"""Export et import de toute la galerie dans un format compact.
+
+Un export est un dossier :
+  manifest.json                 version du format, modèles, nombres de lignes
+  criminals.parquet             fiches (la photo principale est une référence au paquet)
+  photos.parquet                image_id, criminal_id, sha256, created_at
+  blobs.parquet + images.pack   images dédupliquées par contenu (sha256, offset, taille)
+  embeddings_<modèle>.npy       matrice float32 (projetable en mémoire)
+  embeddings_<modèle>.parquet   image_id, qualité, visage détecté (lignes de la matrice)
+  crime_types.parquet
+
+Les tables sont écrites en Parquet ou en Arrow IPC (pyarrow, dépendance optionnelle).
+L'import passe par COPY dans une seule transaction ; les identifiants sont décalés
+après ceux de la base cible. Les triggers par ligne y sont désactivés
+(``session_replication_role``, droits superutilisateur) : les autres instances
+reçoivent une seule notification qui vide leurs caches. Les embeddings ne sont
+importés que si la version du modèle est identique, sinon ils seront recalculés
+(python -m recognition.backfill).
+
+Usage : python -m database.transfer export <dossier> [--format parquet|arrow] [--models Facenet]
+        python -m database.transfer import <dossier> [--force-embeddings]
+"""
+import argparse
+import csv
+import hashlib
+import io
+import json
+import mmap
+import os
+from datetime import datetime
+
+import numpy as np
+
+from recognition.embeddings import from_bytes, model_version
+from recognition.templates import insert_templates, template_deltas
+from . import connect, transaction
+from .notifications import CHANNEL, RESET
+
+FORMAT_VERSION = 1
+CRIMINAL_COLUMNS = [
+    "nom", "prenom", "alias", "age", "date_naissance", "lieu_naissance", "nationalite",
+    "telephone", "adresse", "date_arrestation", "implication", "crime", "description",
+]
+NULL = r"\N"
+# Taille d'un bloc COPY (caractères du CSV, les images y sont encodées en hexadécimal)
+COPY_CHUNK_BYTES = 32 * 1024 * 1024
+FETCH_SIZE = 2000
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.feather
+        import pyarrow.parquet
+    except ImportError:
+        raise SystemExit("pyarrow est requis pour l'export/import de la galerie : pip install pyarrow")
+    return pyarrow
+
+
+def _extension(fmt: str) -> str:
+    return ".parquet" if fmt == "parquet" else ".arrow"
+
+
+def _write_table(path: str, columns: dict, fmt: str) -> None:
+    pa = _pyarrow()
+    table = pa.table(columns)
+    if fmt == "parquet":
+        pa.parquet.write_table(table, path, compression="zstd")
+    else:
+        pa.feather.write_feather(table, path, compression="zstd")
+
+
+def _read_table(path: str):
+    pa = _pyarrow()
+    if path.endswith(".parquet"):
+        return pa.parquet.read_table(path)
+    return pa.feather.read_table(path)
+
+
+def _rows(table):
+    """Lignes d'une table Arrow sous forme de dictionnaires, lot par lot."""
+    for batch in table.to_batches():
+        yield from batch.to_pylist()
+
+
+class BlobPack:
+    """Fichier d'images concaténées, chaque contenu n'étant écrit qu'une fois."""
+
+    def __init__(self, path: str):
+        self.file = open(path, "wb")
+        self.index = {}
+
+    def add(self, data: bytes) -> str:
+        digest = hashlib.sha256(data).hexdigest()
+        if digest not in self.index:
+            self.index[digest] = (self.file.tell(), len(data))
+            self.file.write(data)
+        return digest
+
+    def close(self) -> None:
+        self.file.close()
+
+
+def _stream(conn, name: str, query: str, params=()):
+    """Curseur côté serveur : les photos ne sont jamais toutes en mémoire."""
+    with conn.cursor(name=name) as cur:
+        cur.itersize = FETCH_SIZE
+        cur.execute(query, params)
+        yield from cur
+
+
+def export_gallery(directory: str, fmt: str = "parquet", models=("Facenet",), progress=print) -> dict:
+    """Écrit la galerie dans ``directory`` et retourne le manifeste."""
+    _pyarrow()
+    os.makedirs(directory, exist_ok=True)
+    ext = _extension(fmt)
+    conn = connect(autocommit=False)
+    try:
+        # Un seul instantané pour toutes les lectures : tables cohérentes entre elles,
+        # et le nombre d'embeddings compté est celui qui sera lu
+        conn.set_session(isolation_level="REPEATABLE READ", readonly=True)
+        cur = conn.cursor()
+        pack = BlobPack(os.path.join(directory, "images.pack"))
+
+        records = {"id": [], **{c: [] for c in CRIMINAL_COLUMNS}, "image_sha256": []}
+        for row in _stream(conn, "export_criminals", f"SELECT id, {', '.join(CRIMINAL_COLUMNS)}, image FROM criminals ORDER BY id"):
+            for column, value in zip(["id", *CRIMINAL_COLUMNS], row[:-1]):
+                records[column].append(value)
+            records["image_sha256"].append(pack.add(bytes(row[-1])) if row[-1] is not None else None)
+        _write_table(os.path.join(directory, "criminals" + ext), records, fmt)
+        progress(f"{len(records['id'])} fiche(s)")
+
+        photos = {"image_id": [], "criminal_id": [], "sha256": [], "created_at": []}
+        for image_id, criminal_id, image, created_at in _stream(
+            conn, "export_photos", "SELECT id, criminal_id, image, created_at FROM images_criminels ORDER BY id"
+        ):
+            photos["image_id"].append(image_id)
+            photos["criminal_id"].append(criminal_id)
+            photos["sha256"].append(pack.add(bytes(image)))
+            photos["created_at"].append(created_at)
+        pack.close()
+        _write_table(os.path.join(directory, "photos" + ext), photos, fmt)
+        blobs = {
+            "sha256": list(pack.index),
+            "offset": [offset for offset, _ in pack.index.values()],
+            "length": [length for _, length in pack.index.values()],
+        }
+        _write_table(os.path.join(directory, "blobs" + ext), blobs, fmt)
+        progress(f"{len(photos['image_id'])} photo(s), {len(pack.index)} image(s) distincte(s)")
+
+        cur.execute("SELECT name FROM crime_types ORDER BY name")
+        _write_table(os.path.join(directory, "crime_types" + ext), {"name": [r[0] for r in cur.fetchall()]}, fmt)
+
+        manifest_models = {}
+        for model_name in models:
+            exported = _export_embeddings(conn, cur, directory, model_name, fmt)
+            if exported:
+                manifest_models[model_name] = exported
+                progress(f"{exported['rows']} embedding(s) {model_name}")
+    finally:
+        conn.rollback()
+        conn.close()
+
+    manifest = {
+        "format_version": FORMAT_VERSION,
+        "created_at": datetime.now().isoformat(),
+        "records_format": fmt,
+        "criminals": len(records["id"]),
+        "photos": len(photos["image_id"]),
+        "blobs": len(blobs["sha256"]),
+        "models": manifest_models,
+    }
+    with open(os.path.join(directory, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    return manifest
+
+
+def _export_embeddings(conn, cur, directory: str, model_name: str, fmt: str):
+    cur.execute(
+        "SELECT COUNT(*), MAX(octet_length(embedding)) FROM embeddings_criminels WHERE model_name = %s",
+        (model_name,),
+    )
+    count, size = cur.fetchone()
+    if not count or not size:
+        return None
+    dim = size // 4
+    matrix = np.lib.format.open_memmap(
+        os.path.join(directory, f"embeddings_{model_name}.npy"), mode="w+", dtype=np.float32, shape=(count, dim)
+    )
+    rows = {"image_id": [], "quality": [], "has_face": []}
+    query = (
+        "SELECT image_id, embedding, quality FROM embeddings_criminels "
+        "WHERE model_name = %s ORDER BY image_id"
+    )
+    for i, (image_id, embedding, quality) in enumerate(_stream(conn, "export_embeddings", query, (model_name,))):
+        rows["image_id"].append(image_id)
+        rows["quality"].append(float(quality))
+        rows["has_face"].append(embedding is not None)
+        if embedding is not None:
+            matrix[i] = from_bytes(embedding)
+    matrix.flush()
+    del matrix
+    _write_table(os.path.join(directory, f"embeddings_{model_name}" + _extension(fmt)), rows, fmt)
+    return {"version": model_version(model_name), "dim": int(dim), "rows": int(count)}
+
+
+def _csv_value(value):
+    if value is None:
+        return NULL
+    if isinstance(value, (bytes, memoryview)):
+        return "\\x" + bytes(value).hex()
+    return value
+
+
+def _copy(cur, table: str, columns, rows) -> int:
+    """COPY de ``rows`` par blocs d'environ ``COPY_CHUNK_BYTES`` (CSV en mémoire, NULL explicite)."""
+    sql = f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv, NULL '{NULL}')"
+    total = 0
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([_csv_value(v) for v in row])
+        total += 1
+        if buffer.tell() >= COPY_CHUNK_BYTES:
+            buffer.seek(0)
+            cur.copy_expert(sql, buffer)
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+    if buffer.tell():
+        buffer.seek(0)
+        cur.copy_expert(sql, buffer)
+    return total
+
+
+def import_gallery(directory: str, force_embeddings: bool = False, progress=print) -> dict:
+    """Ajoute la galerie exportée dans ``directory`` à la base. Retourne un résumé."""
+    with open(os.path.join(directory, "manifest.json"), encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("format_version") != FORMAT_VERSION:
+        raise ValueError(f"Format d'export non pris en charge : {manifest.get('format_version')}")
+    ext = _extension(manifest["records_format"])
+
+    blobs = {
+        row["sha256"]: (row["offset"], row["length"])
+        for row in _rows(_read_table(os.path.join(directory, "blobs" + ext)))
+    }
+    summary = {"criminals": 0, "photos": 0, "embeddings": {}, "skipped_models": []}
+    conn = connect()
+    pack_file = open(os.path.join(directory, "images.pack"), "rb")
+    pack = mmap.mmap(pack_file.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(pack_file.name) else b""
+
+    def blob(digest):
+        if digest is None:
+            return None
+        offset, length = blobs[digest]
+        return pack[offset:offset + length]
+
+    try:
+        cur = conn.cursor()
+        with transaction(cur):
+            cur.execute("LOCK TABLE criminals, images_criminels IN SHARE ROW EXCLUSIVE MODE")
+            # Triggers par ligne (journal, NOTIFY) désactivés pour cette seule session :
+            # remplacés ci-dessous par une écriture groupée de chaque effet.
+            cur.execute("SET LOCAL session_replication_role = replica")
+            cur.execute("SELECT COALESCE(MAX(id), 0) FROM criminals")
+            criminal_shift = cur.fetchone()[0]
+            cur.execute("SELECT COALESCE(MAX(id), 0) FROM images_criminels")
+            image_shift = cur.fetchone()[0]
+
+            names = [row["name"] for row in _rows(_read_table(os.path.join(directory, "crime_types" + ext)))]
+            if names:
+                cur.execute(
+                    "INSERT INTO crime_types (name) SELECT unnest(%s::varchar[]) ON CONFLICT (name) DO NOTHING",
+                    (names,),
+                )
+
+            summary["criminals"] = _copy(
+                cur, "criminals", ["id", *CRIMINAL_COLUMNS, "image"],
+                (
+                    [row["id"] + criminal_shift, *(row[c] for c in CRIMINAL_COLUMNS), blob(row["image_sha256"])]
+                    for row in _rows(_read_table(os.path.join(directory, "criminals" + ext)))
+                ),
+            )
+            progress(f"{summary['criminals']} fiche(s) importée(s)")
+
+            owners = {}
+            photos = _read_table(os.path.join(directory, "photos" + ext))
+
+            def photo_rows():
+                for row in _rows(photos):
+                    owners[row["image_id"]] = row["criminal_id"] + criminal_shift
+                    yield [row["image_id"] + image_shift, owners[row["image_id"]], blob(row["sha256"]), row["created_at"]]
+
+            summary["photos"] = _copy(cur, "images_criminels", ["id", "criminal_id", "image", "created_at"], photo_rows())
+            progress(f"{summary['photos']} photo(s) importée(s)")
+
+            for model_name, info in manifest.get("models", {}).items():
+                if info["version"] != model_version(model_name) and not force_embeddings:
+                    summary["skipped_models"].append(model_name)
+                    progress(f"{model_name} : {info['version']} ≠ {model_version(model_name)}, embeddings à recalculer")
+                    continue
+                summary["embeddings"][model_name] = _import_embeddings(
+                    cur, directory, model_name, ext, owners, image_shift
+                )
+
+            for table in ("criminals", "images_criminels"):
+                cur.execute(
+                    f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), GREATEST((SELECT MAX(id) FROM {table}), 1))"
+                )
+            # Une ligne de journal par criminel importé (tous modèles), une version, une notification
+            cur.execute(
+                "INSERT INTO gallery_changes (criminal_id) SELECT id FROM criminals WHERE id > %s",
+                (criminal_shift,),
+            )
+            cur.execute("UPDATE gallery_version SET version = version + 1")
+            cur.execute("SELECT pg_notify(%s, %s)", (CHANNEL, json.dumps(RESET)))
+    finally:
+        if isinstance(pack, mmap.mmap):
+            pack.close()
+        pack_file.close()
+        conn.close()
+    return summary
+
+
+def _import_embeddings(cur, directory: str, model_name: str, ext: str, owners, image_shift: int) -> int:
+    matrix = np.load(os.path.join(directory, f"embeddings_{model_name}.npy"), mmap_mode="r")
+    rows = list(_rows(_read_table(os.path.join(directory, f"embeddings_{model_name}" + ext))))
+    count = _copy(
+        cur, "embeddings_criminels", ["image_id", "model_name", "embedding", "quality"],
+        (
+            [row["image_id"] + image_shift, model_name,
+             np.asarray(matrix[i], dtype=np.float32).tobytes() if row["has_face"] else None, row["quality"]]
+            for i, row in enumerate(rows)
+        ),
+    )
+    # Criminels nouveaux : gabarits insérés d'un bloc plutôt que par mises à jour successives
+    insert_templates(cur, model_name, template_deltas(
+        (owners[row["image_id"]], matrix[i], row["quality"])
+        for i, row in enumerate(rows) if row["has_face"] and row["image_id"] in owners
+    ))
+    return count
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Export/import de la galerie")
+    sub = parser.add_subparsers(dest="command", required=True)
+    export_cmd = sub.add_parser("export", help="Exporte la galerie dans un dossier")
+    export_cmd.add_argument("directory")
+    export_cmd.add_argument("--format", choices=["parquet", "arrow"], default="parquet")
+    export_cmd.add_argument("--models", nargs="+", default=["Facenet"])
+    import_cmd = sub.add_parser("import", help="Importe un export dans la base")
+    import_cmd.add_argument("directory")
+    import_cmd.add_argument("--force-embeddings", action="store_true",
+                            help="Importe les embeddings même si la version du modèle diffère")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        manifest = export_gallery(args.directory, args.format, args.models)
+        print(f"Export terminé : {manifest['criminals']} fiche(s), {manifest['photos']} photo(s) -> {args.directory}")
+    else:
+        summary = import_gallery(args.directory, args.force_embeddings)
+        print(f"Import terminé : {summary['criminals']} fiche(s), {summary['photos']} photo(s)")
+        if summary["skipped_models"]:
+            print(f"Embeddings à recalculer : python -m recognition.backfill --model {summary['skipped_models'][0]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,4 @@
+"""Ingestion des dossiers surveillés : identification et enregistrement automatiques."""
+from .watcher import FolderWatcher, parse_folders, process_batch
+
+__all__ = ["FolderWatcher", "parse_folders", "process_batch"]
@@ -0,0 +1,391 @@
+"""Démon d'ingestion des dossiers surveillés (caméras, postes frontières).
+
+Usage : python -m ingest.watcher [--folder CHEMIN ...] [--enroll CHEMIN ...] [--model Facenet]
+        [--batch-size 64] [--poll-interval 1.0] [--keep]
+
+Sans --folder/--enroll, les dossiers de DGSN_WATCH_FOLDERS sont surveillés. Les
+images déposées sont traitées par lots selon le mode du dossier :
+  identify  comparaison à la galerie ; les correspondances sous le seuil sont
+            écrites dans la table ``alerts``
+  enroll    une fiche par image (champs lus dans ``<image>.json`` s'il existe,
+            sinon le nom du fichier sert de nom)
+
+Un contenu n'est traité qu'une fois (empreinte SHA-256, table ``ingested_files``),
+même si plusieurs démons surveillent le même dossier. Les fichiers traités sont
+déplacés dans le sous-dossier ``traites`` (sauf --keep). La surveillance passe
+par inotify (paquet optionnel inotify_simple), sinon par scrutation : un fichier
+est pris quand sa taille et sa date n'ont pas changé entre deux passages.
+"""
+import argparse
+import hashlib
+import io
+import json
+import os
+import signal
+import socket
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+from psycopg2.extras import execute_values
+
+from config import ENCODE_WORKERS, WATCH_BATCH_SIZE, WATCH_FOLDERS, WATCH_POLL_INTERVAL
+
+MODES = ("identify", "enroll")
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+DONE_DIR = "traites"
+# Utilisateur des recherches du démon dans le journal d'audit
+AUDIT_USER = f"ingest:{socket.gethostname()}"
+# Réservation d'un démon arrêté en cours de lot : reprise après ce délai (s)
+STALE_CLAIM_S = 600
+CRIMINAL_FIELDS = (
+    "nom", "prenom", "alias", "age", "date_naissance", "lieu_naissance", "nationalite",
+    "telephone", "adresse", "date_arrestation", "implication", "crime", "description",
+)
+
+
+def parse_folders(spec: str):
+    """[(chemin absolu, mode)] depuis ``"chemin=mode,chemin"`` (mode identify par défaut)."""
+    folders = []
+    for item in spec.split(","):
+        if not item.strip():
+            continue
+        path, _, mode = item.strip().rpartition("=") if "=" in item else (item.strip(), "", "identify")
+        if mode not in MODES:
+            raise ValueError(f"Mode inconnu pour {path} : {mode}")
+        folders.append((os.path.abspath(path), mode))
+    return folders
+
+
+def _is_image(name: str) -> bool:
+    return name.lower().endswith(IMAGE_EXTENSIONS)
+
+
+class FolderWatcher:
+    """Fichiers complets à traiter dans les dossiers surveillés, sous forme (chemin, mode)."""
+
+    def __init__(self, folders, poll_interval: float = WATCH_POLL_INTERVAL):
+        self.folders = dict(folders)
+        self.poll_interval = poll_interval
+        self._sizes = {}
+        self._handed = {}
+        self._retry = []
+        self._scanned = False
+        self._inotify, self._watches = self._open_inotify()
+
+    def _open_inotify(self):
+        try:
+            from inotify_simple import INotify, flags
+        except ImportError:
+            return None, {}
+        inotify = INotify()
+        watches = {
+            inotify.add_watch(path, flags.CLOSE_WRITE | flags.MOVED_TO): path for path in self.folders
+        }
+        return inotify, watches
+
+    @property
+    def method(self) -> str:
+        return "inotify" if self._inotify is not None else "scrutation"
+
+    def poll(self):
+        """Fichiers prêts ; attend au plus ``poll_interval`` s'il n'y en a aucun."""
+        ready, self._retry = self._retry, []
+        if self._inotify is not None and self._scanned:
+            for event in self._inotify.read(timeout=0 if ready else int(self.poll_interval * 1000)):
+                folder = self._watches.get(event.wd)
+                if folder is not None and _is_image(event.name):
+                    ready.append((os.path.join(folder, event.name), self.folders[folder]))
+            return ready
+        # Scrutation, ou fichiers déjà présents au démarrage avec inotify
+        ready += self._scan(settled=self._inotify is None)
+        self._scanned = True
+        if not ready and self._inotify is None:
+            time.sleep(self.poll_interval)
+        return ready
+
+    def _scan(self, settled: bool):
+        sizes, ready = {}, []
+        for folder, mode in self.folders.items():
+            try:
+                entries = list(os.scandir(folder))
+            except OSError as e:
+                print(f"Dossier {folder} illisible : {e}")
+                continue
+            for entry in entries:
+                if not entry.is_file() or not _is_image(entry.name):
+                    continue
+                st = entry.stat()
+                signature = (st.st_size, st.st_mtime_ns)
+                sizes[entry.path] = signature
+                if self._handed.get(entry.path) == signature:
+                    continue
+                if not settled or self._sizes.get(entry.path) == signature:
+                    self._handed[entry.path] = signature
+                    ready.append((entry.path, mode))
+        self._sizes = sizes
+        # Les fichiers déplacés ou supprimés sont oubliés
+        self._handed = {path: sig for path, sig in self._handed.items() if path in sizes}
+        return ready
+
+    def retry(self, items) -> None:
+        """Remet des fichiers dont le traitement a échoué dans le prochain ``poll``."""
+        self._retry.extend(items)
+
+
+def _read(item):
+    path, mode = item
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except OSError as e:
+        print(f"Lecture impossible de {path} : {e}")
+        return None
+    return {"path": path, "mode": mode, "data": data, "sha256": hashlib.sha256(data).hexdigest()}
+
+
+def _destination(record: dict, keep: bool) -> str:
+    """Chemin final du fichier : déplacé dans ``traites`` sous un nom préfixé par son empreinte."""
+    if keep:
+        return record["path"]
+    folder, name = os.path.split(record["path"])
+    return os.path.join(folder, DONE_DIR, f"{record['sha256'][:16]}_{name}")
+
+
+def _claim(cursor, records):
+    """Réserve les empreintes inconnues (ou abandonnées) ; retourne celles obtenues par ce démon."""
+    if not records:
+        return set()
+    claimed = execute_values(
+        cursor,
+        f"""
+        INSERT INTO ingested_files (sha256, path, folder, mode) VALUES %s
+        ON CONFLICT (sha256) DO UPDATE
+        SET path = EXCLUDED.path, folder = EXCLUDED.folder, mode = EXCLUDED.mode, created_at = NOW()
+        WHERE ingested_files.status = 'pending'
+          AND ingested_files.created_at < NOW() - INTERVAL '{STALE_CLAIM_S} seconds'
+        RETURNING sha256
+        """,
+        [(r["sha256"], r["final"], os.path.dirname(r["path"]), r["mode"]) for r in records],
+        fetch=True,
+    )
+    return {row[0] for row in claimed}
+
+
+def _set_statuses(cursor, statuses) -> None:
+    """Enregistre {empreinte: (statut, criminel)} : ces fichiers sont traités."""
+    if not statuses:
+        return
+    execute_values(
+        cursor,
+        """
+        UPDATE ingested_files f
+        SET status = v.status, criminal_id = v.criminal_id, processed_at = NOW()
+        FROM (VALUES %s) AS v(sha256, status, criminal_id)
+        WHERE f.sha256 = v.sha256
+        """,
+        [(sha, status, criminal_id) for sha, (status, criminal_id) in statuses.items()],
+        template="(%s, %s, %s::integer)",
+    )
+
+
+def _identify(cursor, records, model_name: str, threshold: float, top_k: int):
+    """Compare les images à la galerie, écrit les alertes et les statuts ; {empreinte: (statut, criminel)}."""
+    from audit import audit_event
+    from database import transaction
+    from recognition import embed_images
+    from utils import search_gallery
+
+    vectors = embed_images([r["data"] for r in records], model_name)
+    found = [i for i, vec in enumerate(vectors) if vec is not None]
+    matches = search_gallery(cursor, model_name, [vectors[i] for i in found], threshold, top_k)[0] if found else []
+    statuses = {r["sha256"]: ("no_face", None) for r in records}
+    alerts = []
+    for i, candidates in zip(found, matches):
+        record = records[i]
+        statuses[record["sha256"]] = ("alert", candidates[0][0]) if candidates else ("no_match", None)
+        alerts += [
+            (record["sha256"], record["final"], os.path.dirname(record["path"]), cid, image_id,
+             model_name, float(dist), round((1 - float(dist)) * 100, 2))
+            for cid, image_id, dist in candidates
+        ]
+    # Alertes et statuts dans une même transaction : un lot repris n'écrit pas deux fois ses alertes
+    with transaction() as cur:
+        if alerts:
+            execute_values(
+                cur,
+                """
+                INSERT INTO alerts (sha256, path, folder, criminal_id, image_id, model_name, distance, similarity)
+                VALUES %s
+                """,
+                alerts,
+            )
+        _set_statuses(cur, statuses)
+    for i, candidates in zip(found, matches):
+        record = records[i]
+        audit_event("face_search", AUDIT_USER, details={
+            "probe": record["sha256"], "photos": 1, "path": record["final"], "via": "ingest",
+            "matches": sorted({cid for cid, _, _ in candidates}),
+        })
+    return statuses
+
+
+def _sidecar(path: str) -> dict:
+    """Champs de la fiche : ``<image>.json`` s'il existe, nom du fichier sinon."""
+    data = dict.fromkeys(CRIMINAL_FIELDS)
+    try:
+        with open(os.path.splitext(path)[0] + ".json", encoding="utf-8") as f:
+            data.update((k, v) for k, v in json.load(f).items() if k in CRIMINAL_FIELDS)
+    except FileNotFoundError:
+        pass
+    data["nom"] = data["nom"] or os.path.splitext(os.path.basename(path))[0]
+    return data
+
+
+def _enroll(cursor, records, model_name: str, statuses: dict):
+    """Une fiche par image ; chaque statut est écrit dès l'enregistrement de sa fiche.
+
+    ``statuses`` ({empreinte: (statut, criminel)}) est complété au fur et à mesure :
+    après un échec, il contient les fichiers déjà traités.
+    """
+    from database import insert_criminal
+    from recognition import embed_images
+    from utils import encode_images
+
+    images, invalid = [], {}
+    for record in records:
+        try:
+            images.append((record, Image.open(io.BytesIO(record["data"])).convert("RGB")))
+        except Exception:
+            invalid[record["sha256"]] = ("invalid", None)
+    _set_statuses(cursor, invalid)
+    statuses.update(invalid)
+    encoded = encode_images([img for _, img in images])
+    embeddings = embed_images([full for full, _ in encoded], model_name, with_quality=True)
+    for (record, img), enc, emb in zip(images, encoded, embeddings):
+        criminal_id = insert_criminal(_sidecar(record["path"]), [img], model_name, embeddings=[emb], encoded=[enc])
+        status = {record["sha256"]: ("enrolled", criminal_id)}
+        _set_statuses(cursor, status)
+        statuses.update(status)
+
+
+def _move(record: dict) -> None:
+    if record["final"] == record["path"]:
+        return
+    try:
+        os.makedirs(os.path.dirname(record["final"]), exist_ok=True)
+        os.replace(record["path"], record["final"])
+        sidecar = os.path.splitext(record["path"])[0] + ".json"
+        if os.path.exists(sidecar):
+            os.replace(sidecar, os.path.splitext(record["final"])[0] + ".json")
+    except OSError as e:
+        print(f"Déplacement impossible de {record['path']} : {e}")
+
+
+def process_batch(cursor, items, model_name: str, threshold: float, top_k: int = 3,
+                  keep: bool = False, reader=None) -> dict:
+    """Traite un lot [(chemin, mode)] ; retourne le nombre de fichiers par statut.
+
+    Le statut d'un fichier est écrit dès qu'il est traité. En cas d'échec, seules
+    les empreintes réservées et pas encore traitées sont libérées, et l'exception
+    remonte : le lot pourra être repris sans doublon. Sont déplacés les fichiers
+    traités par ce démon et les copies d'un contenu déjà traité ; ceux qu'un autre
+    démon a réservés restent en place.
+    """
+    records = [r for r in (reader or map)(_read, items) if r is not None]
+    unique = {}
+    for record in records:
+        record["final"] = _destination(record, keep)
+        unique.setdefault(record["sha256"], record)
+    claimed = _claim(cursor, list(unique.values()))
+    todo = [r for sha, r in unique.items() if sha in claimed]
+    statuses = {}
+    try:
+        identify = [r for r in todo if r["mode"] == "identify"]
+        if identify:
+            statuses.update(_identify(cursor, identify, model_name, threshold, top_k))
+        enroll = [r for r in todo if r["mode"] == "enroll"]
+        if enroll:
+            _enroll(cursor, enroll, model_name, statuses)
+    except Exception:
+        released = list(claimed - set(statuses))
+        cursor.execute(
+            "DELETE FROM ingested_files WHERE sha256 = ANY(%s) AND status = 'pending'", (released,)
+        )
+        for record in records:
+            if record["sha256"] in statuses:
+                _move(record)
+        raise
+    others = list(set(unique) - claimed)
+    done = set()
+    if others:
+        cursor.execute(
+            "SELECT sha256 FROM ingested_files WHERE sha256 = ANY(%s) AND status <> 'pending'", (others,)
+        )
+        done = {row[0] for row in cursor.fetchall()}
+    counts = {"duplicate": len(records) - len(todo)}
+    for record in records:
+        if record["sha256"] in statuses or record["sha256"] in done:
+            _move(record)
+        elif record["sha256"] not in claimed:
+            counts["claimed_elsewhere"] = counts.get("claimed_elsewhere", 0) + 1
+    counts["duplicate"] -= counts.get("claimed_elsewhere", 0)
+    for status, _ in statuses.values():
+        counts[status] = counts.get(status, 0) + 1
+    return counts
+
+
+def run(folders, model_name: str = "Facenet", batch_size: int = WATCH_BATCH_SIZE,
+        poll_interval: float = WATCH_POLL_INTERVAL, keep: bool = False, top_k: int = 3) -> None:
+    from database import cursor
+    from recognition import match_threshold
+    from utils import initialize_deepface
+
+    if not cursor:
+        raise SystemExit("Base de données indisponible")
+    initialize_deepface()
+    stopping = []
+    signal.signal(signal.SIGTERM, lambda *_: stopping.append(True))
+    watcher = FolderWatcher(folders, poll_interval)
+    threshold = match_threshold(model_name)
+    print(f"Surveillance ({watcher.method}) : " + ", ".join(f"{path} [{mode}]" for path, mode in folders))
+    with ThreadPoolExecutor(max_workers=ENCODE_WORKERS) as reader:
+        while not stopping:
+            pending = watcher.poll()
+            for start in range(0, len(pending), batch_size):
+                batch = pending[start:start + batch_size]
+                t0 = time.perf_counter()
+                try:
+                    counts = process_batch(cursor, batch, model_name, threshold, top_k, keep, reader.map)
+                except Exception:
+                    traceback.print_exc()
+                    # Les fichiers déjà traités ont été déplacés
+                    watcher.retry([item for item in pending[start:] if os.path.exists(item[0])])
+                    time.sleep(poll_interval)
+                    break
+                summary = ", ".join(f"{n} {status}" for status, n in sorted(counts.items()) if n)
+                print(f"{len(batch)} fichier(s) en {time.perf_counter() - t0:.2f} s : {summary}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Surveillance de dossiers : identification et enregistrement automatiques")
+    parser.add_argument("--folder", action="append", default=[], help="Dossier à identifier (répétable)")
+    parser.add_argument("--enroll", action="append", default=[], help="Dossier d'enregistrement (répétable)")
+    parser.add_argument("--model", default="Facenet")
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--batch-size", type=int, default=WATCH_BATCH_SIZE)
+    parser.add_argument("--poll-interval", type=float, default=WATCH_POLL_INTERVAL)
+    parser.add_argument("--keep", action="store_true", help="Laisser les fichiers traités en place")
+    args = parser.parse_args()
+
+    folders = [(os.path.abspath(p), "identify") for p in args.folder]
+    folders += [(os.path.abspath(p), "enroll") for p in args.enroll]
+    folders = folders or parse_folders(WATCH_FOLDERS)
+    if not folders:
+        parser.error("aucun dossier à surveiller (--folder, --enroll ou DGSN_WATCH_FOLDERS)")
+    run(folders, args.model, args.batch_size, args.poll_interval, args.keep, args.top_k)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,22 @@
+"""Tâches en arrière-plan : file durable PostgreSQL et workers."""
+from .queue import (
+    JobCancelled,
+    JobLost,
+    submit_job,
+    get_job,
+    list_jobs,
+    cancel_job,
+    ACTIVE_STATES,
+    FINAL_STATES,
+)
+
+__all__ = [
+    "JobCancelled",
+    "JobLost",
+    "submit_job",
+    "get_job",
+    "list_jobs",
+    "cancel_job",
+    "ACTIVE_STATES",
+    "FINAL_STATES",
+]
@@ -0,0 +1,84 @@
+"""Handlers des types de tâches, exécutés par ``jobs.worker``."""
+import io
+
+from PIL import Image
+
+HANDLERS = {}
+
+
+def handler(kind: str):
+    """Enregistre la fonction comme handler des tâches ``kind``."""
+    def decorator(fn):
+        HANDLERS[kind] = fn
+        return fn
+    return decorator
+
+
+@handler("search")
+def run_search(job):
+    from database import cursor
+    from utils import find_match_fused, find_match_stream, serialize_match
+
+    params = job.payload
+    job.progress(0.0, "Comparaison avec la galerie", force=True)
+    if params.get("fusion"):
+        # Plusieurs photos d'une même personne : un seul classement fusionné
+        results, _ = find_match_fused(
+            [Image.open(io.BytesIO(data)) for data in job.inputs],
+            cursor,
+            model_name=params.get("model_name", "Facenet"),
+            threshold=float(params["threshold"]) if params.get("threshold") is not None else None,
+            top_k=int(params.get("top_k", 3)),
+            fusion=params["fusion"],
+            filters=params.get("filters"),
+        )
+        job.progress(0.95, "Préparation des résultats", force=True)
+        return {"results": [serialize_match(r) for r in results]}
+    img = Image.open(io.BytesIO(job.inputs[0])).convert("RGB")
+    results = []
+    # Une mise à jour par partition de la galerie (ou réponse de shard) : avancement et annulation
+    for partition, (results, _) in enumerate(find_match_stream(
+        img,
+        cursor,
+        model_name=params.get("model_name", "Facenet"),
+        threshold=float(params["threshold"]) if params.get("threshold") is not None else None,
+        top_k=int(params.get("top_k", 3)),
+        filters=params.get("filters"),
+    ), 1):
+        job.progress(0.9 * partition / (partition + 1), f"Partition {partition} : {len(results)} correspondance(s)")
+    job.progress(0.95, "Préparation des résultats", force=True)
+    return {"results": [serialize_match(r) for r in results]}
+
+
+@handler("enroll")
+def run_enroll(job):
+    from database import insert_criminal
+
+    # Tentative précédente interrompue après son COMMIT : le dossier existe déjà
+    previous = job.checkpointed()
+    if previous:
+        return previous
+    job.progress(0.1, "Lecture des photos", force=True)
+    images = [Image.open(io.BytesIO(b)) for b in job.inputs]
+    job.progress(0.3, "Enregistrement", force=True)
+    # Identifiant enregistré sur la tâche dans la transaction de l'enregistrement
+    criminal_id = insert_criminal(
+        job.payload["criminal"], images,
+        on_insert=lambda cur, cid: job.checkpoint(cur, {"id": cid, "photos": len(images)}),
+    )
+    return {"id": criminal_id, "photos": len(images)}
+
+
+@handler("dedup")
+def run_dedup(job):
+    from database import cursor
+    from recognition.dedup import DEFAULT_THRESHOLD, build_report
+
+    params = job.payload
+    job.progress(0.0, "Comparaison de toutes les photos", force=True)
+    return build_report(
+        cursor,
+        model_name=params.get("model_name", "Facenet"),
+        threshold=float(params.get("threshold", DEFAULT_THRESHOLD)),
+        progress=lambda done, total: job.progress(done / total, f"Bloc {done}/{total}"),
+    )
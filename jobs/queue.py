@@ -0,0 +1,246 @@
+"""File de tâches durable stockée dans la table ``jobs`` de PostgreSQL.
+
+Les fonctions prennent le curseur en paramètre : l'interface utilise le curseur
+partagé, chaque worker sa propre connexion.
+"""
+import json
+import threading
+from contextlib import contextmanager
+from time import monotonic
+
+import psycopg2
+from psycopg2.extras import Json
+
+CHANNEL = "dgsn_jobs"
+ACTIVE_STATES = ("queued", "running")
+FINAL_STATES = ("succeeded", "failed", "cancelled")
+# Tentatives au-delà desquelles une tâche qui fait tomber son worker est abandonnée
+MAX_ATTEMPTS = 3
+
+JOB_COLUMNS = [
+    "id", "kind", "status", "payload", "progress", "message", "result", "error",
+    "cancel_requested", "created_by", "worker", "attempts", "created_at", "started_at", "finished_at",
+]
+
+
+class JobCancelled(Exception):
+    """Levée dans une tâche dont l'annulation a été demandée."""
+
+
+class JobLost(Exception):
+    """Levée quand la tâche a été reprise par un autre worker (ou n'est plus en cours)."""
+
+
+def _json(value):
+    return Json(value, dumps=lambda o: json.dumps(o, default=str))
+
+
+def submit_job(cursor, kind: str, payload: dict = None, inputs=(), created_by: str = None) -> int:
+    """Ajoute une tâche à la file et réveille les workers en attente."""
+    cursor.execute(
+        "INSERT INTO jobs (kind, payload, inputs, created_by) VALUES (%s, %s, %s::bytea[], %s) RETURNING id",
+        (kind, _json(payload or {}), [psycopg2.Binary(b) for b in inputs], created_by),
+    )
+    job_id = cursor.fetchone()[0]
+    cursor.execute("SELECT pg_notify(%s, %s)", (CHANNEL, str(job_id)))
+    return job_id
+
+
+def get_job(cursor, job_id: int):
+    cursor.execute(f"SELECT {', '.join(JOB_COLUMNS)} FROM jobs WHERE id = %s", (job_id,))
+    row = cursor.fetchone()
+    return dict(zip(JOB_COLUMNS, row)) if row else None
+
+
+def list_jobs(cursor, created_by: str = None, limit: int = 20):
+    """Dernières tâches d'un utilisateur (de tous si ``created_by`` est None)."""
+    cursor.execute(
+        f"""
+        SELECT {', '.join(JOB_COLUMNS)} FROM jobs
+        WHERE %(user)s IS NULL OR created_by = %(user)s
+        ORDER BY id DESC LIMIT %(limit)s
+        """,
+        {"user": created_by, "limit": limit},
+    )
+    return [dict(zip(JOB_COLUMNS, row)) for row in cursor.fetchall()]
+
+
+def cancel_job(cursor, job_id: int) -> bool:
+    """Annule une tâche en attente, ou demande l'arrêt d'une tâche en cours."""
+    cursor.execute(
+        """
+        UPDATE jobs SET
+            cancel_requested = TRUE,
+            status = CASE WHEN status = 'queued' THEN 'cancelled' ELSE status END,
+            finished_at = CASE WHEN status = 'queued' THEN NOW() ELSE finished_at END
+        WHERE id = %s AND status IN ('queued', 'running')
+        """,
+        (job_id,),
+    )
+    return cursor.rowcount > 0
+
+
+def claim_job(cursor, worker: str):
+    """Réserve la plus ancienne tâche en attente. Retourne (id, kind, payload, inputs) ou None."""
+    cursor.execute(
+        """
+        UPDATE jobs SET status = 'running', worker = %s, attempts = attempts + 1,
+            started_at = NOW(), heartbeat_at = NOW()
+        WHERE id = (
+            SELECT id FROM jobs WHERE status = 'queued'
+            ORDER BY id FOR UPDATE SKIP LOCKED LIMIT 1
+        )
+        RETURNING id, kind, payload, inputs
+        """,
+        (worker,),
+    )
+    row = cursor.fetchone()
+    if not row:
+        return None
+    job_id, kind, payload, inputs = row
+    return job_id, kind, payload, [bytes(b) for b in (inputs or [])]
+
+
+def finish_job(cursor, job_id: int, worker: str, status: str, result=None, error: str = None) -> bool:
+    """Termine la tâche si ``worker`` la détient encore. Retourne False si elle a été reprise."""
+    cursor.execute(
+        """
+        UPDATE jobs SET status = %s, result = %s, error = %s, finished_at = NOW(),
+            progress = CASE WHEN %s = 'succeeded' THEN 1 ELSE progress END
+        WHERE id = %s AND worker = %s AND status = 'running'
+        """,
+        (status, _json(result) if result is not None else None, error, status, job_id, worker),
+    )
+    return cursor.rowcount > 0
+
+
+def requeue_stale(cursor, timeout_s: float, max_attempts: int = MAX_ATTEMPTS) -> int:
+    """Remet en file les tâches dont le worker ne donne plus signe de vie.
+
+    Une tâche déjà tentée ``max_attempts`` fois échoue définitivement, une tâche
+    dont l'annulation a été demandée est annulée.
+    """
+    cursor.execute(
+        """
+        UPDATE jobs SET
+            status = CASE
+                WHEN cancel_requested THEN 'cancelled'
+                WHEN attempts >= %(max)s THEN 'failed'
+                ELSE 'queued' END,
+            error = CASE
+                WHEN NOT cancel_requested AND attempts >= %(max)s
+                THEN 'Abandonnée après ' || attempts || ' tentatives' ELSE error END,
+            finished_at = CASE
+                WHEN cancel_requested OR attempts >= %(max)s THEN NOW() ELSE finished_at END,
+            worker = NULL
+        WHERE status = 'running' AND heartbeat_at < NOW() - make_interval(secs => %(timeout)s)
+        """,
+        {"max": max_attempts, "timeout": timeout_s},
+    )
+    return cursor.rowcount
+
+
+class JobContext:
+    """Tâche en cours d'exécution, transmise aux handlers."""
+
+    def __init__(self, cursor, job_id: int, kind: str, payload: dict, inputs, worker: str,
+                 min_interval: float = 0.5):
+        self.cursor = cursor
+        self.id = job_id
+        self.worker = worker
+        self.kind = kind
+        self.payload = payload
+        self.inputs = inputs
+        self._min_interval = min_interval
+        self._last_update = 0.0
+        # Constatés par le battement de cœur, signalés au prochain ``progress``
+        self._cancelled = False
+        self._lost = False
+
+    def progress(self, fraction: float, message: str = None, force: bool = False) -> None:
+        """Publie l'avancement (au plus toutes les ``min_interval`` s) et vérifie l'annulation."""
+        if self._lost:
+            raise JobLost(f"Tâche #{self.id} reprise par un autre worker")
+        if self._cancelled:
+            raise JobCancelled(f"Tâche #{self.id} annulée")
+        now = monotonic()
+        if not force and now - self._last_update < self._min_interval:
+            return
+        self._last_update = now
+        self.cursor.execute(
+            """
+            UPDATE jobs SET progress = %s, message = COALESCE(%s, message), heartbeat_at = NOW()
+            WHERE id = %s AND worker = %s AND status = 'running' RETURNING cancel_requested
+            """,
+            (max(0.0, min(1.0, fraction)), message, self.id, self.worker),
+        )
+        row = self.cursor.fetchone()
+        if row is None:
+            raise JobLost(f"Tâche #{self.id} reprise par un autre worker")
+        if row[0]:
+            raise JobCancelled(f"Tâche #{self.id} annulée")
+
+    @contextmanager
+    def heartbeat(self, connect, interval: float):
+        """Tient la tâche pour vivante pendant le bloc, même entre deux ``progress``.
+
+        Un thread rafraîchit ``heartbeat_at`` toutes les ``interval`` s sur sa propre
+        connexion (``connect()``) : une étape longue (chargement de l'index) n'est pas
+        reprise par ``requeue_stale``. L'annulation ou la perte de la tâche sont levées
+        au ``progress`` suivant.
+        """
+        stop = threading.Event()
+
+        def beat():
+            try:
+                conn = connect()
+            except Exception as e:
+                print(f"Battement de cœur de la tâche #{self.id} impossible ({e})")
+                return
+            try:
+                with conn.cursor() as cur:
+                    while not stop.wait(interval):
+                        cur.execute(
+                            """
+                            UPDATE jobs SET heartbeat_at = NOW()
+                            WHERE id = %s AND worker = %s AND status = 'running' RETURNING cancel_requested
+                            """,
+                            (self.id, self.worker),
+                        )
+                        row = cur.fetchone()
+                        if row is None:
+                            self._lost = True
+                            return
+                        self._cancelled = self._cancelled or row[0]
+            except Exception as e:
+                print(f"Battement de cœur de la tâche #{self.id} interrompu ({e})")
+            finally:
+                conn.close()
+
+        thread = threading.Thread(target=beat, name=f"job-{self.id}-heartbeat", daemon=True)
+        thread.start()
+        try:
+            yield self
+        finally:
+            stop.set()
+            thread.join()
+
+    def checkpoint(self, cur, result) -> None:
+        """Enregistre ``result`` sur la tâche dans la transaction de ``cur``.
+
+        Appelé avant le COMMIT d'une écriture : si la tâche a été reprise entre-temps,
+        ``JobLost`` annule la transaction ; sinon une reprise ultérieure retrouve le
+        résultat via ``checkpointed`` au lieu de refaire l'écriture.
+        """
+        cur.execute(
+            "UPDATE jobs SET result = %s WHERE id = %s AND worker = %s AND status = 'running'",
+            (_json(result), self.id, self.worker),
+        )
+        if cur.rowcount == 0:
+            raise JobLost(f"Tâche #{self.id} reprise par un autre worker")
+
+    def checkpointed(self):
+        """Résultat enregistré par ``checkpoint`` lors d'une tentative précédente, ou None."""
+        self.cursor.execute("SELECT result FROM jobs WHERE id = %s", (self.id,))
+        row = self.cursor.fetchone()
+        return row[0] if row else None
@@ -0,0 +1,102 @@
+"""Processus d'exécution des tâches en arrière-plan.
+
+Usage : python -m jobs.worker [--processes 2] [--poll-interval 5]
+
+Les workers se réveillent sur NOTIFY (canal ``dgsn_jobs``) et réservent les
+tâches avec ``FOR UPDATE SKIP LOCKED`` : aucun broker externe n'est nécessaire.
+"""
+import argparse
+import multiprocessing
+import os
+import select
+import signal
+import socket
+import traceback
+from time import monotonic
+
+from .handlers import HANDLERS
+from .queue import CHANNEL, JobCancelled, JobContext, JobLost, claim_job, finish_job, requeue_stale
+
+STALE_TIMEOUT_S = 300
+# Battement de cœur pendant l'exécution d'un handler, bien en deçà de STALE_TIMEOUT_S
+HEARTBEAT_INTERVAL_S = 30
+# Fréquence de reprise des tâches d'un worker arrêté (les autres workers continuent)
+REQUEUE_INTERVAL_S = 60
+
+
+def execute(cursor, job, worker: str) -> None:
+    from database import connect
+
+    job_id, kind, payload, inputs = job
+    context = JobContext(cursor, job_id, kind, payload, inputs, worker)
+    fn = HANDLERS.get(kind)
+    if fn is None:
+        finish_job(cursor, job_id, worker, "failed", error=f"Type de tâche inconnu : {kind}")
+        return
+    try:
+        with context.heartbeat(connect, HEARTBEAT_INTERVAL_S):
+            result = fn(context)
+    except JobLost:
+        print(f"[{worker}] tâche #{job_id} reprise par un autre worker, abandon")
+    except JobCancelled:
+        finish_job(cursor, job_id, worker, "cancelled")
+    except Exception as e:
+        traceback.print_exc()
+        finish_job(cursor, job_id, worker, "failed", error=str(e))
+    else:
+        finish_job(cursor, job_id, worker, "succeeded", result=result)
+
+
+def run_worker(name: str, poll_interval: float = 5.0) -> None:
+    from database import connect
+    from utils import initialize_deepface
+
+    initialize_deepface()
+    stopping = []
+    signal.signal(signal.SIGTERM, lambda *_: stopping.append(True))
+
+    conn = connect()
+    cursor = conn.cursor()
+    cursor.execute(f"LISTEN {CHANNEL}")
+    print(f"[{name}] en attente de tâches")
+    next_requeue = 0.0
+    while not stopping:
+        if monotonic() >= next_requeue:
+            requeue_stale(cursor, STALE_TIMEOUT_S)
+            next_requeue = monotonic() + REQUEUE_INTERVAL_S
+        job = claim_job(cursor, name)
+        if job is None:
+            if select.select([conn], [], [], poll_interval) != ([], [], []):
+                conn.poll()
+                conn.notifies.clear()
+            continue
+        print(f"[{name}] tâche #{job[0]} ({job[1]})")
+        execute(cursor, job, name)
+    conn.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Workers de tâches DGSN")
+    parser.add_argument("--processes", type=int, default=2)
+    parser.add_argument("--poll-interval", type=float, default=5.0)
+    args = parser.parse_args()
+
+    ctx = multiprocessing.get_context("spawn")
+    prefix = f"{socket.gethostname()}:{os.getpid()}"
+    workers = [
+        ctx.Process(target=run_worker, args=(f"{prefix}-{i}", args.poll_interval), daemon=False)
+        for i in range(args.processes)
+    ]
+    for w in workers:
+        w.start()
+    try:
+        for w in workers:
+            w.join()
+    except KeyboardInterrupt:
+        for w in workers:
+            w.terminate()
+            w.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -98,6 +98,13 @@ def build_login_page() -> None:
                 st.warning("Trop de tentatives. Bouton désactivé 60s.")
 
 
+@st.cache_resource
+def init_db() -> bool:
+    """Initialise le schéma une seule fois par processus, pas à chaque rerun."""
+    setup_db()
+    return True
+
+
 st.set_page_config(
     page_title="DGSN - Reconnaissance Faciale",
     page_icon="logo.png",
@@ -106,7 +113,7 @@ st.set_page_config(
 
 initialize_deepface()
 if cursor:
-    setup_db()
+    init_db()
 
 if "authenticated" not in st.session_state:
     st.session_state["authenticated"] = False
@@ -6,13 +6,21 @@ from database import setup_db, cursor
 from ui import login_page, main_page, load_css, app_header
 from utils import initialize_deepface
 
+
+@st.cache_resource
+def init_db() -> bool:
+    """Initialise le schéma une seule fois par processus, pas à chaque rerun."""
+    setup_db()
+    return True
+
+
 # Configuration de la page
 st.set_page_config(page_title="DGSN - Reconnaissance Faciale", page_icon="logo.png", layout="wide")
 
 # Initialisations
 initialize_deepface()
 if cursor:
-    setup_db()
+    init_db()
 load_css()
 app_header()
 
@@ -0,0 +1,29 @@
+"""Reconnaissance faciale : cache, embeddings et index de la galerie."""
+from .cache import TTLCache, search_cache, probe_hash, gallery_version
+from .embeddings import compute_embedding, store_embeddings
+from .pool import EmbeddingPool, embed_images
+from .backfill import backfill_async, backfill_embeddings
+from .index import GalleryIndex, get_gallery_index, gallery_token, apply_gallery_changes
+from .quantization import QuantizedMatrix
+from .snapshot import SnapshotIndex
+from .calibration import match_threshold
+
+__all__ = [
+    "TTLCache",
+    "search_cache",
+    "probe_hash",
+    "gallery_version",
+    "compute_embedding",
+    "store_embeddings",
+    "EmbeddingPool",
+    "embed_images",
+    "backfill_async",
+    "backfill_embeddings",
+    "GalleryIndex",
+    "get_gallery_index",
+    "gallery_token",
+    "apply_gallery_changes",
+    "QuantizedMatrix",
+    "SnapshotIndex",
+    "match_threshold",
+]
@@ -0,0 +1,95 @@
+"""Calcul des embeddings manquants de la galerie.
+
+Usage : python -m recognition.backfill [--model Facenet] [--batch 512]
+
+La recherche ne calcule rien elle-même : ``backfill_async`` lance le calcul en
+arrière-plan et l'index se met à jour au fil des embeddings enregistrés.
+"""
+import argparse
+import threading
+
+from .embeddings import count_missing, fetch_missing, store_embeddings
+from .pool import embed_images
+
+
+def backfill_embeddings(cursor, model_name: str = "Facenet", batch: int = 512, progress=None, shard=None) -> int:
+    """Calcule et enregistre les embeddings manquants. Retourne le nombre de photos traitées.
+
+    ``shard`` : (index, nombre) pour ne traiter que les criminels d'un shard.
+    """
+    total = count_missing(cursor, model_name, shard)
+    done = 0
+    while done < total:
+        rows = fetch_missing(cursor, model_name, batch, shard)
+        if not rows:
+            break
+        embedded = embed_images([img for _, img in rows], model_name, with_quality=True)
+        store_embeddings(
+            cursor, model_name,
+            [(image_id, vec, quality) for (image_id, _), (vec, quality) in zip(rows, embedded)],
+        )
+        done += len(rows)
+        if progress:
+            progress(done, total)
+    return done
+
+
+_running = set()
+_lock = threading.Lock()
+
+
+def backfill_async(model_name: str = "Facenet", shard=None) -> None:
+    """Calcule les embeddings manquants dans un thread d'arrière-plan, sur une connexion dédiée.
+
+    Un seul calcul par modèle et shard : dans le processus (ensemble ``_running``)
+    et entre processus (verrou consultatif PostgreSQL).
+    """
+    key = (model_name, shard)
+    with _lock:
+        if key in _running:
+            return
+        _running.add(key)
+
+    def run():
+        from database import connect
+        conn = None
+        try:
+            conn = connect()
+            cur = conn.cursor()
+            cur.execute("SELECT pg_try_advisory_lock(hashtext(%s))", (f"backfill:{model_name}:{shard}",))
+            if cur.fetchone()[0]:
+                done = backfill_embeddings(cur, model_name, shard=shard)
+                if done:
+                    print(f"{done} embedding(s) {model_name} calculé(s) en arrière-plan")
+        except Exception as e:
+            print(f"Calcul des embeddings manquants {model_name} impossible ({e})")
+        finally:
+            if conn is not None:
+                # La fermeture libère le verrou consultatif
+                conn.close()
+            with _lock:
+                _running.discard(key)
+
+    threading.Thread(target=run, name="embedding-backfill", daemon=True).start()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Calcul des embeddings manquants")
+    parser.add_argument("--model", default="Facenet")
+    parser.add_argument("--batch", type=int, default=512)
+    args = parser.parse_args()
+
+    from database import cursor
+    from utils import initialize_deepface
+    if not cursor:
+        raise SystemExit("Base de données indisponible")
+    initialize_deepface()
+    done = backfill_embeddings(
+        cursor, args.model, args.batch,
+        progress=lambda d, t: print(f"{d}/{t} photos", flush=True),
+    )
+    print(f"{done} embedding(s) calculé(s) pour {args.model}")
+
+
+if __name__ == "__main__":
+    main()
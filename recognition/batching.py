@@ -0,0 +1,213 @@
+"""Inférence par lots : détection/alignement image par image, un seul passage du modèle par lot."""
+import queue
+import threading
+from concurrent.futures import Future
+from time import monotonic
+
+import numpy as np
+
+from config import DETECTION_MAX_SIDE, DETECTOR_BACKEND, EMBED_BATCH_SIZE, EMBED_BATCH_WAIT_MS, FAKE_EMBEDDER
+
+
+def detect_face(img_array: np.ndarray, detector_backend: str = None, max_side: int = None):
+    """Plus grand visage aligné (RGB, valeurs dans [0, 1]) et confiance du détecteur.
+
+    Si le plus grand côté de l'image dépasse ``max_side``, la détection se fait sur
+    une copie réduite et le visage est découpé dans l'image en pleine résolution.
+    """
+    if FAKE_EMBEDDER:
+        from .fake import fake_face
+        return fake_face(img_array), 1.0
+    detector_backend = detector_backend or DETECTOR_BACKEND
+    max_side = DETECTION_MAX_SIDE if max_side is None else max_side
+    scale = max_side / max(img_array.shape[:2]) if max_side else 1.0
+    if scale >= 1.0:
+        best = _largest_face(img_array, detector_backend, align=True)
+        if best is None:
+            return None, 0.0
+        return best["face"], float(best.get("confidence") or 0.0)
+
+    import cv2
+    height, width = img_array.shape[:2]
+    small = cv2.resize(img_array, (max(1, int(width * scale)), max(1, int(height * scale))), interpolation=cv2.INTER_AREA)
+    best = _largest_face(small, detector_backend, align=False)
+    if best is None:
+        return None, 0.0
+    return crop_face(img_array, best["facial_area"], 1.0 / scale), float(best.get("confidence") or 0.0)
+
+
+def _largest_face(img_array: np.ndarray, detector_backend: str, align: bool):
+    from deepface import DeepFace
+    try:
+        faces = DeepFace.extract_faces(
+            img_array,
+            detector_backend=detector_backend,
+            enforce_detection=False,
+            align=align,
+        )
+    except Exception:
+        return None
+    if not faces:
+        return None
+    return max(faces, key=lambda f: f["facial_area"]["w"] * f["facial_area"]["h"])
+
+
+def crop_face(img_array: np.ndarray, area: dict, factor: float = 1.0) -> np.ndarray:
+    """Découpe la zone ``area`` (coordonnées multipliées par ``factor``), alignée sur les yeux.
+
+    Comme DeepFace : rotation pour mettre les yeux à l'horizontale, RGB dans [0, 1].
+    """
+    from PIL import Image
+    height, width = img_array.shape[:2]
+    x, y = area["x"] * factor, area["y"] * factor
+    w, h = area["w"] * factor, area["h"] * factor
+    eyes = [area.get("left_eye"), area.get("right_eye")]
+    angle = 0.0
+    if all(eye is not None for eye in eyes):
+        (x1, y1), (x2, y2) = sorted((ex * factor, ey * factor) for ex, ey in eyes)
+        angle = float(np.degrees(np.arctan2(y2 - y1, x2 - x1)))
+    # Marge autour du visage pour que la rotation ne fasse pas entrer de bords noirs
+    pad = 0.5 * max(w, h) if angle else 0.0
+    left, top = int(max(0, x - pad)), int(max(0, y - pad))
+    right, bottom = int(min(width, x + w + pad)), int(min(height, y + h + pad))
+    region = Image.fromarray(np.ascontiguousarray(img_array[top:bottom, left:right]))
+    cx, cy = x + w / 2 - left, y + h / 2 - top
+    if angle:
+        region = region.rotate(angle, resample=Image.BILINEAR, center=(cx, cy))
+    box = (int(max(0, cx - w / 2)), int(max(0, cy - h / 2)), int(cx + w / 2), int(cy + h / 2))
+    face = np.asarray(region.crop(box), dtype=np.float32)
+    return face / 255.0
+
+
+def _model_input(model_name: str):
+    """(client DeepFace, modèle Keras ou None, taille d'entrée (h, w))."""
+    from deepface import DeepFace
+    client = DeepFace.build_model(model_name)
+    keras_model = getattr(client, "model", None)
+    shape = getattr(client, "input_shape", None)
+    if shape is None and keras_model is not None:
+        shape = tuple(keras_model.input_shape[1:3])
+    return client, keras_model, shape
+
+
+def _resize(face: np.ndarray, target_size) -> np.ndarray:
+    """Redimensionne en conservant les proportions puis complète à la taille du modèle (comme DeepFace).
+
+    ``target_size`` None (taille d'entrée inconnue) : seules la conversion BGR et la normalisation sont faites.
+    """
+    face = face[:, :, ::-1]  # le modèle attend du BGR
+    if target_size is None:
+        face = face.astype(np.float32)
+        return face / 255.0 if face.max() > 1 else face
+    import cv2
+    height, width = target_size
+    if face.shape[0] > 0 and face.shape[1] > 0:
+        factor = min(height / face.shape[0], width / face.shape[1])
+        face = cv2.resize(face, (int(face.shape[1] * factor), int(face.shape[0] * factor)))
+        diff_h, diff_w = height - face.shape[0], width - face.shape[1]
+        face = np.pad(
+            face,
+            ((diff_h // 2, diff_h - diff_h // 2), (diff_w // 2, diff_w - diff_w // 2), (0, 0)),
+            "constant",
+        )
+    if face.shape[0:2] != (height, width):
+        face = cv2.resize(face, (width, height))
+    face = face.astype(np.float32)
+    if face.max() > 1:
+        face /= 255.0
+    return face
+
+
+def forward_batch(faces, model_name: str = "Facenet", batch_size: int = EMBED_BATCH_SIZE):
+    """Embeddings de visages alignés, ``batch_size`` visages par passage du modèle."""
+    if not faces:
+        return []
+    if FAKE_EMBEDDER:
+        from .fake import fake_vector
+        return [fake_vector(f, model_name) for f in faces]
+    client, keras_model, shape = _model_input(model_name)
+    if keras_model is None or shape is None:
+        # Modèles hors Keras (Dlib, SFace...) : pas de passage par lot possible ; sans taille
+        # d'entrée connue, le client reçoit le visage à sa taille d'origine
+        return [np.asarray(client.forward(_resize(f, shape)[None]), dtype=np.float32).ravel() for f in faces]
+    vectors = []
+    for start in range(0, len(faces), batch_size):
+        batch = np.stack([_resize(f, shape) for f in faces[start:start + batch_size]])
+        vectors.extend(np.asarray(keras_model(batch, training=False), dtype=np.float32))
+    return vectors
+
+
+def face_quality(confidence: float) -> float:
+    """Poids d'un visage dans le gabarit : confiance du détecteur bornée à [0.05, 1]."""
+    return float(min(1.0, max(0.05, confidence)))
+
+
+def embed_batch(img_arrays, model_name: str = "Facenet", detector_backend: str = None,
+                batch_size: int = EMBED_BATCH_SIZE, with_quality: bool = False, max_side: int = None):
+    """Embedding (ou None) de chaque image : détection une par une, inférence par lots.
+
+    Avec ``with_quality``, retourne des couples (embedding, qualité du visage).
+    """
+    detections = [detect_face(img, detector_backend, max_side) for img in img_arrays]
+    found = [i for i, (face, _) in enumerate(detections) if face is not None]
+    vectors = forward_batch([detections[i][0] for i in found], model_name, batch_size)
+    results = [(None, 0.0)] * len(detections)
+    for i, vec in zip(found, vectors):
+        results[i] = (vec, face_quality(detections[i][1]))
+    return results if with_quality else [vec for vec, _ in results]
+
+
+class DynamicBatcher:
+    """Regroupe les visages soumis par plusieurs threads en lots d'inférence.
+
+    Le premier visage arrivé attend au plus ``max_wait_ms`` que le lot se remplisse.
+    """
+
+    def __init__(self, model_name: str = "Facenet", batch_size: int = EMBED_BATCH_SIZE,
+                 max_wait_ms: float = EMBED_BATCH_WAIT_MS):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name=f"batcher-{model_name}", daemon=True)
+        self._thread.start()
+
+    def submit(self, face: np.ndarray) -> Future:
+        future = Future()
+        self._queue.put((face, future))
+        return future
+
+    def embed(self, face: np.ndarray) -> np.ndarray:
+        return self.submit(face).result()
+
+    def _run(self) -> None:
+        while True:
+            pending = [self._queue.get()]
+            deadline = monotonic() + self.max_wait
+            while len(pending) < self.batch_size:
+                timeout = deadline - monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    pending.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            try:
+                vectors = forward_batch([face for face, _ in pending], self.model_name, self.batch_size)
+            except Exception as e:
+                for _, future in pending:
+                    future.set_exception(e)
+                continue
+            for (_, future), vec in zip(pending, vectors):
+                future.set_result(vec)
+
+
+_batchers = {}
+_batchers_lock = threading.Lock()
+
+
+def get_batcher(model_name: str = "Facenet") -> DynamicBatcher:
+    with _batchers_lock:
+        if model_name not in _batchers:
+            _batchers[model_name] = DynamicBatcher(model_name)
+        return _batchers[model_name]
@@ -0,0 +1,99 @@
+"""Cache des résultats de recherche faciale."""
+import hashlib
+import threading
+from collections import OrderedDict
+from time import monotonic
+
+from PIL import Image
+
+from config import SEARCH_CACHE_SIZE, SEARCH_CACHE_TTL
+
+
+class TTLCache:
+    """Cache LRU borné dont les entrées expirent après ``ttl`` secondes.
+
+    ``generation`` compte les modifications signalées par ``bump`` : un résultat
+    calculé avant l'une d'elles n'est pas stocké (voir ``set``).
+    """
+
+    def __init__(self, maxsize: int = 128, ttl: float = 600.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.generation = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            expires_at, value = entry
+            if expires_at < monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, generation=None) -> bool:
+        """Stocke ``value`` ; ignoré si ``generation`` (lue avant le calcul) n'est plus la courante."""
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return False
+            self._data[key] = (monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+        return True
+
+    def bump(self) -> None:
+        """Signale une modification : les calculs en cours ne seront pas stockés."""
+        with self._lock:
+            self.generation += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def keys(self):
+        with self._lock:
+            return list(self._data)
+
+    def discard_if(self, predicate) -> int:
+        """Supprime les entrées pour lesquelles ``predicate(clé, valeur)`` est vrai ; retourne leur nombre."""
+        with self._lock:
+            stale = [key for key, (_, value) in self._data.items() if predicate(key, value)]
+            for key in stale:
+                del self._data[key]
+        return len(stale)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+def probe_hash(image: Image.Image) -> str:
+    """Empreinte SHA-256 du contenu (pixels) d'une image."""
+    digest = hashlib.sha256()
+    digest.update(f"{image.mode}:{image.size}".encode())
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+
+def gallery_version(cursor):
+    """Version courante de la galerie, incrémentée par trigger au COMMIT de chaque transaction
+    qui modifie les embeddings ou les champs filtrables des fiches.
+
+    Retourne ``None`` si la version n'est pas disponible : le cache est alors ignoré.
+    """
+    if not cursor:
+        return None
+    try:
+        cursor.execute("SELECT version FROM gallery_version")
+        row = cursor.fetchone()
+    except Exception:
+        return None
+    return row[0] if row else None
+
+
+# Cache partagé par toutes les sessions du processus
+search_cache = TTLCache(maxsize=SEARCH_CACHE_SIZE, ttl=SEARCH_CACHE_TTL)
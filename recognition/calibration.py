@@ -0,0 +1,185 @@
+"""Calibration des seuils de correspondance par modèle et par métrique.
+
+Les distances de toutes les paires d'un jeu étiqueté (un dossier par personne,
+comme ``images/``) sont calculées d'un coup par produit matriciel, puis séparées
+en paires authentiques (même personne) et imposteurs. Le seuil retenu est le
+plus grand dont le taux de fausses acceptations reste sous la cible.
+
+Usage : python -m recognition.calibration [--data images] [--models Facenet ArcFace]
+        [--metrics cosine euclidean_l2] [--target-far 0.001] [--out thresholds.json]
+"""
+import argparse
+import json
+import os
+import threading
+
+import numpy as np
+
+from config import CALIBRATION_TARGET_FAR, DEFAULT_MATCH_THRESHOLD, THRESHOLDS_FILE
+from .embeddings import normalize
+from .pool import embed_images
+
+METRICS = ("cosine", "euclidean", "euclidean_l2")
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+
+def load_dataset(root: str):
+    """[(étiquette, octets de l'image)] pour chaque image de ``root/<personne>/``."""
+    samples = []
+    for label in sorted(os.listdir(root)):
+        folder = os.path.join(root, label)
+        if not os.path.isdir(folder):
+            continue
+        for name in sorted(os.listdir(folder)):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                with open(os.path.join(folder, name), "rb") as f:
+                    samples.append((label, f.read()))
+    return samples
+
+
+def pairwise_distances(vectors, metric: str = "cosine") -> np.ndarray:
+    """Matrice des distances entre toutes les paires de vecteurs."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if metric == "cosine":
+        unit = normalize(vectors)
+        return 1.0 - unit @ unit.T
+    if metric == "euclidean_l2":
+        vectors = normalize(vectors)
+    elif metric != "euclidean":
+        raise ValueError(f"Métrique inconnue : {metric}")
+    sq = np.einsum("ij,ij->i", vectors, vectors)
+    return np.sqrt(np.maximum(sq[:, None] + sq[None, :] - 2.0 * vectors @ vectors.T, 0.0))
+
+
+def split_pairs(distances, labels):
+    """Distances des paires authentiques et imposteurs (triangle supérieur, triées)."""
+    labels = np.asarray(labels)
+    upper = np.triu_indices(len(labels), k=1)
+    same = labels[upper[0]] == labels[upper[1]]
+    values = distances[upper]
+    return np.sort(values[same]), np.sort(values[~same])
+
+
+def sweep(genuine, impostor, steps: int = 1000):
+    """Taux d'erreur pour une grille de seuils : (seuils, FAR, FRR)."""
+    low = min(genuine[0], impostor[0])
+    high = max(genuine[-1], impostor[-1])
+    thresholds = np.linspace(low, high, steps)
+    far = np.searchsorted(impostor, thresholds, side="right") / len(impostor)
+    frr = 1.0 - np.searchsorted(genuine, thresholds, side="right") / len(genuine)
+    return thresholds, far, frr
+
+
+def operating_point(genuine, impostor, target_far: float = CALIBRATION_TARGET_FAR, steps: int = 1000) -> dict:
+    """Seuil le plus permissif respectant ``target_far``, avec le taux d'égale erreur."""
+    thresholds, far, frr = sweep(genuine, impostor, steps)
+    allowed = np.flatnonzero(far <= target_far)
+    k = allowed[-1] if len(allowed) else 0
+    eer = int(np.argmin(np.abs(far - frr)))
+    return {
+        "threshold": float(thresholds[k]),
+        "far": float(far[k]),
+        "frr": float(frr[k]),
+        "eer": float((far[eer] + frr[eer]) / 2),
+        "eer_threshold": float(thresholds[eer]),
+        "genuine_pairs": int(len(genuine)),
+        "impostor_pairs": int(len(impostor)),
+    }
+
+
+def calibrate(samples, models, metrics=("cosine",), target_far: float = CALIBRATION_TARGET_FAR, progress=None) -> dict:
+    """{modèle: {métrique: point de fonctionnement}} pour un jeu étiqueté."""
+    results = {}
+    for model_name in models:
+        vectors = embed_images([data for _, data in samples], model_name, progress=progress)
+        kept = [(label, vec) for (label, _), vec in zip(samples, vectors) if vec is not None]
+        labels = [label for label, _ in kept]
+        if len(set(labels)) < 2 or len(labels) == len(set(labels)):
+            raise ValueError("Il faut au moins deux personnes, dont une avec plusieurs visages détectés")
+        matrix = np.stack([vec for _, vec in kept])
+        results[model_name] = {}
+        for metric in metrics:
+            genuine, impostor = split_pairs(pairwise_distances(matrix, metric), labels)
+            results[model_name][metric] = operating_point(genuine, impostor, target_far)
+    return results
+
+
+def write_thresholds(results: dict, path: str = THRESHOLDS_FILE, **meta) -> None:
+    """Fusionne ``results`` dans le fichier de seuils (les autres modèles sont conservés)."""
+    config = _read(path)
+    config.update(meta)
+    config.setdefault("models", {})
+    for model_name, metrics in results.items():
+        config["models"].setdefault(model_name, {}).update(metrics)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(config, f, ensure_ascii=False, indent=2)
+    _cache.clear()
+
+
+def _read(path: str) -> dict:
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+_cache = {}
+_lock = threading.Lock()
+
+
+def model_config(model_name: str, path: str = THRESHOLDS_FILE) -> dict:
+    """Entrée de ``model_name`` dans le fichier de seuils (relu quand il change), {} à défaut."""
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return {}
+    with _lock:
+        if _cache.get("key") != (path, mtime):
+            _cache.update(key=(path, mtime), config=_read(path))
+        return _cache["config"].get("models", {}).get(model_name, {})
+
+
+def match_threshold(model_name: str = "Facenet", path: str = THRESHOLDS_FILE) -> float:
+    """Seuil de distance cosinus calibré pour ``model_name``.
+
+    Le fichier est relu quand il change. Un seuil euclidean_l2 est converti
+    (d_l2² = 2·d_cos sur des vecteurs normalisés) ; à défaut, seuil par défaut.
+    """
+    metrics = model_config(model_name, path)
+    if "cosine" in metrics:
+        return float(metrics["cosine"]["threshold"])
+    if "euclidean_l2" in metrics:
+        return float(metrics["euclidean_l2"]["threshold"]) ** 2 / 2
+    return DEFAULT_MATCH_THRESHOLD
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Calibration des seuils de correspondance")
+    parser.add_argument("--data", default="images")
+    parser.add_argument("--models", nargs="+", default=["Facenet"])
+    parser.add_argument("--metrics", nargs="+", choices=METRICS, default=["cosine", "euclidean_l2"])
+    parser.add_argument("--target-far", type=float, default=CALIBRATION_TARGET_FAR)
+    parser.add_argument("--out", default=THRESHOLDS_FILE)
+    args = parser.parse_args()
+
+    from utils import initialize_deepface
+    initialize_deepface()
+    samples = load_dataset(args.data)
+    print(f"{len(samples)} image(s), {len({label for label, _ in samples})} personne(s)")
+    results = calibrate(
+        samples, args.models, args.metrics, args.target_far,
+        progress=lambda d, t: print(f"{d}/{t} images", flush=True),
+    )
+    for model_name, metrics in results.items():
+        for metric, point in metrics.items():
+            print(
+                f"{model_name:<12} {metric:<13} seuil={point['threshold']:.4f} "
+                f"FAR={point['far']:.4f} FRR={point['frr']:.4f} EER={point['eer']:.4f}"
+            )
+    write_thresholds(results, args.out, dataset=os.path.abspath(args.data), target_far=args.target_far)
+    print(f"Seuils enregistrés -> {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+"""Détection des doublons dans toute la galerie.
+
+Usage :
+  python -m recognition.dedup report [--model Facenet] [--threshold 0.30] [--out dedup_report.json]
+  python -m recognition.dedup merge --target ID --sources ID [ID ...]
+
+Toutes les paires de photos sont comparées par produits matriciels par blocs
+(mémoire bornée à ``block_size``² flottants), puis les criminels reliés par au
+moins une paire sous le seuil sont regroupés (union-find).
+"""
+import argparse
+import getpass
+import json
+
+import numpy as np
+
+from .embeddings import load_embeddings, normalize
+
+DEFAULT_THRESHOLD = 0.30
+
+
+def similar_pairs(criminal_ids, image_ids, vectors, threshold: float = DEFAULT_THRESHOLD,
+                  block_size: int = 4096, progress=None):
+    """Paires de criminels distincts ayant deux photos à distance cosinus <= ``threshold``.
+
+    Retourne {(criminal_a, criminal_b): (distance, image_a, image_b)} avec la paire la plus proche.
+    """
+    matrix = normalize(vectors)
+    criminal_ids = np.asarray(criminal_ids)
+    image_ids = np.asarray(image_ids)
+    n = len(matrix)
+    min_similarity = np.float32(1.0 - threshold)
+    found = []
+    blocks = list(range(0, n, block_size))
+    for bi, i0 in enumerate(blocks):
+        i1 = min(i0 + block_size, n)
+        for j0 in blocks[bi:]:
+            j1 = min(j0 + block_size, n)
+            sim = matrix[i0:i1] @ matrix[j0:j1].T
+            rows, cols = np.nonzero(sim >= min_similarity)
+            rows, cols = rows + i0, cols + j0
+            keep = (rows < cols) & (criminal_ids[rows] != criminal_ids[cols])
+            rows, cols = rows[keep], cols[keep]
+            if len(rows):
+                found.append((rows, cols, 1.0 - sim[rows - i0, cols - j0]))
+        if progress:
+            progress(bi + 1, len(blocks))
+
+    pairs = {}
+    for rows, cols, dists in found:
+        for r, c, d in zip(rows, cols, dists):
+            a, b = int(criminal_ids[r]), int(criminal_ids[c])
+            ia, ib = int(image_ids[r]), int(image_ids[c])
+            if a > b:
+                a, b, ia, ib = b, a, ib, ia
+            if (a, b) not in pairs or d < pairs[(a, b)][0]:
+                pairs[(a, b)] = (float(d), ia, ib)
+    return pairs
+
+
+def cluster_pairs(pairs):
+    """Regroupe les criminels reliés (composantes connexes). Retourne une liste de listes triées."""
+    parent = {}
+
+    def find(x):
+        parent.setdefault(x, x)
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    for a, b in pairs:
+        ra, rb = find(a), find(b)
+        if ra != rb:
+            parent[max(ra, rb)] = min(ra, rb)
+    groups = {}
+    for x in parent:
+        groups.setdefault(find(x), []).append(x)
+    return sorted((sorted(g) for g in groups.values()), key=lambda g: (-len(g), g[0]))
+
+
+def build_report(cursor, model_name: str = "Facenet", threshold: float = DEFAULT_THRESHOLD,
+                 block_size: int = 4096, progress=None) -> dict:
+    """Rapport des fusions candidates : un groupe par personne présumée en double."""
+    image_ids, criminal_ids, vectors = load_embeddings(cursor, model_name)
+    pairs = similar_pairs(criminal_ids, image_ids, vectors, threshold, block_size, progress) if len(image_ids) else {}
+    clusters = cluster_pairs(pairs)
+
+    members = sorted({cid for group in clusters for cid in group})
+    records = {}
+    if members:
+        cursor.execute(
+            """
+            SELECT c.id, c.nom, c.prenom, c.crime, COUNT(ic.id)
+            FROM criminals c LEFT JOIN images_criminels ic ON ic.criminal_id = c.id
+            WHERE c.id = ANY(%s) GROUP BY c.id
+            """,
+            (members,),
+        )
+        records = {row[0]: row for row in cursor.fetchall()}
+
+    edges_by_member = {}
+    for (a, b), (d, ia, ib) in sorted(pairs.items(), key=lambda kv: kv[1][0]):
+        edges_by_member.setdefault(a, []).append({"a": a, "b": b, "distance": d, "image_a": ia, "image_b": ib})
+
+    report = []
+    for group in clusters:
+        edges = sorted(
+            (edge for cid in group for edge in edges_by_member.get(cid, [])),
+            key=lambda e: e["distance"],
+        )
+        members = []
+        for cid in group:
+            _, nom, prenom, crime, photos = records.get(cid) or (cid, None, None, None, 0)
+            members.append({"id": cid, "nom": nom, "prenom": prenom, "crime": crime, "photos": photos})
+        report.append({
+            # Le plus ancien dossier est proposé comme cible de la fusion
+            "target": group[0],
+            "members": members,
+            "pairs": edges,
+            "best_similarity": round((1 - edges[0]["distance"]) * 100, 2) if edges else None,
+        })
+    return {
+        "model_name": model_name,
+        "threshold": threshold,
+        "embeddings": int(len(image_ids)),
+        "clusters": report,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Doublons de la galerie")
+    sub = parser.add_subparsers(dest="command", required=True)
+    report_cmd = sub.add_parser("report", help="Calcule le rapport des fusions candidates")
+    report_cmd.add_argument("--model", default="Facenet")
+    report_cmd.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    report_cmd.add_argument("--block-size", type=int, default=4096)
+    report_cmd.add_argument("--out", default="dedup_report.json")
+    merge_cmd = sub.add_parser("merge", help="Fusionne des dossiers dans un dossier cible")
+    merge_cmd.add_argument("--target", type=int, required=True)
+    merge_cmd.add_argument("--sources", type=int, nargs="+", required=True)
+    args = parser.parse_args()
+
+    from audit import audit_event
+    from database import cursor, merge_criminals
+    if not cursor:
+        raise SystemExit("Base de données indisponible")
+    if args.command == "report":
+        report = build_report(
+            cursor, args.model, args.threshold, args.block_size,
+            progress=lambda d, t: print(f"bloc {d}/{t}", flush=True),
+        )
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"{len(report['clusters'])} groupe(s) de doublons présumés -> {args.out}")
+    else:
+        user = f"cli:{getpass.getuser()}"
+        moved = merge_criminals(args.target, args.sources, merged_by=user)
+        audit_event("criminal_merge", user, args.target,
+                    {"sources": [i for i in args.sources if i != args.target], "photos": moved, "via": "cli"})
+        print(f"{moved} photo(s) déplacée(s) vers le criminel ID {args.target}")
+
+
+if __name__ == "__main__":
+    main()
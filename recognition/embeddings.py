@@ -0,0 +1,173 @@
+"""Calcul et stockage des embeddings faciaux (table ``embeddings_criminels``)."""
+import io
+from importlib import metadata
+
+import numpy as np
+import psycopg2
+from psycopg2.extras import execute_values
+from PIL import Image
+
+from config import DETECTION_MAX_SIDE, DETECTOR_BACKEND
+
+
+def image_array(image_bytes: bytes) -> np.ndarray:
+    return np.array(Image.open(io.BytesIO(image_bytes)).convert("RGB"))
+
+
+def compute_embedding(img_array: np.ndarray, model_name: str = "Facenet", detector_backend: str = None):
+    """Embedding du plus grand visage de l'image, ou None en cas d'échec.
+
+    Chemin en ligne : l'inférence passe par le ``DynamicBatcher`` du processus,
+    qui regroupe les requêtes simultanées.
+    """
+    from .batching import detect_face, get_batcher
+    face, _ = detect_face(img_array, detector_backend)
+    if face is None:
+        return None
+    try:
+        return get_batcher(model_name).embed(face)
+    except Exception:
+        return None
+
+
+def model_version(model_name: str) -> str:
+    """Identifiant de ce qui produit les embeddings : modèle, version de DeepFace et détection.
+
+    Le backend de détection et la réduction avant détection changent le visage recadré,
+    donc les vecteurs : ils font partie de la version (instantanés, exports).
+    """
+    try:
+        version = metadata.version("deepface")
+    except metadata.PackageNotFoundError:
+        version = "inconnue"
+    return f"{model_name}@deepface-{version}/{DETECTOR_BACKEND}-{DETECTION_MAX_SIDE or 'full'}"
+
+
+def to_bytes(vector) -> bytes:
+    return np.asarray(vector, dtype=np.float32).tobytes()
+
+
+def from_bytes(data) -> np.ndarray:
+    return np.frombuffer(bytes(data), dtype=np.float32)
+
+
+def normalize(matrix: np.ndarray) -> np.ndarray:
+    """Normalise chaque ligne (norme L2) ; distance cosinus = 1 - produit scalaire."""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
+
+
+def store_embeddings(cursor, model_name: str, rows) -> None:
+    """Enregistre [(image_id, vecteur ou None, qualité)] et met à jour les gabarits.
+
+    None marque une image sans visage exploitable ; la qualité vaut 1 si absente.
+    """
+    from .templates import apply_template_deltas, template_deltas
+
+    rows = [(r[0], r[1], r[2] if len(r) > 2 else 1.0) for r in rows]
+    if not rows:
+        return
+    remove_embeddings(cursor, [image_id for image_id, _, _ in rows], model_name)
+    execute_values(
+        cursor,
+        "INSERT INTO embeddings_criminels (image_id, model_name, embedding, quality) VALUES %s",
+        [
+            (image_id, model_name, psycopg2.Binary(to_bytes(vec)) if vec is not None else None, float(quality))
+            for image_id, vec, quality in rows
+        ],
+    )
+    cursor.execute(
+        "SELECT id, criminal_id FROM images_criminels WHERE id = ANY(%s)",
+        ([image_id for image_id, _, _ in rows],),
+    )
+    owners = dict(cursor.fetchall())
+    apply_template_deltas(
+        cursor,
+        model_name,
+        template_deltas((owners[image_id], vec, quality) for image_id, vec, quality in rows if image_id in owners),
+    )
+
+
+def remove_embeddings(cursor, image_ids, model_name: str = None) -> None:
+    """Supprime les embeddings des photos (tous modèles par défaut) et les retire des gabarits."""
+    from .templates import apply_template_deltas, template_deltas
+
+    cursor.execute(
+        """
+        DELETE FROM embeddings_criminels e USING images_criminels ic
+        WHERE ic.id = e.image_id AND e.image_id = ANY(%s) AND (%s IS NULL OR e.model_name = %s)
+        RETURNING e.model_name, ic.criminal_id, e.embedding, e.quality
+        """,
+        (list(image_ids), model_name, model_name),
+    )
+    removed = {}
+    for model, criminal_id, emb, quality in cursor.fetchall():
+        if emb is not None:
+            removed.setdefault(model, []).append((criminal_id, from_bytes(emb), quality))
+    for model, rows in removed.items():
+        apply_template_deltas(cursor, model, template_deltas(rows, sign=-1.0))
+
+
+def shard_clause(shard=None, column: str = "ic.criminal_id"):
+    """Condition SQL limitant une requête à un shard ``(index, nombre)`` de la galerie."""
+    if shard is None:
+        return "", ()
+    index, count = shard
+    return f" AND {column} %% %s = %s", (int(count), int(index))
+
+
+def count_missing(cursor, model_name: str, shard=None) -> int:
+    clause, params = shard_clause(shard)
+    cursor.execute(
+        """
+        SELECT COUNT(*) FROM images_criminels ic
+        LEFT JOIN embeddings_criminels e ON e.image_id = ic.id AND e.model_name = %s
+        WHERE e.image_id IS NULL
+        """ + clause,
+        (model_name, *params),
+    )
+    return cursor.fetchone()[0]
+
+
+def fetch_missing(cursor, model_name: str, limit: int, shard=None):
+    """Photos sans embedding pour ``model_name`` : [(image_id, bytes)]."""
+    clause, params = shard_clause(shard)
+    cursor.execute(
+        """
+        SELECT ic.id, ic.image FROM images_criminels ic
+        LEFT JOIN embeddings_criminels e ON e.image_id = ic.id AND e.model_name = %s
+        WHERE e.image_id IS NULL""" + clause + """
+        ORDER BY ic.id LIMIT %s
+        """,
+        (model_name, *params, limit),
+    )
+    return [(image_id, bytes(img)) for image_id, img in cursor.fetchall()]
+
+
+def load_embeddings(cursor, model_name: str, shard=None, criminals=None):
+    """Retourne (image_ids, criminal_ids, matrice float32) triés par criminel.
+
+    ``criminals`` : limite le chargement à ces criminels.
+    """
+    clause, params = shard_clause(shard)
+    if criminals is not None:
+        clause += " AND ic.criminal_id = ANY(%s)"
+        params += (list(criminals),)
+    cursor.execute(
+        """
+        SELECT e.image_id, ic.criminal_id, e.embedding
+        FROM embeddings_criminels e
+        JOIN images_criminels ic ON ic.id = e.image_id
+        WHERE e.model_name = %s AND e.embedding IS NOT NULL""" + clause + """
+        ORDER BY ic.criminal_id, e.image_id
+        """,
+        (model_name, *params),
+    )
+    rows = cursor.fetchall()
+    if not rows:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty((0, 0), dtype=np.float32)
+    image_ids = np.fromiter((r[0] for r in rows), dtype=np.int64, count=len(rows))
+    criminal_ids = np.fromiter((r[1] for r in rows), dtype=np.int64, count=len(rows))
+    matrix = np.stack([from_bytes(r[2]) for r in rows])
+    return image_ids, criminal_ids, matrix
@@ -0,0 +1,35 @@
+"""Embedder factice déterministe, activé par DGSN_FAKE_EMBEDDER=1.
+
+Permet les tests de charge sans DeepFace ni TensorFlow : le « visage » est
+l'image entière et son embedding est un vecteur gaussien tiré d'une graine
+dérivée de l'empreinte SHA-256 des pixels. Une même image donne toujours le
+même vecteur (distance 0) ; deux images différentes sont quasi orthogonales.
+"""
+import hashlib
+
+import numpy as np
+
+# Dimension des embeddings de chaque modèle DeepFace
+DIMENSIONS = {
+    "VGG-Face": 4096,
+    "Facenet": 128,
+    "Facenet512": 512,
+    "OpenFace": 128,
+    "DeepFace": 4096,
+    "DeepID": 160,
+    "ArcFace": 512,
+    "Dlib": 128,
+    "SFace": 128,
+    "GhostFaceNet": 512,
+}
+
+
+def fake_face(img_array: np.ndarray) -> np.ndarray:
+    """L'image entière comme visage (RGB dans [0, 1], comme ``detect_face``)."""
+    return np.asarray(img_array, dtype=np.float32) / 255.0
+
+
+def fake_vector(face: np.ndarray, model_name: str = "Facenet") -> np.ndarray:
+    digest = hashlib.sha256(model_name.encode() + np.ascontiguousarray(face).tobytes()).digest()
+    rng = np.random.default_rng(int.from_bytes(digest[:8], "little"))
+    return rng.standard_normal(DIMENSIONS.get(model_name, 128)).astype(np.float32)
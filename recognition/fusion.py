@@ -0,0 +1,147 @@
+"""Fusion des scores de plusieurs photos d'une même personne inconnue.
+
+Pour chaque criminel, chaque requête donne sa meilleure distance (photo la plus
+proche) ; ces distances sont combinées en un score unique :
+  min      la requête la plus proche
+  mean     moyenne des requêtes
+  learned  combinaison pondérée du minimum, de la moyenne et du maximum ; poids
+           et seuil appris sur un jeu étiqueté (python -m recognition.fusion)
+Les poids sont positifs et de somme 1 : le score fusionné est croissant en chaque
+distance et jamais inférieur au minimum, ce qui garde valides les bornes de
+l'index quantifié et l'invalidation du cache.
+
+Usage : python -m recognition.fusion [--data images] [--model Facenet] [--probes 3]
+        [--trials 20] [--target-far 0.001] [--out thresholds.json]
+"""
+import argparse
+import itertools
+import os
+
+import numpy as np
+
+from config import CALIBRATION_TARGET_FAR, THRESHOLDS_FILE
+from .calibration import (
+    load_dataset,
+    match_threshold,
+    model_config,
+    operating_point,
+    pairwise_distances,
+    write_thresholds,
+)
+from .pool import embed_images
+
+FUSIONS = ("min", "mean", "learned")
+# Poids (minimum, moyenne, maximum) sans apprentissage : fusion par le minimum
+DEFAULT_WEIGHTS = (1.0, 0.0, 0.0)
+
+
+def fuse(distances, fusion: str = "min", weights=None) -> np.ndarray:
+    """Score de chaque ligne de ``distances`` (criminels x requêtes)."""
+    distances = np.asarray(distances)
+    if fusion == "min":
+        return distances.min(axis=1)
+    if fusion == "mean":
+        return distances.mean(axis=1)
+    if fusion != "learned":
+        raise ValueError(f"Fusion inconnue : {fusion}")
+    fused = np.zeros(len(distances), dtype=distances.dtype)
+    for weight, reduce in zip(weights or DEFAULT_WEIGHTS, (np.min, np.mean, np.max)):
+        # Un poids nul n'intervient pas (0 x inf)
+        if weight:
+            fused += np.float32(weight) * reduce(distances, axis=1)
+    return fused
+
+
+def fusion_weights(model_name: str = "Facenet", path: str = THRESHOLDS_FILE):
+    """Poids appris (minimum, moyenne, maximum) de ``model_name``, ou ceux par défaut."""
+    weights = model_config(model_name, path).get("fusion", {}).get("weights")
+    return tuple(float(w) for w in weights) if weights else DEFAULT_WEIGHTS
+
+
+def fusion_threshold(model_name: str = "Facenet", fusion: str = "min", path: str = THRESHOLDS_FILE) -> float:
+    """Seuil du score fusionné : appris pour ``learned``, sinon le seuil calibré du modèle."""
+    if fusion == "learned":
+        learned = model_config(model_name, path).get("fusion", {})
+        if "threshold" in learned:
+            return float(learned["threshold"])
+    return match_threshold(model_name, path)
+
+
+def probe_features(distances, labels, probes: int, trials: int = 20, seed: int = 0):
+    """(minimum, moyenne, maximum) des scores de jeux de ``probes`` requêtes tirés du jeu étiqueté.
+
+    Chaque jeu vient d'une personne ayant au moins ``probes`` + 1 photos : il est
+    comparé à ses autres photos (authentique) et à toutes les autres personnes
+    (imposteurs). Retourne (caractéristiques authentiques, imposteurs).
+    """
+    labels = np.asarray(labels)
+    order = np.argsort(labels, kind="stable")
+    labels, distances = labels[order], distances[np.ix_(order, order)]
+    _, starts, counts = np.unique(labels, return_index=True, return_counts=True)
+    rng = np.random.default_rng(seed)
+    genuine, impostor = [], []
+    for person in np.flatnonzero(counts > probes):
+        members = np.arange(starts[person], starts[person] + counts[person])
+        for _ in range(trials):
+            chosen = rng.choice(members, probes, replace=False)
+            rows = distances[chosen].copy()
+            rows[:, chosen] = np.inf
+            # Meilleure distance de chaque requête à chaque personne : criminels x requêtes
+            best = np.minimum.reduceat(rows, starts, axis=1).T
+            features = np.stack([best.min(axis=1), best.mean(axis=1), best.max(axis=1)], axis=1)
+            genuine.append(features[person])
+            impostor.append(np.delete(features, person, axis=0))
+    if not genuine:
+        raise ValueError(f"Il faut au moins une personne avec {probes + 1} visages détectés")
+    return np.stack(genuine), np.concatenate(impostor)
+
+
+def fit_fusion(genuine, impostor, target_far: float = CALIBRATION_TARGET_FAR, step: float = 0.1) -> dict:
+    """Poids (minimum, moyenne, maximum) de plus faible taux d'égale erreur, grille de pas ``step``."""
+    grid = np.round(np.arange(0.0, 1.0 + step / 2, step), 6)
+    best = None
+    for w_min, w_mean in itertools.product(grid, grid):
+        if w_min + w_mean > 1.0 + 1e-9:
+            continue
+        weights = np.array([w_min, w_mean, max(0.0, 1.0 - w_min - w_mean)])
+        point = operating_point(np.sort(genuine @ weights), np.sort(impostor @ weights), target_far)
+        if best is None or point["eer"] < best["eer"]:
+            best = {**point, "weights": [float(w) for w in weights]}
+    baselines = {
+        name: operating_point(np.sort(genuine @ w), np.sort(impostor @ w), target_far)["eer"]
+        for name, w in (("min", np.array([1.0, 0.0, 0.0])), ("mean", np.array([0.0, 1.0, 0.0])))
+    }
+    return {**best, "baseline_eer": baselines}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Apprentissage de la fusion multi-requêtes")
+    parser.add_argument("--data", default="images")
+    parser.add_argument("--model", default="Facenet")
+    parser.add_argument("--probes", type=int, default=3, help="Photos de la personne inconnue par recherche")
+    parser.add_argument("--trials", type=int, default=20, help="Jeux de requêtes tirés par personne")
+    parser.add_argument("--target-far", type=float, default=CALIBRATION_TARGET_FAR)
+    parser.add_argument("--out", default=THRESHOLDS_FILE)
+    args = parser.parse_args()
+
+    from utils import initialize_deepface
+    initialize_deepface()
+    samples = load_dataset(args.data)
+    vectors = embed_images([data for _, data in samples], args.model,
+                           progress=lambda d, t: print(f"{d}/{t} images", flush=True))
+    kept = [(label, vec) for (label, _), vec in zip(samples, vectors) if vec is not None]
+    distances = pairwise_distances(np.stack([vec for _, vec in kept]), "cosine")
+    genuine, impostor = probe_features(distances, [label for label, _ in kept], args.probes, args.trials)
+    result = fit_fusion(genuine, impostor, args.target_far)
+    result["probes"] = args.probes
+    print(
+        f"{args.model} : poids (min, moyenne, max) = {tuple(round(w, 2) for w in result['weights'])} "
+        f"seuil={result['threshold']:.4f} EER={result['eer']:.4f} "
+        f"(min : {result['baseline_eer']['min']:.4f}, moyenne : {result['baseline_eer']['mean']:.4f})"
+    )
+    write_thresholds({args.model: {"fusion": result}}, args.out, dataset=os.path.abspath(args.data))
+    print(f"Fusion enregistrée -> {args.out}")
+
+
+if __name__ == "__main__":
+    main()
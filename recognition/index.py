@@ -0,0 +1,522 @@
+"""Index en mémoire des embeddings de la galerie, reconstruit à chaque version.
+
+La recherche se fait en deux étapes : les gabarits (un par criminel) classent les
+identités, puis les meilleurs candidats sont départagés photo par photo.
+Avec une matrice quantifiée, la première étape porte sur toutes les photos en
+précision réduite, et la seconde relit depuis le disque les vecteurs exacts des
+seuls candidats dont la borne d'erreur ne permet pas d'exclure qu'ils figurent
+dans le top-k.
+"""
+import threading
+
+import numpy as np
+
+from config import (
+    INDEX_DIR,
+    INDEX_QUANTIZATION,
+    INDEX_SNAPSHOTS,
+    SEARCH_SHORTLIST,
+    SEARCH_SHORTLIST_FACTOR,
+    SNAPSHOT_COMPACT_CHANGES,
+    STREAM_PARTITION_ROWS,
+)
+from .backfill import backfill_async
+from .cache import gallery_version, search_cache
+from .embeddings import load_embeddings, normalize
+from .fusion import fuse
+from .quantization import QuantizedMatrix, spill_to_disk
+from .templates import load_templates
+
+
+class GalleryIndex:
+    """Matrice normalisée des embeddings (lignes triées par criminel) et gabarits par criminel."""
+
+    def __init__(self, model_name: str, image_ids, criminal_ids, vectors, version=None, templates=None,
+                 quantization: str = INDEX_QUANTIZATION, store_dir: str = INDEX_DIR):
+        self.model_name = model_name
+        self.version = version
+        self.image_ids = np.asarray(image_ids, dtype=np.int64)
+        self.criminal_ids = np.asarray(criminal_ids, dtype=np.int64)
+        self.matrix = normalize(vectors) if len(self.image_ids) else np.empty((0, 0), dtype=np.float32)
+        # Plage de lignes [starts, ends) de chaque criminel
+        self.persons, self.starts = np.unique(self.criminal_ids, return_index=True)
+        self.ends = np.append(self.starts[1:], len(self.image_ids)).astype(np.int64)
+        self.templates = self._build_templates(templates or {})
+        self.coarse = None
+        if quantization not in (None, "none") and len(self.image_ids):
+            # En mémoire : la matrice quantifiée ; la pleine précision est projetée depuis le disque
+            self.coarse = QuantizedMatrix.quantize(self.matrix, quantization)
+            self.matrix = spill_to_disk(self.matrix, store_dir)
+
+    @classmethod
+    def from_arrays(cls, model_name: str, image_ids, criminal_ids, matrix, persons, starts, templates,
+                    version=None, coarse=None) -> "GalleryIndex":
+        """Index sur des tableaux déjà normalisés et triés (instantané projeté en mémoire), sans copie."""
+        index = cls.__new__(cls)
+        index.model_name = model_name
+        index.version = version
+        index.image_ids = image_ids
+        index.criminal_ids = criminal_ids
+        index.matrix = matrix
+        index.persons = persons
+        index.starts = starts
+        index.ends = np.append(starts[1:], len(image_ids)).astype(np.int64)
+        index.templates = templates
+        index.coarse = coarse
+        return index
+
+    def _build_templates(self, stored) -> np.ndarray:
+        if not len(self.persons):
+            return np.empty((0, 0), dtype=np.float32)
+        # Gabarit manquant en base : moyenne simple des photos en mémoire
+        sums = np.add.reduceat(self.matrix, self.starts, axis=0)
+        for k, cid in enumerate(self.persons):
+            vec = stored.get(int(cid))
+            if vec is not None and vec.shape == sums[k].shape:
+                sums[k] = vec
+        return normalize(sums)
+
+    def __len__(self) -> int:
+        return len(self.image_ids)
+
+    def distances(self, query) -> np.ndarray:
+        """Distance cosinus entre la requête et chaque photo."""
+        return 1.0 - self.matrix @ normalize(query)
+
+    def _shortlist_size(self, top_k: int) -> int:
+        return max(SEARCH_SHORTLIST, SEARCH_SHORTLIST_FACTOR * max(1, int(top_k)))
+
+    def _rows(self, positions) -> np.ndarray:
+        """Lignes de la matrice des criminels ``positions`` (indices dans ``persons``)."""
+        sizes = self.ends[positions] - self.starts[positions]
+        offsets = np.repeat(self.starts[positions] - np.cumsum(sizes) + sizes, sizes)
+        return offsets + np.arange(sizes.sum())
+
+    def _rerank(self, query, template_distances, threshold: float, top_k: int, positions=None):
+        """Deuxième étape : photos des criminels dont le gabarit est le plus proche.
+
+        ``positions`` : criminels correspondant à ``template_distances`` (tous par défaut).
+        """
+        size = self._shortlist_size(top_k)
+        candidates = np.argpartition(template_distances, size)[:size]
+        candidates = candidates[np.isfinite(template_distances[candidates])]
+        if not len(candidates):
+            return []
+        rows = self._rows(positions[candidates] if positions is not None else candidates)
+        distances = 1.0 - self.matrix[rows] @ query
+        return best_per_person(self.criminal_ids[rows], self.image_ids[rows], distances, threshold, top_k)
+
+    def search(self, query, threshold: float, top_k: int, criminals=None):
+        """Meilleure photo par criminel sous le seuil : [(criminal_id, image_id, distance)]."""
+        return self.search_many([query], threshold, top_k, criminals=criminals)[0]
+
+    def search_many(self, queries, threshold: float, top_k: int, exclude=None, criminals=None):
+        """Recherche de plusieurs requêtes ; la première étape est un seul produit matriciel.
+
+        ``exclude`` : masque booléen sur ``persons`` des criminels à ignorer.
+        ``criminals`` : identifiants (préfiltre SQL, voir database.filters) auxquels
+        limiter la recherche. S'ils sont minoritaires, seuls leurs gabarits et leurs
+        photos sont lus : le coût suit la taille du filtre.
+        """
+        if not len(queries):
+            return []
+        if not len(self):
+            return [[] for _ in queries]
+        queries = normalize(np.stack(queries))
+        if criminals is not None:
+            keep = self._person_mask(criminals)
+            if exclude is not None:
+                keep &= ~exclude
+            positions = np.flatnonzero(keep)
+            # Filtre large : le parcours complet, criminels écartés, coûte moins que la copie des
+            # lignes (jusqu'à 20 % des criminels en float32, 50 % avec les codes quantifiés)
+            if len(positions) * (2 if self.coarse is not None else 5) > len(self.persons):
+                exclude = ~keep
+            else:
+                return self._search_persons(queries, positions, threshold, top_k)
+        if self.coarse is not None:
+            return self._search_quantized(queries, threshold, top_k, exclude)
+        if len(self.persons) <= self._shortlist_size(top_k):
+            distances = 1.0 - self.matrix @ queries.T
+            if exclude is not None:
+                distances[np.repeat(exclude, self.ends - self.starts)] = np.inf
+            return [
+                best_per_person(self.criminal_ids, self.image_ids, distances[:, j], threshold, top_k)
+                for j in range(len(queries))
+            ]
+        template_distances = 1.0 - self.templates @ queries.T
+        if exclude is not None:
+            template_distances[exclude] = np.inf
+        return [
+            self._rerank(queries[j], template_distances[:, j], threshold, top_k)
+            for j in range(len(queries))
+        ]
+
+    def search_stream(self, query, threshold: float, top_k: int, exclude=None, criminals=None,
+                      partition_rows: int = STREAM_PARTITION_ROWS):
+        """Recherche progressive : produit le top-k provisoire après chaque partition de la galerie.
+
+        Les partitions sont des tranches disjointes de criminels (environ ``partition_rows``
+        photos chacune), cherchées comme ``search_many`` ; le dernier top-k produit est définitif.
+        """
+        if not len(self):
+            return
+        queries = normalize(np.stack([query]))
+        keep = self._person_mask(criminals) if criminals is not None else np.ones(len(self.persons), dtype=bool)
+        if exclude is not None:
+            keep &= ~exclude
+        edges = np.unique(np.append(np.searchsorted(self.starts, np.arange(0, len(self), max(1, partition_rows))),
+                                    len(self.persons)))
+        best = []
+        for first, last in zip(edges[:-1], edges[1:]):
+            positions = np.flatnonzero(keep[first:last]) + first
+            if not len(positions):
+                continue
+            found = self._search_persons(queries, positions, threshold, top_k)[0]
+            if found:
+                best = merge_matches([best, found], top_k)
+            yield best
+
+    def search_fused(self, queries, threshold: float, top_k: int, fusion: str = "min", weights=None,
+                     exclude=None, criminals=None):
+        """Plusieurs photos d'une même personne : un classement unique [(criminal_id, image_id, score)].
+
+        Un seul produit matriciel (photos x requêtes) ; la meilleure distance de chaque
+        criminel à chaque requête est fusionnée (recognition.fusion) puis filtrée au seuil.
+        ``image_id`` est la photo du criminel la plus proche de l'une des requêtes.
+        Avec l'index quantifié, les bornes fusionnées écartent les criminels hors top-k
+        avant le calcul exact, comme ``_search_quantized``.
+        """
+        if not len(queries) or not len(self):
+            return []
+        queries = normalize(np.stack(queries))
+        k = max(1, int(top_k))
+        keep = None
+        if criminals is not None or exclude is not None:
+            keep = self._person_mask(criminals) if criminals is not None else np.ones(len(self.persons), dtype=bool)
+            if exclude is not None:
+                keep &= ~exclude
+        positions = np.flatnonzero(keep) if keep is not None else None
+        # Filtre large : parcours complet, criminels écartés (même seuil que search_many)
+        if positions is not None and len(positions) * (2 if self.coarse is not None else 5) > len(self.persons):
+            positions = None
+        if self.coarse is not None:
+            rows = self._rows(positions) if positions is not None else None
+            sizes = self.ends - self.starts if positions is None else self.ends[positions] - self.starts[positions]
+            approx = 1.0 - self.coarse.dot(queries, rows)
+            error = (self.coarse.error if rows is None else self.coarse.error[rows])[:, None]
+            starts = np.cumsum(sizes) - sizes
+            lower = fuse(np.minimum.reduceat(approx - error, starts), fusion, weights)
+            upper = fuse(np.minimum.reduceat(approx + error, starts), fusion, weights)
+            if positions is None and keep is not None:
+                lower[~keep] = upper[~keep] = np.inf
+            bound = float(threshold)
+            if len(upper) > k:
+                bound = min(bound, float(np.partition(upper, k - 1)[k - 1]))
+            candidates = np.flatnonzero(lower <= bound)
+            positions = positions[candidates] if positions is not None else candidates
+            keep = None
+        if positions is not None and not len(positions):
+            return []
+        if positions is None:
+            rows, sizes = None, self.ends - self.starts
+            similarities = np.asarray(self.matrix) @ queries.T
+        else:
+            rows, sizes = self._rows(positions), self.ends[positions] - self.starts[positions]
+            similarities = np.asarray(self.matrix[rows]) @ queries.T
+        starts = np.cumsum(sizes) - sizes
+        scores = fuse(1.0 - np.maximum.reduceat(similarities, starts, axis=0), fusion, weights)
+        if keep is not None and rows is None:
+            scores[~keep] = np.inf
+        best = np.flatnonzero(scores <= threshold)
+        best = best[np.argsort(scores[best], kind="stable")][:k]
+        results = []
+        for i in best:
+            row = starts[i] + int(np.argmax(similarities[starts[i]:starts[i] + sizes[i]].max(axis=1)))
+            if rows is not None:
+                row = rows[row]
+            results.append((int(self.criminal_ids[row]), int(self.image_ids[row]), float(scores[i])))
+        return results
+
+    def _person_mask(self, criminals) -> np.ndarray:
+        """Masque sur ``persons`` des criminels listés (``persons`` est trié)."""
+        criminals = np.asarray(criminals, dtype=np.int64)
+        mask = np.zeros(len(self.persons), dtype=bool)
+        if not len(criminals) or not len(self.persons):
+            return mask
+        top = max(int(criminals.max()), int(self.persons[-1]))
+        if top <= 8 * (len(self.persons) + len(criminals)):
+            # Identifiants denses : table indexée par identifiant
+            lookup = np.zeros(top + 1, dtype=bool)
+            lookup[criminals] = True
+            return lookup[self.persons]
+        positions = np.searchsorted(self.persons, criminals)
+        found = positions < len(self.persons)
+        positions = positions[found]
+        mask[positions[self.persons[positions] == criminals[found]]] = True
+        return mask
+
+    def _search_persons(self, queries, positions, threshold: float, top_k: int):
+        """Recherche limitée aux criminels ``positions`` : gabarits puis photos, ou photos seules s'ils sont peu nombreux."""
+        if not len(positions):
+            return [[] for _ in queries]
+        if self.coarse is not None:
+            return self._search_quantized(queries, threshold, top_k, positions=positions)
+        if len(positions) > self._shortlist_size(top_k):
+            template_distances = 1.0 - self.templates[positions] @ queries.T
+            return [
+                self._rerank(queries[j], template_distances[:, j], threshold, top_k, positions)
+                for j in range(len(queries))
+            ]
+        rows = self._rows(positions)
+        distances = 1.0 - np.asarray(self.matrix[rows]) @ queries.T
+        return [
+            best_per_person(self.criminal_ids[rows], self.image_ids[rows], distances[:, j], threshold, top_k)
+            for j in range(len(queries))
+        ]
+
+    def _search_quantized(self, queries, threshold: float, top_k: int, exclude=None, positions=None):
+        """Passe approchée sur toute la matrice quantifiée, puis distances exactes des candidats.
+
+        Pour chaque criminel, sa meilleure distance exacte est encadrée par les bornes
+        [approchée - erreur, approchée + erreur]. Un criminel dont la borne basse dépasse
+        la k-ième borne haute (ou le seuil) ne peut pas être dans le top-k : seuls les
+        autres sont relus en pleine précision, le classement est donc identique.
+        ``positions`` : limite la recherche à ces criminels (indices dans ``persons``).
+        """
+        k = max(1, int(top_k))
+        if positions is None:
+            all_rows, starts, sizes = None, self.starts, self.ends - self.starts
+        else:
+            all_rows = self._rows(positions)
+            sizes = self.ends[positions] - self.starts[positions]
+            starts = np.cumsum(sizes) - sizes
+        approx = 1.0 - self.coarse.dot(queries, all_rows)
+        error = self.coarse.error if all_rows is None else self.coarse.error[all_rows]
+        results = []
+        for j in range(len(queries)):
+            lower = np.minimum.reduceat(approx[:, j] - error, starts)
+            upper = np.minimum.reduceat(approx[:, j] + error, starts)
+            if exclude is not None:
+                lower[exclude] = upper[exclude] = np.inf
+            bound = float(threshold)
+            if len(upper) > k:
+                bound = min(bound, float(np.partition(upper, k - 1)[k - 1]))
+            rows = np.flatnonzero(np.repeat(lower <= bound, sizes))
+            if all_rows is not None:
+                rows = all_rows[rows]
+            if not len(rows):
+                results.append([])
+                continue
+            distances = 1.0 - np.asarray(self.matrix[rows]) @ queries[j]
+            results.append(best_per_person(self.criminal_ids[rows], self.image_ids[rows], distances, threshold, top_k))
+        return results
+
+
+def merge_matches(lists, top_k: int):
+    """Fusionne des listes [(criminal_id, image_id, distance)] portant sur des criminels distincts."""
+    merged = [match for matches in lists for match in matches]
+    merged.sort(key=lambda m: m[2])
+    return merged[:max(1, int(top_k))]
+
+
+def best_per_person(criminal_ids, image_ids, distances, threshold: float, top_k: int):
+    """Garde la distance minimale de chaque criminel, filtre au seuil et trie."""
+    # Le seuil d'abord : seules les lignes retenues sont triées
+    order = np.flatnonzero(distances <= threshold)
+    order = order[np.lexsort((distances[order], criminal_ids[order]))]
+    _, first = np.unique(criminal_ids[order], return_index=True)
+    best = order[first]
+    best = best[np.argsort(distances[best], kind="stable")][:max(1, int(top_k))]
+    return [(int(criminal_ids[i]), int(image_ids[i]), float(distances[i])) for i in best]
+
+
+_indexes = {}
+# Protège ``_indexes`` : jamais tenu pendant un chargement depuis la base ou le disque
+_lock = threading.Lock()
+# Un verrou de construction par index : le chargement de l'un ne bloque pas les recherches sur les autres
+_build_locks = {}
+# Index en construction : criminels modifiés pendant le chargement (None : tout invalider)
+_pending = {}
+
+
+def get_gallery_index(cursor, model_name: str = "Facenet", shard=None) -> GalleryIndex:
+    """Index du processus pour ``model_name``, reconstruit quand la galerie change.
+
+    Les photos sans embedding (anciennes données) sont calculées en arrière-plan
+    (``backfill_async``) : la recherche porte sur celles déjà calculées.
+    ``shard`` : (index, nombre) pour ne charger que les criminels d'un shard.
+    Avec DGSN_INDEX_SNAPSHOTS, l'index part de l'instantané sur disque (recognition.snapshot).
+    Tant que le listener NOTIFY est connecté, l'index est tenu à jour par
+    ``apply_gallery_changes`` : la version de la galerie n'est plus interrogée.
+    """
+    from .snapshot import is_current, load_index
+
+    key = (model_name, shard)
+    listener = watch_gallery()
+    with _lock:
+        stale = _indexes.get(key)
+    if stale is not None and listener is not None and listener.connected.is_set() and is_current(stale, shard):
+        return stale
+    version = gallery_version(cursor)
+    if stale is not None and version is not None and stale.version == version and is_current(stale, shard):
+        return stale
+
+    with _lock:
+        build_lock = _build_locks.setdefault(key, threading.Lock())
+    with build_lock:
+        with _lock:
+            current = _indexes.get(key)
+        # Reconstruit pendant l'attente par une autre recherche
+        if current is not None and current is not stale and (version is None or current.version == version):
+            return current
+        backfill_async(model_name, shard)
+        with _lock:
+            _pending[key] = set()
+        try:
+            index = None
+            if INDEX_SNAPSHOTS:
+                try:
+                    index = load_index(cursor, model_name, shard, version)
+                except Exception as e:
+                    print(f"Instantané de l'index indisponible ({e})")
+            if index is None:
+                index = GalleryIndex(
+                    model_name,
+                    *load_embeddings(cursor, model_name, shard),
+                    version=version,
+                    templates=load_templates(cursor, model_name, shard),
+                )
+        finally:
+            with _lock:
+                changed = _pending.pop(key)
+        if changed is None:
+            # Notifications perdues pendant le chargement : index utilisé pour cette recherche seulement
+            return index
+        with _lock:
+            _indexes[key] = index
+        if changed:
+            # Modifications notifiées pendant le chargement, peut-être absentes de l'index
+            _update_index(cursor, key, changed)
+            with _lock:
+                index = _indexes.get(key, index)
+        return index
+
+
+def watch_gallery():
+    """Listener NOTIFY du processus, abonné à ``apply_gallery_changes`` ; None si désactivé."""
+    from database.notifications import get_listener
+
+    listener = get_listener()
+    if listener is not None:
+        listener.subscribe(apply_gallery_changes)
+    return listener
+
+
+def gallery_token(cursor):
+    """Jeton de validité des résultats de recherche mis en cache.
+
+    Listener connecté : son époque (les entrées touchées sont retirées à réception
+    des notifications) ; sinon la version de la galerie, ou None si indisponible.
+    """
+    listener = watch_gallery()
+    if listener is not None and listener.connected.is_set():
+        return ("notify", listener.epoch)
+    return gallery_version(cursor)
+
+
+def apply_gallery_changes(cursor, events) -> None:
+    """Applique un lot de notifications aux index et au cache de recherche du processus.
+
+    Les criminels touchés sont rechargés dans l'index en mémoire de chaque index
+    (voir ``SnapshotIndex.updated``), hors du verrou : les recherches continuent
+    sur l'index courant, remplacé une fois prêt. Une entrée du cache est retirée
+    si elle contient l'un d'eux, ou si l'une de leurs photos actuelles entre
+    désormais dans son top-k ; les recherches commencées avant ne sont pas mises
+    en cache (``search_cache.bump``). ``events=None`` (reconnexion) vide tout.
+    """
+    if events is None:
+        with _lock:
+            _indexes.clear()
+            for key in _pending:
+                _pending[key] = None
+        search_cache.bump()
+        search_cache.clear()
+        return
+    touched = {}
+    for event in events:
+        touched.setdefault(event.get("model_name"), set()).add(int(event["criminal_id"]))
+    # Fiche ou photo (model_name nul) : concerne tous les modèles
+    common = touched.pop(None, set())
+    with _lock:
+        keys = list(_indexes)
+        for (model, shard), changed in _pending.items():
+            if changed is not None:
+                changed.update(
+                    cid for cid in common | touched.get(model, set())
+                    if shard is None or cid % shard[1] == shard[0]
+                )
+    models = {model for model, _ in keys} | {key[1] for key in search_cache.keys()} | set(touched)
+    for model in models:
+        criminals = common | touched.get(model, set())
+        if not criminals:
+            continue
+        for key in [key for key in keys if key[0] == model]:
+            shard = key[1]
+            ids = {cid for cid in criminals if shard is None or cid % shard[1] == shard[0]}
+            if ids:
+                _update_index(cursor, key, ids)
+        # Après le remplacement des index : une recherche qui lit la génération suivante voit les modifications
+        search_cache.bump()
+        _discard_results(cursor, model, criminals)
+
+
+def _update_index(cursor, key, criminals) -> None:
+    """Recharge ``criminals`` dans l'index ``key`` hors du verrou, puis le remplace."""
+    from .snapshot import SnapshotIndex, compact_async
+
+    while True:
+        with _lock:
+            current = _indexes.get(key)
+        if current is None:
+            return
+        index = current if isinstance(current, SnapshotIndex) else SnapshotIndex(current, None, (), current.version)
+        index = index.updated(cursor, criminals, key[1])
+        with _lock:
+            # Index remplacé entre-temps (rechargement) : les modifications lui sont appliquées
+            if _indexes.get(key) is not current:
+                continue
+            if len(index.dirty) < SNAPSHOT_COMPACT_CHANGES:
+                _indexes[key] = index
+                return
+            if index.snapshot is None:
+                # Sans instantané : reconstruction complète à la prochaine recherche
+                del _indexes[key]
+                return
+            _indexes[key] = index
+        compact_async(key[0], key[1])
+        return
+
+
+def _discard_results(cursor, model_name: str, criminals) -> None:
+    """Retire du cache les résultats de ``model_name`` que la modification de ``criminals`` peut changer."""
+    if not any(key[1] == model_name for key in search_cache.keys()):
+        return
+    _, _, vectors = load_embeddings(cursor, model_name, None, criminals)
+    vectors = normalize(vectors) if len(vectors) else None
+
+    def stale(key, value) -> bool:
+        if key[1] != model_name:
+            return False
+        query, results = value
+        if any(result["id"] in criminals for result in results):
+            return True
+        if query is None or vectors is None:
+            return False
+        threshold, top_k = key[2], key[3]
+        # Plusieurs requêtes (recherche fusionnée) : le score fusionné n'est jamais sous
+        # la meilleure distance de l'une d'elles
+        best = 1.0 - float(np.max(vectors @ normalize(query).T))
+        return best <= threshold and (len(results) < top_k or best < results[-1]["distance"])
+
+    search_cache.discard_if(stale)
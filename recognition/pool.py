@@ -0,0 +1,120 @@
+"""Pool de processus pour la détection et le calcul des embeddings.
+
+Chaque processus charge le modèle une seule fois ; le nombre de threads
+TensorFlow par processus est fixé avant l'import de TensorFlow pour que
+``processus x threads`` ne dépasse pas le nombre de cœurs.
+"""
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from config import EMBED_CHUNK_SIZE, EMBED_POOL_MIN_BATCH, EMBED_THREADS_PER_WORKER, EMBED_WORKERS
+
+_worker_model = None
+
+
+def _init_worker(model_name: str, threads: int) -> None:
+    global _worker_model
+    for var in ("TF_NUM_INTRAOP_THREADS", "OMP_NUM_THREADS", "MKL_NUM_THREADS"):
+        os.environ[var] = str(threads)
+    os.environ["TF_NUM_INTEROP_THREADS"] = "1"
+    import tensorflow as tf
+    tf.config.threading.set_intra_op_parallelism_threads(threads)
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+
+    from utils import initialize_deepface
+    initialize_deepface()
+    from deepface import DeepFace
+    DeepFace.build_model(model_name)
+    _worker_model = model_name
+
+
+def _decode(images_bytes):
+    from .embeddings import image_array
+    arrays = []
+    for data in images_bytes:
+        try:
+            arrays.append(image_array(data))
+        except Exception:
+            arrays.append(None)
+    return arrays
+
+
+def _embed_arrays(arrays, model_name: str):
+    """[(embedding ou None, qualité)] pour chaque image décodée."""
+    from .batching import embed_batch
+    valid = [i for i, arr in enumerate(arrays) if arr is not None]
+    embedded = embed_batch([arrays[i] for i in valid], model_name, with_quality=True)
+    results = [(None, 0.0)] * len(arrays)
+    for i, item in zip(valid, embedded):
+        results[i] = item
+    return results
+
+
+def _embed_chunk(images_bytes):
+    return _embed_arrays(_decode(images_bytes), _worker_model)
+
+
+class EmbeddingPool:
+    """Calcule des embeddings en parallèle, par lots de ``chunk_size`` images par tâche.
+
+    Chaque tâche passe ses visages dans le modèle par lots (``embed_batch``).
+    """
+
+    def __init__(self, model_name: str = "Facenet", workers: int = EMBED_WORKERS,
+                 threads_per_worker: int = EMBED_THREADS_PER_WORKER, chunk_size: int = EMBED_CHUNK_SIZE):
+        self.model_name = model_name
+        self.workers = workers
+        self.chunk_size = max(1, chunk_size)
+        self._executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(model_name, threads_per_worker),
+        )
+
+    def embed(self, images_bytes, progress=None):
+        """Retourne (embedding ou None, qualité) par image, dans l'ordre d'entrée."""
+        images_bytes = list(images_bytes)
+        # Petits lots pour répartir la charge, mais assez gros pour amortir le coût par tâche
+        chunk_size = min(self.chunk_size, max(1, -(-len(images_bytes) // self.workers)))
+        chunks = [images_bytes[i:i + chunk_size] for i in range(0, len(images_bytes), chunk_size)]
+        results = []
+        for chunk_result in self._executor.map(_embed_chunk, chunks):
+            results.extend(chunk_result)
+            if progress:
+                progress(len(results), len(images_bytes))
+        return results
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(model_name: str = "Facenet") -> EmbeddingPool:
+    """Pool partagé du processus, créé à la première utilisation."""
+    with _pools_lock:
+        if model_name not in _pools:
+            _pools[model_name] = EmbeddingPool(model_name)
+        return _pools[model_name]
+
+
+def embed_images(images_bytes, model_name: str = "Facenet", progress=None, with_quality: bool = False):
+    """Embeddings d'une liste d'images : pool de processus pour les lots, sinon en local.
+
+    Avec ``with_quality``, retourne des couples (embedding, qualité du visage).
+    """
+    images_bytes = list(images_bytes)
+    # Pas de pool imbriqué dans un processus de travail (service, tâches) : surallocation des cœurs
+    in_worker = multiprocessing.parent_process() is not None
+    if len(images_bytes) >= EMBED_POOL_MIN_BATCH and EMBED_WORKERS > 1 and not in_worker:
+        results = get_pool(model_name).embed(images_bytes, progress)
+    else:
+        results = _embed_arrays(_decode(images_bytes), model_name)
+        if progress:
+            progress(len(results), len(images_bytes))
+    return results if with_quality else [vec for vec, _ in results]
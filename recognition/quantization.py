@@ -0,0 +1,89 @@
+"""Matrice d'embeddings quantifiée (float16, ou int8 avec une échelle par vecteur).
+
+Chaque ligne garde la norme de son erreur de quantification : pour une requête
+normalisée, l'écart entre produit scalaire approché et exact est borné par
+cette erreur, ce qui permet une deuxième passe exacte sans perte de résultats.
+"""
+import os
+import tempfile
+
+import numpy as np
+
+MODES = ("none", "float16", "int8")
+BLOCK_ROWS = 65536
+# Marge pour les arrondis du calcul en float32
+ROUNDING_SLACK = 1e-5
+
+
+class QuantizedMatrix:
+    """Codes quantifiés, échelles (int8) et borne d'erreur de chaque ligne."""
+
+    def __init__(self, codes: np.ndarray, scales, error: np.ndarray, mode: str):
+        self.codes = codes
+        self.scales = scales
+        self.error = error
+        self.mode = mode
+
+    @classmethod
+    def quantize(cls, matrix: np.ndarray, mode: str = "int8") -> "QuantizedMatrix":
+        if mode not in ("float16", "int8"):
+            raise ValueError(f"Quantification inconnue : {mode}")
+        n = len(matrix)
+        codes = np.empty(matrix.shape, dtype=np.float16 if mode == "float16" else np.int8)
+        scales = np.empty(n, dtype=np.float32) if mode == "int8" else None
+        error = np.empty(n, dtype=np.float32)
+        for start in range(0, n, BLOCK_ROWS):
+            block = np.asarray(matrix[start:start + BLOCK_ROWS], dtype=np.float32)
+            if mode == "int8":
+                scale = np.abs(block).max(axis=1) / 127.0
+                scale[scale == 0] = 1.0
+                codes[start:start + len(block)] = np.round(block / scale[:, None])
+                scales[start:start + len(block)] = scale
+                restored = codes[start:start + len(block)].astype(np.float32) * scale[:, None]
+            else:
+                codes[start:start + len(block)] = block
+                restored = codes[start:start + len(block)].astype(np.float32)
+            error[start:start + len(block)] = np.linalg.norm(block - restored, axis=1) + ROUNDING_SLACK
+        return cls(codes, scales, error, mode)
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes + self.error.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def dot(self, queries: np.ndarray, rows=None) -> np.ndarray:
+        """Produits scalaires approchés (lignes x requêtes), décodés par blocs.
+
+        ``rows`` : limite le calcul à ces lignes (dans cet ordre).
+        """
+        queries = np.asarray(queries, dtype=np.float32)
+        n = len(self.codes) if rows is None else len(rows)
+        out = np.empty((n, len(queries)), dtype=np.float32)
+        for start in range(0, n, BLOCK_ROWS):
+            index = slice(start, start + BLOCK_ROWS) if rows is None else rows[start:start + BLOCK_ROWS]
+            block = self.codes[index].astype(np.float32)
+            out[start:start + len(block)] = block @ queries.T
+            if self.scales is not None:
+                out[start:start + len(block)] *= self.scales[index, None]
+        return out
+
+
+def spill_to_disk(matrix: np.ndarray, directory: str) -> np.ndarray:
+    """Écrit la matrice pleine précision et la relit projetée en mémoire (lecture seule).
+
+    Le fichier est supprimé aussitôt : la projection reste valide jusqu'à sa libération
+    (sous Windows, un fichier projeté ne peut pas être supprimé : il reste dans ``directory``).
+    """
+    os.makedirs(directory, exist_ok=True)
+    fd, path = tempfile.mkstemp(suffix=".npy", dir=directory)
+    os.close(fd)
+    try:
+        np.save(path, np.asarray(matrix, dtype=np.float32))
+        return np.load(path, mmap_mode="r")
+    finally:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
@@ -0,0 +1,385 @@
+"""Instantanés de l'index sur disque : démarrage immédiat et pages partagées entre processus.
+
+Un instantané est un répertoire de fichiers .npy (vecteurs normalisés triés par
+criminel, identifiants, gabarits, codes quantifiés) projetés en lecture seule :
+les processus d'une même machine partagent les pages du cache système. Les
+criminels modifiés depuis (journal ``gallery_changes``) sont masqués dans
+l'instantané et rechargés depuis la base dans un petit index en mémoire. Une
+compaction en arrière-plan publie un nouvel instantané quand ce journal grossit.
+
+Usage : python -m recognition.snapshot [--model Facenet] [--shard 0/4]
+"""
+import argparse
+import json
+import os
+import re
+import shutil
+import threading
+import time
+
+import numpy as np
+
+from config import INDEX_DIR, INDEX_QUANTIZATION, SNAPSHOT_COMPACT_CHANGES, SNAPSHOT_RETENTION
+from .embeddings import load_embeddings, model_version, shard_clause
+from .index import GalleryIndex, merge_matches
+from .quantization import QuantizedMatrix
+from .templates import load_templates
+
+ARRAYS = ("image_ids", "criminal_ids", "matrix", "persons", "starts", "templates")
+# Instantanés conservés (un processus peut encore projeter le précédent)
+KEEP = 2
+# Verrou de compaction abandonné (processus tué) au-delà de ce délai
+LOCK_STALE = 3600
+
+
+def _quantization(mode) -> str:
+    return mode or "none"
+
+
+class Snapshot:
+    """Instantané projeté : nom, métadonnées et index de base (sans copie)."""
+
+    def __init__(self, name: str, meta: dict, base: GalleryIndex):
+        self.name = name
+        self.meta = meta
+        self.base = base
+
+    @property
+    def age(self) -> float:
+        return time.time() - self.meta["created_at"]
+
+
+class SnapshotIndex:
+    """Index de base (instantané ou index complet) aux criminels modifiés masqués.
+
+    Ces criminels sont rechargés depuis la base dans un petit index en mémoire.
+    """
+
+    def __init__(self, base: GalleryIndex, delta, dirty, version=None, snapshot: str = None):
+        self.base = base
+        self.delta = delta
+        self.model_name = base.model_name
+        self.version = version
+        self.snapshot = snapshot
+        self.dirty = set(dirty)
+        self.exclude = np.isin(base.persons, np.fromiter(dirty, dtype=np.int64)) if dirty else None
+
+    def __len__(self) -> int:
+        masked = int((self.base.ends - self.base.starts)[self.exclude].sum()) if self.exclude is not None else 0
+        return len(self.base) - masked + (len(self.delta) if self.delta is not None else 0)
+
+    def updated(self, cursor, criminals, shard=None) -> "SnapshotIndex":
+        """Copie où ``criminals`` sont masqués à leur tour et rechargés depuis la base.
+
+        Seuls ``criminals`` sont relus : les autres lignes de l'index en mémoire sont reprises.
+        """
+        criminals = set(criminals)
+        parts = [load_embeddings(cursor, self.model_name, shard, criminals)]
+        if self.delta is not None and len(self.delta):
+            keep = ~np.isin(self.delta.criminal_ids, np.fromiter(criminals, dtype=np.int64))
+            parts.append((self.delta.image_ids[keep], self.delta.criminal_ids[keep], self.delta.matrix[keep]))
+        parts = [part for part in parts if len(part[0])]
+        if parts:
+            image_ids, criminal_ids, vectors = (np.concatenate(arrays) for arrays in zip(*parts))
+            order = np.argsort(criminal_ids, kind="stable")
+            image_ids, criminal_ids, vectors = image_ids[order], criminal_ids[order], vectors[order]
+        else:
+            image_ids, criminal_ids, vectors = (
+                np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty((0, 0), dtype=np.float32)
+            )
+        delta = GalleryIndex(self.model_name, image_ids, criminal_ids, vectors, quantization="none")
+        return SnapshotIndex(self.base, delta, self.dirty | criminals, self.version, self.snapshot)
+
+    def search(self, query, threshold: float, top_k: int, criminals=None):
+        return self.search_many([query], threshold, top_k, criminals)[0]
+
+    def search_many(self, queries, threshold: float, top_k: int, criminals=None):
+        found = self.base.search_many(queries, threshold, top_k, self.exclude, criminals)
+        if self.delta is None:
+            return found
+        # Les criminels de l'instantané et du journal sont disjoints
+        extra = self.delta.search_many(queries, threshold, top_k, criminals=criminals)
+        return [merge_matches([a, b], top_k) for a, b in zip(found, extra)]
+
+    def search_fused(self, queries, threshold: float, top_k: int, fusion: str = "min", weights=None, criminals=None):
+        found = self.base.search_fused(queries, threshold, top_k, fusion, weights, self.exclude, criminals)
+        if self.delta is None:
+            return found
+        extra = self.delta.search_fused(queries, threshold, top_k, fusion, weights, criminals=criminals)
+        return merge_matches([found, extra], top_k)
+
+    def search_stream(self, query, threshold: float, top_k: int, criminals=None):
+        """Recherche progressive : criminels du journal d'abord, puis les partitions de l'instantané."""
+        extra = self.delta.search(query, threshold, top_k, criminals) if self.delta is not None else []
+        if extra:
+            yield extra
+        best = extra
+        for found in self.base.search_stream(query, threshold, top_k, self.exclude, criminals):
+            best = merge_matches([extra, found], top_k)
+            yield best
+        if not best:
+            yield []
+
+
+def snapshot_root(model_name: str, shard=None, directory: str = INDEX_DIR) -> str:
+    name = re.sub(r"[^A-Za-z0-9_.-]", "_", model_name)
+    if shard is not None:
+        name += f"-shard{shard[0]}of{shard[1]}"
+    return os.path.join(directory, "snapshots", name)
+
+
+def current_name(root: str):
+    """Nom de l'instantané publié dans ``root``, ou None."""
+    try:
+        with open(os.path.join(root, "CURRENT"), encoding="utf-8") as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+def write_snapshot(cursor, model_name: str, shard=None, directory: str = INDEX_DIR,
+                   quantization: str = INDEX_QUANTIZATION) -> str:
+    """Construit un instantané depuis la base, le publie et retourne son chemin.
+
+    ``cursor`` doit appartenir à une connexion dédiée (voir ``compact``) : la
+    lecture se fait dans une transaction en lecture seule ouverte sur elle.
+    """
+    cursor.execute("BEGIN ISOLATION LEVEL REPEATABLE READ READ ONLY")
+    try:
+        # Les transactions invisibles pour cette lecture ont toutes un txid >= xmin :
+        # le journal est relu à partir de là (rejouer une modification déjà vue est sans effet)
+        cursor.execute("SELECT txid_snapshot_xmin(txid_current_snapshot())")
+        xmin = int(cursor.fetchone()[0])
+        index = GalleryIndex(
+            model_name,
+            *load_embeddings(cursor, model_name, shard),
+            templates=load_templates(cursor, model_name, shard),
+            quantization="none",
+        )
+    finally:
+        cursor.execute("COMMIT")
+
+    arrays = {key: getattr(index, key) for key in ARRAYS}
+    if _quantization(quantization) != "none" and len(index):
+        coarse = QuantizedMatrix.quantize(index.matrix, quantization)
+        arrays.update(codes=coarse.codes, error=coarse.error)
+        if coarse.scales is not None:
+            arrays["scales"] = coarse.scales
+
+    root = snapshot_root(model_name, shard, directory)
+    name = f"{time.time_ns() // 1_000_000}-{xmin}"
+    tmp = os.path.join(root, name + ".tmp")
+    os.makedirs(tmp, exist_ok=True)
+    for key, array in arrays.items():
+        np.save(os.path.join(tmp, key + ".npy"), array)
+    meta = {
+        "model_name": model_name,
+        "model_version": model_version(model_name),
+        "shard": list(shard) if shard is not None else None,
+        "xmin": xmin,
+        "rows": len(index),
+        "quantization": _quantization(quantization),
+        "created_at": time.time(),
+    }
+    with open(os.path.join(tmp, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    path = os.path.join(root, name)
+    os.replace(tmp, path)
+    # Publication atomique : les lecteurs voient l'ancien ou le nouveau nom, jamais un fichier partiel
+    with open(os.path.join(root, "CURRENT.tmp"), "w", encoding="utf-8") as f:
+        f.write(name)
+    os.replace(os.path.join(root, "CURRENT.tmp"), os.path.join(root, "CURRENT"))
+    _prune(root, name)
+    return path
+
+
+def _prune(root: str, current: str) -> None:
+    """Supprime les anciens instantanés et les écritures interrompues."""
+    names = sorted(n for n in os.listdir(root) if os.path.isdir(os.path.join(root, n)))
+    finished = [n for n in names if not n.endswith(".tmp")]
+    for name in finished[:-KEEP]:
+        if name != current:
+            # Sous Windows, un fichier encore projeté ne peut pas être supprimé
+            shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+    for name in names:
+        path = os.path.join(root, name)
+        if name.endswith(".tmp") and time.time() - os.path.getmtime(path) > LOCK_STALE:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def open_snapshot(model_name: str, shard=None, directory: str = INDEX_DIR):
+    """Projette l'instantané courant en lecture seule ; None s'il manque ou ne correspond plus."""
+    root = snapshot_root(model_name, shard, directory)
+    name = current_name(root)
+    if name is None:
+        return None
+    path = os.path.join(root, name)
+    try:
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        arrays = {key: _load(path, key) for key in ARRAYS}
+        coarse = None
+        if meta["quantization"] != "none" and meta["rows"]:
+            scales = _load(path, "scales") if os.path.exists(os.path.join(path, "scales.npy")) else None
+            coarse = QuantizedMatrix(_load(path, "codes"), scales, _load(path, "error"), meta["quantization"])
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Instantané {path} illisible ({e})")
+        return None
+    snapshot = Snapshot(name, meta, GalleryIndex.from_arrays(model_name, coarse=coarse, **arrays))
+    if (
+        meta["model_version"] != model_version(model_name)
+        or meta["quantization"] != _quantization(INDEX_QUANTIZATION)
+        # Le journal plus ancien que SNAPSHOT_RETENTION est purgé
+        or snapshot.age > SNAPSHOT_RETENTION
+    ):
+        return None
+    return snapshot
+
+
+def _load(path: str, key: str) -> np.ndarray:
+    array = np.load(os.path.join(path, key + ".npy"), mmap_mode="r")
+    # Tableau vide : rien à projeter, la copie est gratuite
+    return np.asarray(array) if not array.size else array
+
+
+def read_changes(cursor, model_name: str, xmin: int, shard=None):
+    """Criminels modifiés (pour ``model_name``) par les transactions de txid >= ``xmin``."""
+    clause, params = shard_clause(shard, "criminal_id")
+    cursor.execute(
+        """
+        SELECT DISTINCT criminal_id FROM gallery_changes
+        WHERE txid >= %s AND (model_name IS NULL OR model_name = %s)""" + clause,
+        (xmin, model_name, *params),
+    )
+    return {row[0] for row in cursor.fetchall()}
+
+
+_snapshots = {}
+_compacting = set()
+_lock = threading.Lock()
+
+
+def current_snapshot(model_name: str, shard=None, directory: str = INDEX_DIR):
+    """Instantané courant, projeté une seule fois par processus."""
+    root = snapshot_root(model_name, shard, directory)
+    name = current_name(root)
+    with _lock:
+        snapshot = _snapshots.get(root)
+    if snapshot is not None and snapshot.name == name:
+        return snapshot
+    snapshot = open_snapshot(model_name, shard, directory)
+    with _lock:
+        _snapshots[root] = snapshot
+    return snapshot
+
+
+def is_current(index, shard=None, directory: str = INDEX_DIR) -> bool:
+    """Vrai si ``index`` repose sur l'instantané publié (ou n'utilise pas d'instantané).
+
+    Un nom vide marque l'index complet chargé en attendant le premier instantané :
+    il reste courant tant qu'aucun n'est publié.
+    """
+    name = getattr(index, "snapshot", None)
+    return name is None or (name or None) == current_name(snapshot_root(index.model_name, shard, directory))
+
+
+def load_index(cursor, model_name: str, shard=None, version=None, directory: str = INDEX_DIR) -> SnapshotIndex:
+    """Index de la galerie : instantané courant et criminels du journal.
+
+    Sans instantané, l'index complet est chargé en mémoire par ``cursor`` et le
+    premier instantané est construit en arrière-plan sur une connexion dédiée.
+    """
+    snapshot = current_snapshot(model_name, shard, directory)
+    if snapshot is None:
+        compact_async(model_name, shard, directory)
+        base = GalleryIndex(
+            model_name,
+            *load_embeddings(cursor, model_name, shard),
+            version=version,
+            templates=load_templates(cursor, model_name, shard),
+        )
+        return SnapshotIndex(base, None, (), version, snapshot="")
+    dirty = read_changes(cursor, model_name, snapshot.meta["xmin"], shard)
+    delta = None
+    if dirty:
+        delta = GalleryIndex(model_name, *load_embeddings(cursor, model_name, shard, dirty), quantization="none")
+    if len(dirty) >= SNAPSHOT_COMPACT_CHANGES or snapshot.age > SNAPSHOT_RETENTION / 2:
+        compact_async(model_name, shard, directory)
+    return SnapshotIndex(snapshot.base, delta, dirty, version, snapshot.name)
+
+
+def compact(model_name: str, shard=None, directory: str = INDEX_DIR):
+    """Publie un nouvel instantané (connexion dédiée) et purge le journal expiré.
+
+    Retourne le chemin de l'instantané, ou None si une compaction est déjà en cours sur la machine.
+    """
+    root = snapshot_root(model_name, shard, directory)
+    lock = _acquire_lock(root)
+    if lock is None:
+        return None
+    from database import connect
+    conn = connect()
+    try:
+        cur = conn.cursor()
+        path = write_snapshot(cur, model_name, shard, directory)
+        cur.execute(
+            "DELETE FROM gallery_changes WHERE created_at < NOW() - %s * INTERVAL '1 second'",
+            (SNAPSHOT_RETENTION,),
+        )
+        return path
+    finally:
+        conn.close()
+        os.unlink(lock)
+
+
+def compact_async(model_name: str, shard=None, directory: str = INDEX_DIR) -> None:
+    """Lance la compaction dans un thread d'arrière-plan (une seule à la fois par instantané)."""
+    key = (model_name, shard, directory)
+    with _lock:
+        if key in _compacting:
+            return
+        _compacting.add(key)
+
+    def run():
+        try:
+            compact(*key)
+        except Exception as e:
+            print(f"Compaction de l'instantané {model_name} impossible ({e})")
+        finally:
+            with _lock:
+                _compacting.discard(key)
+
+    threading.Thread(target=run, name="snapshot-compaction", daemon=True).start()
+
+
+def _acquire_lock(root: str):
+    """Verrou inter-processus (création exclusive d'un fichier), ou None s'il est pris."""
+    os.makedirs(root, exist_ok=True)
+    path = os.path.join(root, "compact.lock")
+    try:
+        if time.time() - os.path.getmtime(path) > LOCK_STALE:
+            os.unlink(path)
+    except OSError:
+        pass
+    try:
+        os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+    except FileExistsError:
+        return None
+    return path
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Instantané de l'index de la galerie")
+    parser.add_argument("--model", default="Facenet")
+    parser.add_argument("--shard", help="Shard index/nombre, par exemple 0/4")
+    args = parser.parse_args()
+
+    shard = tuple(int(part) for part in args.shard.split("/")) if args.shard else None
+    path = compact(args.model, shard)
+    if path is None:
+        raise SystemExit("Compaction déjà en cours")
+    print(f"Instantané publié : {path}")
+
+
+if __name__ == "__main__":
+    main()
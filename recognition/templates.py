@@ -0,0 +1,122 @@
+"""Gabarits par criminel : moyenne des embeddings normalisés, pondérée par la qualité du visage.
+
+Un gabarit est stocké comme somme pondérée (``weighted_sum``, REAL[]) et somme des
+poids : ajouter ou retirer une photo est une addition atomique côté SQL, sans
+relire les autres photos du criminel.
+
+Usage : python -m recognition.templates --rebuild [--model Facenet]
+"""
+import argparse
+
+import numpy as np
+from psycopg2.extras import execute_values
+
+from .embeddings import from_bytes, normalize, shard_clause
+
+UPSERT_DELTA = """
+    INSERT INTO templates_criminels (criminal_id, model_name, weighted_sum, weight_sum, photos)
+    VALUES (%s, %s, %s::real[], %s, %s)
+    ON CONFLICT (criminal_id, model_name) DO UPDATE SET
+        weighted_sum = ARRAY(
+            SELECT a + b
+            FROM unnest(templates_criminels.weighted_sum, EXCLUDED.weighted_sum) WITH ORDINALITY AS t(a, b, i)
+            ORDER BY i
+        ),
+        weight_sum = templates_criminels.weight_sum + EXCLUDED.weight_sum,
+        photos = templates_criminels.photos + EXCLUDED.photos,
+        updated_at = NOW()
+"""
+
+
+def template_deltas(rows, sign: float = 1.0):
+    """Regroupe [(criminal_id, vecteur, qualité)] en {criminal_id: (Σ q·v̂, Σ q, nombre)}."""
+    deltas = {}
+    for criminal_id, vec, quality in rows:
+        if vec is None:
+            continue
+        contribution = normalize(vec) * np.float32(quality)
+        total, weight, count = deltas.get(criminal_id, (0.0, 0.0, 0))
+        deltas[criminal_id] = (total + contribution, weight + quality, count + 1)
+    return {cid: (sign * total, sign * weight, int(sign) * count) for cid, (total, weight, count) in deltas.items()}
+
+
+def apply_template_deltas(cursor, model_name: str, deltas) -> None:
+    """Ajoute (ou retire, deltas négatifs) des contributions aux gabarits."""
+    for criminal_id, (total, weight, count) in deltas.items():
+        cursor.execute(
+            UPSERT_DELTA,
+            (criminal_id, model_name, np.asarray(total, dtype=np.float32).tolist(), float(weight), count),
+        )
+    removed = [cid for cid, (_, _, count) in deltas.items() if count < 0]
+    if removed:
+        cursor.execute(
+            "DELETE FROM templates_criminels WHERE model_name = %s AND criminal_id = ANY(%s) AND photos <= 0",
+            (model_name, removed),
+        )
+
+
+def merge_templates(cursor, target_id: int, source_ids) -> None:
+    """Ajoute les gabarits des dossiers fusionnés à celui du dossier cible."""
+    cursor.execute(
+        """
+        SELECT model_name, weighted_sum, weight_sum, photos
+        FROM templates_criminels WHERE criminal_id = ANY(%s)
+        """,
+        (list(source_ids),),
+    )
+    for model_name, total, weight, count in cursor.fetchall():
+        apply_template_deltas(cursor, model_name, {target_id: (np.asarray(total, dtype=np.float32), weight, count)})
+
+
+def load_templates(cursor, model_name: str, shard=None):
+    """{criminal_id: somme pondérée} pour ``model_name`` (à normaliser avant comparaison)."""
+    clause, params = shard_clause(shard, "criminal_id")
+    cursor.execute(
+        "SELECT criminal_id, weighted_sum FROM templates_criminels WHERE model_name = %s AND photos > 0" + clause,
+        (model_name, *params),
+    )
+    return {cid: np.asarray(total, dtype=np.float32) for cid, total in cursor.fetchall()}
+
+
+def rebuild_templates(cursor, model_name: str = "Facenet") -> int:
+    """Recalcule tous les gabarits depuis les embeddings (migration, dérive numérique)."""
+    cursor.execute(
+        """
+        SELECT ic.criminal_id, e.embedding, e.quality
+        FROM embeddings_criminels e JOIN images_criminels ic ON ic.id = e.image_id
+        WHERE e.model_name = %s AND e.embedding IS NOT NULL
+        """,
+        (model_name,),
+    )
+    deltas = template_deltas((cid, from_bytes(emb), quality) for cid, emb, quality in cursor.fetchall())
+    cursor.execute("DELETE FROM templates_criminels WHERE model_name = %s", (model_name,))
+    insert_templates(cursor, model_name, deltas)
+    return len(deltas)
+
+
+def insert_templates(cursor, model_name: str, deltas) -> None:
+    """Insertion groupée de gabarits pour des criminels qui n'en ont pas encore."""
+    execute_values(
+        cursor,
+        "INSERT INTO templates_criminels (criminal_id, model_name, weighted_sum, weight_sum, photos) VALUES %s",
+        [
+            (cid, model_name, np.asarray(total, dtype=np.float32).tolist(), float(weight), count)
+            for cid, (total, weight, count) in deltas.items()
+        ],
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Gabarits par criminel")
+    parser.add_argument("--rebuild", action="store_true", required=True)
+    parser.add_argument("--model", default="Facenet")
+    args = parser.parse_args()
+
+    from database import cursor
+    if not cursor:
+        raise SystemExit("Base de données indisponible")
+    print(f"{rebuild_templates(cursor, args.model)} gabarit(s) recalculé(s) pour {args.model}")
+
+
+if __name__ == "__main__":
+    main()
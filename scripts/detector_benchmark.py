@@ -0,0 +1,95 @@
+"""Compare les détecteurs de visages (vitesse et précision) sur un jeu étiqueté.
+
+Usage : python scripts/detector_benchmark.py [--data images] [--model Facenet]
+        [--backends opencv ssd mtcnn retinaface] [--max-sides 0 640 320] [--out bench.json]
+
+Pour chaque backend et chaque taille de détection (0 = pleine résolution) :
+temps de détection par image, taux de visages détectés, précision rang 1
+(plus proche voisin, chaque image contre toutes les autres) et taux d'égale erreur.
+Le résultat aide à choisir DGSN_DETECTOR_BACKEND et DGSN_DETECTION_MAX_SIDE.
+"""
+import argparse
+import json
+import os
+import sys
+from time import perf_counter
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def rank1_accuracy(distances, labels) -> float:
+    """Part des images dont le plus proche voisin (hors elle-même) est la même personne."""
+    labels = np.asarray(labels)
+    distances = distances + np.diag(np.full(len(labels), np.inf))
+    return float(np.mean(labels[np.argmin(distances, axis=1)] == labels))
+
+
+def run(samples, model_name: str, backend: str, max_side: int) -> dict:
+    from recognition.batching import detect_face, forward_batch
+    from recognition.calibration import operating_point, pairwise_distances, split_pairs
+    from recognition.embeddings import image_array
+
+    timings, faces, labels = [], [], []
+    for label, data in samples:
+        img = image_array(data)
+        start = perf_counter()
+        face, confidence = detect_face(img, backend, max_side)
+        timings.append((perf_counter() - start) * 1000)
+        if face is not None and confidence > 0:
+            faces.append(face)
+            labels.append(label)
+    result = {
+        "backend": backend,
+        "max_side": max_side,
+        "detect_ms_mean": float(np.mean(timings)),
+        "detect_ms_p95": float(np.percentile(timings, 95)),
+        "detection_rate": len(faces) / len(samples),
+    }
+    if len(set(labels)) >= 2 and len(labels) > len(set(labels)):
+        distances = pairwise_distances(np.stack(forward_batch(faces, model_name)), "cosine")
+        genuine, impostor = split_pairs(distances, labels)
+        result["rank1"] = rank1_accuracy(distances, labels)
+        result["eer"] = operating_point(genuine, impostor)["eer"]
+    return result
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Banc d'essai des détecteurs de visages")
+    parser.add_argument("--data", default=os.path.join(ROOT, "images"))
+    parser.add_argument("--model", default="Facenet")
+    parser.add_argument("--backends", nargs="+", default=["opencv", "ssd", "mtcnn", "retinaface"])
+    parser.add_argument("--max-sides", nargs="+", type=int, default=[0, 640, 320])
+    parser.add_argument("--out", help="Fichier JSON des résultats")
+    args = parser.parse_args()
+
+    from recognition.calibration import load_dataset
+    from utils import initialize_deepface
+    initialize_deepface()
+    samples = load_dataset(args.data)
+    print(f"{len(samples)} image(s), {len({label for label, _ in samples})} personne(s)")
+
+    results = []
+    print(f"{'backend':<12}{'taille':>8}{'ms moy.':>10}{'ms p95':>10}{'détectés':>10}{'rang 1':>9}{'EER':>8}")
+    for backend in args.backends:
+        for max_side in args.max_sides:
+            try:
+                r = run(samples, args.model, backend, max_side)
+            except Exception as e:
+                print(f"{backend:<12}{max_side:>8}  échec : {e}")
+                continue
+            results.append(r)
+            print(
+                f"{backend:<12}{max_side or 'plein':>8}{r['detect_ms_mean']:>10.1f}{r['detect_ms_p95']:>10.1f}"
+                f"{r['detection_rate']:>10.1%}{r.get('rank1', float('nan')):>9.1%}{r.get('eer', float('nan')):>8.3f}"
+            )
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,65 @@
+"""Rapport du temps d'import des modules de la page de connexion.
+
+Usage : python scripts/import_time_report.py [--top 20] [--budget-ms 3000]
+
+Lance ``python -X importtime`` sur les modules chargés avant l'authentification
+et échoue si une dépendance lourde (DeepFace, TensorFlow, ReportLab...) y apparaît.
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+LOGIN_MODULES = ["auth", "database", "ui", "utils"]
+FORBIDDEN = ["deepface", "tensorflow", "keras", "tf_keras", "torch", "reportlab", "cv2"]
+
+
+def measure(modules):
+    """Retourne [(module, self_us, cumulative_us)] pour l'import des modules."""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {', '.join(modules)}"],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1] if proc.stderr else "échec de l'import")
+    entries = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        entries.append((name.strip(), int(self_us), int(cumulative_us)))
+    return entries
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("--budget-ms", type=float, default=None, help="Durée totale maximale tolérée")
+    parser.add_argument("modules", nargs="*", default=LOGIN_MODULES)
+    args = parser.parse_args()
+
+    entries = measure(args.modules)
+    top_level = {name.split(".")[0] for name, _, _ in entries}
+    total_ms = sum(self_us for _, self_us, _ in entries) / 1000
+
+    print(f"Modules importés : {len(entries)} — total {total_ms:.0f} ms")
+    for name, _, cumulative_us in sorted(entries, key=lambda e: e[2], reverse=True)[:args.top]:
+        print(f"{cumulative_us / 1000:10.1f} ms  {name}")
+
+    failed = False
+    heavy = sorted(top_level.intersection(FORBIDDEN))
+    if heavy:
+        print(f"ÉCHEC : dépendances lourdes importées avant l'authentification : {', '.join(heavy)}")
+        failed = True
+    if args.budget_ms is not None and total_ms > args.budget_ms:
+        print(f"ÉCHEC : {total_ms:.0f} ms dépasse le budget de {args.budget_ms:.0f} ms")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,295 @@
+"""Test de charge : sessions d'agents simultanées sur une base PostgreSQL éphémère.
+
+Usage : python scripts/load_test.py [--dsn DSN | --pg-dir /tmp/dgsn-load --port 5434]
+        [--criminals 2000] [--photos 3] [--concurrency 1 2 4 8 16] [--duration 30]
+        [--probes 200] [--known 0.5] [--model Facenet] [--cache] [--keep] [--out load.json]
+
+Sans --dsn, un serveur PostgreSQL jetable est créé dans --pg-dir (initdb/pg_ctl
+dans le PATH, comme scripts/local_replica.py) puis arrêté à la fin. La galerie
+est peuplée d'images synthétiques ; l'embedder factice (DGSN_FAKE_EMBEDDER,
+recognition.fake) remplace DeepFace : les résultats sont reproductibles.
+
+Chaque session simulée est un processus avec sa propre connexion et enchaîne
+le parcours d'un agent avec les fonctions appelées par ``ui`` :
+connexion (auth.authenticate_user) -> recherche faciale (utils.find_match_stream)
+-> consultation de la fiche (database.crud.get_criminal_by_id) -> export PDF
+(utils.generate_pdf). Une moitié des requêtes (--known) sont des photos de la
+galerie, les autres des inconnus. Les requêtes se répètent : le cache de recherche
+est contourné, sauf --cache. Pour chaque niveau de concurrence : débit
+(parcours/s) et latences p50/p95/p99 de chaque étape ; le point de saturation
+est le premier niveau où le débit progresse de moins de 10 %.
+"""
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from datetime import date, datetime
+from time import monotonic, perf_counter
+
+import numpy as np
+from PIL import Image
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+USER = ("agent.charge", "charge")
+STEPS = ("login", "search_first", "search", "dossier", "pdf", "flow")
+CRIMES = ("Vol", "Escroquerie", "Trafic de stupéfiants", "Homicide", "Contrebande")
+NATIONALITIES = ("Marocaine", "Algérienne", "Française", "Espagnole", "Sénégalaise")
+# Graines des images inconnues : hors de la plage de la galerie
+UNKNOWN_SEED = 10 ** 9
+
+
+def _run(*args) -> None:
+    subprocess.run(args, check=True)
+
+
+def start_postgres(root: str, port: int, dbname: str = "DGSN", user: str = "postgres") -> str:
+    """Serveur jetable dans ``root`` ; retourne son DSN."""
+    data = os.path.join(root, "data")
+    if not os.path.isdir(data):
+        _run("initdb", "-D", data, "-U", user, "--auth=trust")
+        with open(os.path.join(data, "postgresql.conf"), "a") as f:
+            f.write(f"\nport = {port}\nlisten_addresses = 'localhost'\nmax_connections = 300\nfsync = off\n")
+    _run("pg_ctl", "-D", data, "-l", os.path.join(root, "postgres.log"), "-w", "start")
+    subprocess.run(["createdb", "-h", "localhost", "-p", str(port), "-U", user, dbname])
+    return f"host=localhost port={port} dbname={dbname} user={user}"
+
+
+def stop_postgres(root: str) -> None:
+    data = os.path.join(root, "data")
+    if os.path.isdir(data):
+        subprocess.run(["pg_ctl", "-D", data, "-m", "fast", "stop"])
+
+
+def synthetic_image(seed: int, size: int = 96) -> Image.Image:
+    """Image déterministe (blocs de couleur) : une graine, une « personne »."""
+    rng = np.random.default_rng(seed)
+    blocks = rng.integers(0, 256, (12, 12, 3), dtype=np.uint8)
+    return Image.fromarray(blocks).resize((size, size), Image.NEAREST)
+
+
+def _image_bytes(img: Image.Image) -> bytes:
+    buffer = io.BytesIO()
+    img.save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+
+def seed_gallery(criminals: int, photos: int, model_name: str) -> None:
+    """Crée le schéma, l'utilisateur de test et complète la galerie jusqu'à ``criminals`` fiches."""
+    from database import cursor, setup_db
+    from database.crud import insert_criminal
+
+    setup_db()
+    cursor.execute(
+        "INSERT INTO users (username, password) VALUES (%s, %s) ON CONFLICT (username) DO NOTHING", USER
+    )
+    cursor.execute("SELECT COUNT(*) FROM criminals")
+    existing = cursor.fetchone()[0]
+    start = perf_counter()
+    for n in range(existing, criminals):
+        rng = np.random.default_rng(n)
+        data = {
+            "nom": f"Nom{n}",
+            "prenom": f"Prénom{n}",
+            "alias": None,
+            "age": int(rng.integers(18, 70)),
+            "date_naissance": None,
+            "lieu_naissance": "Rabat",
+            "nationalite": NATIONALITIES[n % len(NATIONALITIES)],
+            "telephone": None,
+            "adresse": None,
+            "date_arrestation": date(2015 + n % 10, 1 + n % 12, 1 + n % 28),
+            "implication": None,
+            "crime": CRIMES[n % len(CRIMES)],
+            "description": "Fiche générée pour le test de charge",
+        }
+        insert_criminal(data, [synthetic_image(n * photos + p) for p in range(photos)], model_name)
+        if (n + 1) % 500 == 0:
+            print(f"  {n + 1}/{criminals} fiches ({perf_counter() - start:.0f} s)")
+
+
+def load_probes(count: int, known: float):
+    """Photos de la galerie (correspondance attendue) et images inconnues, mélangées."""
+    from database import cursor
+
+    n_known = int(round(count * known))
+    cursor.execute("SELECT image FROM images_criminels ORDER BY random() LIMIT %s", (n_known,))
+    probes = [bytes(row[0]) for row in cursor.fetchall()]
+    probes += [_image_bytes(synthetic_image(UNKNOWN_SEED + i)) for i in range(count - len(probes))]
+    np.random.default_rng(0).shuffle(probes)
+    return probes
+
+
+# --- Processus de session ----------------------------------------------------
+
+_probes = None
+_columns = None
+
+
+def _init_session(probes, model_name: str) -> None:
+    """Importe l'application et charge l'index (hors mesure) dans le processus de session."""
+    global _probes, _columns
+    from database import cursor
+    from recognition import get_gallery_index
+
+    _probes = probes
+    cursor.execute("SELECT * FROM criminals LIMIT 0")
+    _columns = [col[0] for col in cursor.description]
+    get_gallery_index(cursor, model_name)
+
+
+def _session(task):
+    """Parcours répétés jusqu'à l'échéance ; retourne ({étape: [ms]}, parcours, erreurs)."""
+    from auth import authenticate_user
+    from database import cursor, get_criminal_by_id, read_cursor
+    from utils import find_match_stream, generate_pdf, image_to_bytes
+
+    number, duration, model_name, use_cache = task
+    rng = np.random.default_rng(number)
+    samples = {step: [] for step in STEPS}
+    flows, errors = 0, {}
+    deadline = monotonic() + duration
+    # Au moins un parcours (échauffement avec duration = 0)
+    while flows + sum(errors.values()) == 0 or monotonic() < deadline:
+        step = "login"
+        flow_start = perf_counter()
+        try:
+            start = perf_counter()
+            if authenticate_user(cursor, *USER) is None:
+                raise RuntimeError("authentification refusée")
+            samples["login"].append((perf_counter() - start) * 1000)
+
+            step = "search"
+            probe = Image.open(io.BytesIO(_probes[rng.integers(len(_probes))])).convert("RGB")
+            start = perf_counter()
+            results, first = [], None
+            with read_cursor() as cur:
+                for results, _ in find_match_stream(probe, cur, model_name, use_cache=use_cache):
+                    first = first or perf_counter() - start
+            samples["search_first"].append(first * 1000)
+            samples["search"].append((perf_counter() - start) * 1000)
+
+            if results:
+                best = results[0]
+                step = "dossier"
+                start = perf_counter()
+                criminal_data = dict(zip(_columns, get_criminal_by_id(best["id"])))
+                samples["dossier"].append((perf_counter() - start) * 1000)
+
+                step = "pdf"
+                start = perf_counter()
+                current_date = datetime.now().strftime("%d/%m/%Y à %H:%M")
+                generate_pdf(criminal_data, image_to_bytes(best["reference_image"]), best["similarity"], current_date)
+                samples["pdf"].append((perf_counter() - start) * 1000)
+            samples["flow"].append((perf_counter() - flow_start) * 1000)
+            flows += 1
+        except Exception as e:
+            key = f"{step}: {type(e).__name__}: {e}"
+            errors[key] = errors.get(key, 0) + 1
+    return samples, flows, errors
+
+
+def run_level(concurrency: int, duration: float, probes, model_name: str, use_cache: bool = False) -> dict:
+    """Un niveau de concurrence : ``concurrency`` sessions pendant ``duration`` secondes."""
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(concurrency, initializer=_init_session, initargs=(probes, model_name)) as pool:
+        # Échauffement (imports, premier parcours), non mesuré
+        pool.map(_session, [(i, 0, model_name, use_cache) for i in range(concurrency)], chunksize=1)
+        outcomes = pool.map(_session, [(i, duration, model_name, use_cache) for i in range(concurrency)], chunksize=1)
+    samples = {step: [ms for s, _, _ in outcomes for ms in s[step]] for step in STEPS}
+    errors = {}
+    for _, _, session_errors in outcomes:
+        for key, n in session_errors.items():
+            errors[key] = errors.get(key, 0) + n
+    flows = sum(n for _, n, _ in outcomes)
+    return {
+        "concurrency": concurrency,
+        "flows": flows,
+        "throughput": flows / duration,
+        "errors": errors,
+        "latency_ms": {
+            step: {f"p{q}": float(np.percentile(values, q)) for q in (50, 95, 99)}
+            for step, values in samples.items() if values
+        },
+    }
+
+
+def saturation_point(levels, gain: float = 1.1):
+    """Premier niveau dont le débit progresse de moins de ``gain`` par rapport au précédent."""
+    for previous, level in zip(levels, levels[1:]):
+        if level["throughput"] < previous["throughput"] * gain:
+            return level["concurrency"]
+    return None
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Test de charge des parcours agents (base et embedder factices)")
+    parser.add_argument("--dsn", help="Base existante (sinon serveur PostgreSQL jetable)")
+    parser.add_argument("--pg-dir", help="Répertoire du serveur jetable (défaut : temporaire)")
+    parser.add_argument("--port", type=int, default=5434)
+    parser.add_argument("--keep", action="store_true", help="Conserver le serveur jetable et ses données")
+    parser.add_argument("--criminals", type=int, default=2000)
+    parser.add_argument("--photos", type=int, default=3, help="Photos par fiche (5 au maximum)")
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 2, 4, 8, 16])
+    parser.add_argument("--duration", type=float, default=30.0, help="Durée de chaque niveau (s)")
+    parser.add_argument("--probes", type=int, default=200)
+    parser.add_argument("--known", type=float, default=0.5, help="Part des requêtes présentes dans la galerie")
+    parser.add_argument("--model", default="Facenet")
+    parser.add_argument("--cache", action="store_true",
+                        help="Laisser le cache de recherche servir les requêtes répétées")
+    parser.add_argument("--out", help="Fichier JSON des résultats")
+    args = parser.parse_args()
+
+    pg_dir = None
+    if not args.dsn:
+        pg_dir = args.pg_dir or tempfile.mkdtemp(prefix="dgsn-load-")
+        os.makedirs(pg_dir, exist_ok=True)
+        args.dsn = start_postgres(pg_dir, args.port)
+    # Lu à l'import de config : à fixer avant d'importer l'application (hérité par les sessions)
+    os.environ.update({
+        "DGSN_PRIMARY_DSN": args.dsn,
+        "DGSN_FAKE_EMBEDDER": "1",
+        "DGSN_EMBED_WORKERS": "1",
+        "DGSN_INDEX_DIR": os.path.join(pg_dir or tempfile.gettempdir(), "dgsn-load-index"),
+    })
+    try:
+        print(f"Galerie : {args.criminals} fiche(s) x {args.photos} photo(s)")
+        seed_gallery(args.criminals, min(5, args.photos), args.model)
+        probes = load_probes(args.probes, args.known)
+
+        levels = []
+        print(f"{'sessions':>9}{'parcours/s':>12}{'erreurs':>9}"
+              + "".join(f"{step + ' p95':>16}" for step in STEPS))
+        for concurrency in args.concurrency:
+            level = run_level(concurrency, args.duration, probes, args.model, args.cache)
+            levels.append(level)
+            latency = level["latency_ms"]
+            print(
+                f"{concurrency:>9}{level['throughput']:>12.2f}{sum(level['errors'].values()):>9}"
+                + "".join(f"{latency[step]['p95'] if step in latency else float('nan'):>16.1f}" for step in STEPS)
+            )
+            for key, n in level["errors"].items():
+                print(f"          {n} x {key}")
+        saturation = saturation_point(levels)
+        if saturation:
+            print(f"Saturation à {saturation} session(s) : le débit progresse de moins de 10 %.")
+        else:
+            print("Pas de saturation observée sur les niveaux testés.")
+        if args.out:
+            with open(args.out, "w", encoding="utf-8") as f:
+                json.dump({"levels": levels, "saturation": saturation}, f, ensure_ascii=False, indent=2)
+    finally:
+        if pg_dir and not args.keep:
+            stop_postgres(pg_dir)
+            shutil.rmtree(pg_dir, ignore_errors=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,62 @@
+"""Crée un primaire et un réplica PostgreSQL locaux pour tester le routage des lectures.
+
+Usage : python scripts/local_replica.py start [--dir /tmp/dgsn-pg] [--port 5433]
+        python scripts/local_replica.py stop [--dir /tmp/dgsn-pg]
+
+Le primaire écoute sur --port, le réplica (réplication physique en streaming,
+pg_basebackup -R) sur --port + 1. Les binaires initdb/pg_ctl/pg_basebackup
+doivent être dans le PATH. Affiche les variables d'environnement à exporter.
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+
+def _run(*args) -> None:
+    subprocess.run(args, check=True)
+
+
+def start(root: str, port: int, dbname: str = "DGSN", user: str = "postgres") -> None:
+    primary = os.path.join(root, "primary")
+    replica = os.path.join(root, "replica")
+    if not os.path.isdir(primary):
+        _run("initdb", "-D", primary, "-U", user, "--auth=trust")
+        with open(os.path.join(primary, "postgresql.conf"), "a") as f:
+            f.write(f"\nport = {port}\nwal_level = replica\nmax_wal_senders = 4\nlisten_addresses = 'localhost'\n")
+        with open(os.path.join(primary, "pg_hba.conf"), "a") as f:
+            f.write("\nhost replication all 127.0.0.1/32 trust\n")
+    _run("pg_ctl", "-D", primary, "-l", os.path.join(root, "primary.log"), "-w", "start")
+    subprocess.run(["createdb", "-h", "localhost", "-p", str(port), "-U", user, dbname])
+    if not os.path.isdir(replica):
+        _run("pg_basebackup", "-h", "localhost", "-p", str(port), "-U", user, "-D", replica, "-R", "-X", "stream")
+        with open(os.path.join(replica, "postgresql.conf"), "a") as f:
+            f.write(f"\nport = {port + 1}\nhot_standby = on\n")
+    _run("pg_ctl", "-D", replica, "-l", os.path.join(root, "replica.log"), "-w", "start")
+    print(f'export DGSN_PRIMARY_DSN="host=localhost port={port} dbname={dbname} user={user}"')
+    print(f'export DGSN_REPLICA_DSNS="host=localhost port={port + 1} dbname={dbname} user={user}"')
+
+
+def stop(root: str) -> None:
+    for name in ("replica", "primary"):
+        path = os.path.join(root, name)
+        if os.path.isdir(path):
+            subprocess.run(["pg_ctl", "-D", path, "-m", "fast", "stop"])
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Primaire + réplica PostgreSQL locaux")
+    parser.add_argument("command", choices=["start", "stop"])
+    parser.add_argument("--dir", default="/tmp/dgsn-pg")
+    parser.add_argument("--port", type=int, default=5433)
+    args = parser.parse_args()
+    os.makedirs(args.dir, exist_ok=True)
+    if args.command == "start":
+        start(args.dir, args.port)
+    else:
+        stop(args.dir)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,4 @@
+"""Service d'identification autonome (HTTP + pool de processus)."""
+from .client import IdentificationClient, ServiceError
+
+__all__ = ["IdentificationClient", "ServiceError"]
@@ -0,0 +1,103 @@
+"""Client du service d'identification, utilisé par l'interface et les systèmes internes."""
+import base64
+import json
+import urllib.error
+import urllib.request
+from datetime import date
+
+from config import SERVICE_TIMEOUT, SERVICE_TOKEN, SERVICE_URL
+from utils import deserialize_match, image_to_bytes
+
+
+class ServiceError(Exception):
+    """Erreur renvoyée par le service (ou service injoignable)."""
+
+    def __init__(self, message: str, status: int = None):
+        super().__init__(message)
+        self.status = status
+
+
+def _encode(img) -> str:
+    return base64.b64encode(image_to_bytes(img.convert("RGB"))).decode()
+
+
+def _decode_results(results):
+    return [deserialize_match(r) for r in results]
+
+
+def _filters(filters):
+    """Filtres d'attributs sérialisables en JSON (dates en ISO)."""
+    if not filters:
+        return None
+    return {k: v.isoformat() if isinstance(v, date) else v for k, v in filters.items()}
+
+
+class IdentificationClient:
+    """``username`` : utilisateur pour le compte duquel les appels sont journalisés par le service."""
+
+    def __init__(self, base_url: str = SERVICE_URL, timeout: float = SERVICE_TIMEOUT,
+                 token: str = SERVICE_TOKEN, username: str = None):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.token = token
+        self.username = username
+
+    def identify(self, image, model_name: str = "Facenet", threshold: float = None, top_k: int = 3, filters: dict = None):
+        body = {
+            "image": _encode(image), "model_name": model_name, "threshold": threshold, "top_k": top_k,
+            "filters": _filters(filters),
+        }
+        return _decode_results(self._request("POST", "/identify", body)["results"])
+
+    def identify_batch(self, images, model_name: str = "Facenet", threshold: float = None, top_k: int = 3,
+                       filters: dict = None):
+        body = {
+            "images": [_encode(i) for i in images], "model_name": model_name, "threshold": threshold, "top_k": top_k,
+            "filters": _filters(filters),
+        }
+        return [_decode_results(r) for r in self._request("POST", "/identify/batch", body)["results"]]
+
+    def identify_fused(self, images, fusion: str = "min", model_name: str = "Facenet", threshold: float = None,
+                       top_k: int = 3, filters: dict = None):
+        body = {
+            "images": [_encode(i) for i in images], "fusion": fusion, "model_name": model_name,
+            "threshold": threshold, "top_k": top_k, "filters": _filters(filters),
+        }
+        return _decode_results(self._request("POST", "/identify/fused", body)["results"])
+
+    def enroll(self, data: dict, images) -> int:
+        criminal = {k: v.isoformat() if isinstance(v, date) else v for k, v in data.items()}
+        body = {"criminal": criminal, "images": [_encode(i) for i in images]}
+        return self._request("POST", "/enroll", body)["id"]
+
+    def get_criminal(self, criminal_id: int):
+        try:
+            return self._request("GET", f"/criminals/{int(criminal_id)}")
+        except ServiceError as e:
+            if e.status == 404:
+                return None
+            raise
+
+    def _request(self, method: str, path: str, body: dict = None):
+        data = json.dumps(body).encode() if body is not None else None
+        request = urllib.request.Request(
+            self.base_url + path,
+            data=data,
+            method=method,
+            headers={
+                "Content-Type": "application/json",
+                "X-DGSN-Token": self.token,
+                **({"X-DGSN-User": self.username} if self.username else {}),
+            },
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            try:
+                message = json.loads(e.read()).get("error", str(e))
+            except ValueError:
+                message = str(e)
+            raise ServiceError(message, e.code)
+        except urllib.error.URLError as e:
+            raise ServiceError(f"Service d'identification injoignable : {e.reason}")
@@ -0,0 +1,56 @@
+"""Pool de processus de taille fixe avec file d'attente bornée."""
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from . import tasks
+
+
+class QueueFull(Exception):
+    """Toutes les places de la file d'attente sont occupées."""
+
+
+class RecognitionPool:
+    """``workers`` processus gardant le modèle en mémoire, ``queue_size`` requêtes en attente au plus."""
+
+    def __init__(self, workers: int, queue_size: int, model_name: str = "Facenet"):
+        self.workers = workers
+        self.queue_size = queue_size
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+        # "spawn" : une connexion PostgreSQL ne doit pas être héritée par fork
+        self._executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=tasks.init_worker,
+            initargs=(model_name,),
+        )
+
+    def submit(self, fn, *args):
+        return self.submit_many(fn, [args])[0]
+
+    def submit_many(self, fn, args_list):
+        """Soumet toutes les tâches, ou aucune si la file n'a pas assez de places."""
+        acquired = 0
+        for _ in args_list:
+            if not self._slots.acquire(blocking=False):
+                break
+            acquired += 1
+        if acquired < len(args_list):
+            for _ in range(acquired):
+                self._slots.release()
+            raise QueueFull(f"File d'attente pleine ({self.workers + self.queue_size} places)")
+
+        futures = []
+        try:
+            for args in args_list:
+                future = self._executor.submit(fn, *args)
+                future.add_done_callback(lambda _: self._slots.release())
+                futures.append(future)
+        except Exception:
+            for _ in range(len(args_list) - len(futures)):
+                self._slots.release()
+            raise
+        return futures
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,235 @@
+"""Service HTTP d'identification.
+
+Usage : DGSN_SERVICE_TOKEN=... python -m service.server [--host 127.0.0.1] [--port 8600]
+        [--workers 4] [--queue-size 32]
+
+Chaque requête porte le jeton partagé DGSN_SERVICE_TOKEN (en-tête ``X-DGSN-Token``)
+et l'identifiant de l'utilisateur appelant (``X-DGSN-User``), inscrit au journal
+d'audit avec les recherches, enregistrements et consultations de fiches.
+
+Routes (JSON, images encodées en base64) :
+  POST /identify          {"image", "model_name"?, "threshold"?, "top_k"?, "filters"?}
+  POST /identify/batch    {"images": [...], "model_name"?, "threshold"?, "top_k"?, "filters"?}
+  POST /identify/fused    {"images": [...], "fusion"?, "model_name"?, "threshold"?, "top_k"?, "filters"?}
+                          (plusieurs photos d'une même personne, un seul classement)
+  POST /enroll            {"criminal": {...}, "images": [...]}
+  GET  /criminals/<id>
+  GET  /health
+"""
+import argparse
+import base64
+import binascii
+import hashlib
+import hmac
+import json
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from audit import audit_event
+from config import SERVICE_QUEUE_SIZE, SERVICE_TIMEOUT, SERVICE_TOKEN, SERVICE_WORKERS
+from . import tasks
+from .pool import QueueFull, RecognitionPool
+
+MAX_BODY_BYTES = 50 * 1024 * 1024
+TOKEN_HEADER = "X-DGSN-Token"
+USER_HEADER = "X-DGSN-User"
+CRIMINAL_FIELDS = [
+    "nom", "prenom", "alias", "age", "date_naissance", "lieu_naissance", "nationalite",
+    "telephone", "adresse", "date_arrestation", "implication", "crime", "description",
+]
+
+
+class BadRequest(Exception):
+    pass
+
+
+def _decode_image(value) -> bytes:
+    try:
+        return base64.b64decode(value, validate=True)
+    except (binascii.Error, TypeError, ValueError):
+        raise BadRequest("Image base64 invalide")
+
+
+def _probe_digest(images) -> str:
+    """Empreinte de la photo (ou de la suite de photos) recherchée, comme dans l'interface."""
+    if len(images) == 1:
+        return hashlib.sha256(images[0]).hexdigest()
+    digest = hashlib.sha256()
+    for image in images:
+        digest.update(hashlib.sha256(image).digest())
+    return digest.hexdigest()
+
+
+def _search_params(payload: dict):
+    filters = payload.get("filters")
+    if filters is not None and not isinstance(filters, dict):
+        raise BadRequest("Champ 'filters' invalide")
+    return (
+        payload.get("model_name", "Facenet"),
+        float(payload["threshold"]) if payload.get("threshold") is not None else None,
+        int(payload.get("top_k", 3)),
+        filters,
+    )
+
+
+class IdentificationHandler(BaseHTTPRequestHandler):
+    server_version = "DGSNIdentification/1.0"
+
+    @property
+    def pool(self) -> RecognitionPool:
+        return self.server.pool
+
+    @property
+    def caller(self) -> str:
+        """Utilisateur pour le compte duquel le client appelle, sinon l'adresse du client."""
+        return self.headers.get(USER_HEADER) or f"service:{self.client_address[0]}"
+
+    def _authorized(self) -> bool:
+        token = (self.headers.get(TOKEN_HEADER) or "").encode()
+        return hmac.compare_digest(token, self.server.token)
+
+    def _audit(self, action: str, target=None, **details) -> None:
+        audit_event(action, self.caller, target, {**details, "via": "service", "client": self.client_address[0]})
+
+    def do_GET(self):
+        if not self._authorized():
+            return self._send(401, {"error": "Jeton du service invalide"})
+        parts = self.path.strip("/").split("/")
+        if parts == ["health"]:
+            return self._send(200, {"status": "ok", "workers": self.pool.workers})
+        if len(parts) == 2 and parts[0] == "criminals" and parts[1].isdigit():
+            return self._run(lambda: self._get_criminal(int(parts[1])), not_found=True)
+        self._send(404, {"error": "Route inconnue"})
+
+    def do_POST(self):
+        if not self._authorized():
+            return self._send(401, {"error": "Jeton du service invalide"})
+        routes = {
+            "/identify": self._identify,
+            "/identify/batch": self._identify_batch,
+            "/identify/fused": self._identify_fused,
+            "/enroll": self._enroll,
+        }
+        handler = routes.get(self.path.rstrip("/"))
+        if handler is None:
+            return self._send(404, {"error": "Route inconnue"})
+        self._run(lambda: handler(self._read_json()))
+
+    def _get_criminal(self, criminal_id: int):
+        self._audit("criminal_view", criminal_id)
+        return self._wait(self.pool.submit(tasks.get_criminal, criminal_id))
+
+    def _identify(self, payload):
+        image = _decode_image(payload.get("image"))
+        params = _search_params(payload)
+        self._audit("face_search", probe=_probe_digest([image]), photos=1, filters=params[3])
+        future = self.pool.submit(tasks.identify, image, *params)
+        return {"results": self._wait(future)}
+
+    def _identify_batch(self, payload):
+        images = payload.get("images")
+        if not isinstance(images, list) or not images:
+            raise BadRequest("Champ 'images' manquant")
+        params = _search_params(payload)
+        images = [_decode_image(i) for i in images]
+        for image in images:
+            self._audit("face_search", probe=_probe_digest([image]), photos=1, filters=params[3])
+        futures = self.pool.submit_many(tasks.identify, [(image, *params) for image in images])
+        return {"results": [self._wait(f) for f in futures]}
+
+    def _identify_fused(self, payload):
+        images = payload.get("images")
+        if not isinstance(images, list) or not images:
+            raise BadRequest("Champ 'images' manquant")
+        fusion = payload.get("fusion", "min")
+        if fusion not in ("min", "mean", "learned"):
+            raise BadRequest("Champ 'fusion' invalide")
+        images = [_decode_image(i) for i in images]
+        params = _search_params(payload)
+        self._audit("face_search", probe=_probe_digest(images), photos=len(images), fusion=fusion, filters=params[3])
+        future = self.pool.submit(tasks.identify_fused, images, *params, fusion)
+        return {"results": self._wait(future)}
+
+    def _enroll(self, payload):
+        criminal = payload.get("criminal") or {}
+        images = payload.get("images") or []
+        if not criminal.get("nom") or not images:
+            raise BadRequest("Un nom et au moins une image sont requis")
+        data = {field: criminal.get(field) for field in CRIMINAL_FIELDS}
+        future = self.pool.submit(tasks.enroll, data, [_decode_image(i) for i in images])
+        criminal_id = self._wait(future)
+        self._audit("criminal_create", criminal_id, photos=len(images))
+        return {"id": criminal_id}
+
+    def _wait(self, future):
+        return future.result(timeout=SERVICE_TIMEOUT)
+
+    def _run(self, action, not_found: bool = False):
+        try:
+            result = action()
+        except BadRequest as e:
+            return self._send(400, {"error": str(e)})
+        except QueueFull as e:
+            return self._send(503, {"error": str(e)}, headers={"Retry-After": "1"})
+        except Exception as e:
+            return self._send(500, {"error": str(e)})
+        if not_found and result is None:
+            return self._send(404, {"error": "Criminel non trouvé"})
+        self._send(200, result)
+
+    def _read_json(self) -> dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        if length <= 0 or length > MAX_BODY_BYTES:
+            raise BadRequest("Corps de requête absent ou trop volumineux")
+        try:
+            payload = json.loads(self.rfile.read(length))
+        except ValueError:
+            raise BadRequest("JSON invalide")
+        if not isinstance(payload, dict):
+            raise BadRequest("Objet JSON attendu")
+        return payload
+
+    def _send(self, status: int, body, headers=None):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def serve(host: str, port: int, workers: int, queue_size: int, model_name: str = "Facenet",
+          token: str = SERVICE_TOKEN) -> None:
+    if not token:
+        raise ValueError("Jeton du service manquant (DGSN_SERVICE_TOKEN)")
+    pool = RecognitionPool(workers, queue_size, model_name)
+    httpd = ThreadingHTTPServer((host, port), IdentificationHandler)
+    httpd.daemon_threads = True
+    httpd.pool = pool
+    httpd.token = token.encode()
+    print(f"Service d'identification sur http://{host}:{port} ({workers} processus, file de {queue_size})")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+        pool.shutdown()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Service HTTP d'identification DGSN")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8600)
+    parser.add_argument("--workers", type=int, default=SERVICE_WORKERS)
+    parser.add_argument("--queue-size", type=int, default=SERVICE_QUEUE_SIZE)
+    parser.add_argument("--model", default="Facenet")
+    args = parser.parse_args()
+    if not SERVICE_TOKEN:
+        parser.error("DGSN_SERVICE_TOKEN doit être définie (jeton secret partagé avec les clients)")
+    serve(args.host, args.port, args.workers, args.queue_size, args.model)
+
+
+if __name__ == "__main__":
+    main()
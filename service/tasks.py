@@ -0,0 +1,68 @@
+"""Tâches exécutées dans les processus du pool de reconnaissance.
+
+Chaque processus ouvre sa propre connexion (import de ``database``) et garde
+le modèle DeepFace en mémoire entre deux requêtes.
+"""
+import io
+from datetime import date, datetime
+
+from PIL import Image
+
+
+def init_worker(model_name: str) -> None:
+    from utils import initialize_deepface
+    initialize_deepface()
+    from deepface import DeepFace
+    DeepFace.build_model(model_name)
+
+
+def _cursor():
+    from database import cursor
+    if not cursor:
+        raise RuntimeError("Base de données indisponible")
+    return cursor
+
+
+def _jsonable(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    if isinstance(value, (bytes, memoryview)):
+        return None
+    return value
+
+
+def identify(image_bytes: bytes, model_name: str, threshold: float, top_k: int, filters: dict = None):
+    from utils import find_match, serialize_match
+    img = Image.open(io.BytesIO(image_bytes)).convert("RGB")
+    results = find_match(img, _cursor(), model_name=model_name, threshold=threshold, top_k=top_k, filters=filters)
+    return [serialize_match(r) for r in results]
+
+
+def identify_fused(images_bytes, model_name: str, threshold: float, top_k: int, filters: dict = None,
+                   fusion: str = "min"):
+    from utils import find_match_fused, serialize_match
+    images = [Image.open(io.BytesIO(b)).convert("RGB") for b in images_bytes]
+    results, _ = find_match_fused(
+        images, _cursor(), model_name=model_name, threshold=threshold, top_k=top_k, fusion=fusion, filters=filters
+    )
+    return [serialize_match(r) for r in results]
+
+
+def enroll(data: dict, images_bytes):
+    from database import insert_criminal
+    _cursor()
+    images = [Image.open(io.BytesIO(b)) for b in images_bytes]
+    return insert_criminal(data, images)
+
+
+def get_criminal(criminal_id: int):
+    cursor = _cursor()
+    cursor.execute("SELECT * FROM criminals WHERE id = %s", (criminal_id,))
+    row = cursor.fetchone()
+    if not row:
+        return None
+    columns = [col[0] for col in cursor.description]
+    record = {col: _jsonable(val) for col, val in zip(columns, row) if col != "image"}
+    cursor.execute("SELECT id FROM images_criminels WHERE criminal_id = %s ORDER BY id", (criminal_id,))
+    record["photos"] = [r[0] for r in cursor.fetchall()]
+    return record
@@ -0,0 +1,4 @@
+"""Galerie répartie : serveurs de shards et coordinateur scatter-gather."""
+from .coordinator import ShardCoordinator, ShardUnavailable, get_coordinator
+
+__all__ = ["ShardCoordinator", "ShardUnavailable", "get_coordinator"]
@@ -0,0 +1,181 @@
+"""Coordinateur de recherche sur une galerie répartie en shards.
+
+Les embeddings des requêtes sont envoyés à tous les shards en parallèle ; les
+top-k de chaque shard sont fusionnés en top-k global. Comme un criminel
+appartient à un seul shard, la fusion se limite à un tri par distance. Un shard
+lent ou injoignable est ignoré après le délai : le résultat est alors partiel.
+"""
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout, as_completed
+from multiprocessing.connection import Connection, answer_challenge, deliver_challenge
+from time import monotonic
+
+import numpy as np
+
+from config import SHARD_ADDRESSES, SHARD_AUTHKEY, SHARD_TIMEOUT
+from recognition.index import merge_matches
+
+
+class ShardUnavailable(Exception):
+    """Le shard n'a pas répondu à temps ou a renvoyé une erreur."""
+
+
+def parse_address(address: str):
+    host, _, port = address.strip().rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+
+class ShardCoordinator:
+    """Diffuse les requêtes aux shards et fusionne leurs réponses."""
+
+    def __init__(self, addresses, authkey: bytes = SHARD_AUTHKEY, timeout: float = SHARD_TIMEOUT):
+        if not authkey:
+            raise ValueError("Clé des shards manquante (DGSN_SHARD_AUTHKEY)")
+        self.addresses = [parse_address(a) if isinstance(a, str) else tuple(a) for a in addresses]
+        self.authkey = authkey
+        self.timeout = timeout
+
+    def _connect(self, address, deadline: float):
+        """Connexion authentifiée ; la connexion TCP et le défi de la clé sont bornés par ``deadline``."""
+        sock = socket.create_connection(address, timeout=max(0.001, deadline - monotonic()))
+        sock.setblocking(True)
+        conn = Connection(sock.detach())
+        try:
+            if not conn.poll(max(0.0, deadline - monotonic())):
+                raise ShardUnavailable("authentification : délai dépassé")
+            answer_challenge(conn, self.authkey)
+            deliver_challenge(conn, self.authkey)
+        except BaseException:
+            conn.close()
+            raise
+        return conn
+
+    def _ask(self, address, request: dict, deadline: float) -> dict:
+        """Une requête sur une connexion dédiée : un shard lent ne bloque pas les suivantes."""
+        name = f"{address[0]}:{address[1]}"
+        try:
+            with self._connect(address, deadline) as conn:
+                conn.send(request)
+                if not conn.poll(max(0.0, deadline - monotonic())):
+                    raise ShardUnavailable("délai dépassé")
+                response = conn.recv()
+        except ShardUnavailable as e:
+            raise ShardUnavailable(f"{name} : {e}")
+        except Exception as e:
+            # OSError, EOFError, AuthenticationError (clé différente)...
+            raise ShardUnavailable(f"{name} : {e!r}")
+        if "error" in response:
+            raise ShardUnavailable(f"{name} : {response['error']}")
+        return response
+
+    def _broadcast(self, request: dict, deadline: float) -> dict:
+        """Envoie ``request`` à tous les shards ; {future: numéro du shard}.
+
+        Un pool par appel : les recherches simultanées n'attendent pas de thread
+        libre, leur délai court dès l'envoi.
+        """
+        executor = ThreadPoolExecutor(max_workers=max(1, len(self.addresses)), thread_name_prefix="shard")
+        try:
+            return {
+                executor.submit(self._ask, address, request, deadline): shard
+                for shard, address in enumerate(self.addresses)
+            }
+        finally:
+            executor.shutdown(wait=False)
+
+    def _collect(self, futures: dict, deadline: float):
+        """(réponses dans l'ordre des shards, shards manquants), au plus tard à ``deadline``."""
+        responses, missing = [], []
+        for future, shard in futures.items():
+            try:
+                responses.append(future.result(timeout=max(0.0, deadline - monotonic())))
+            except (ShardUnavailable, FutureTimeout) as e:
+                print(f"Shard {shard} ignoré ({str(e) or 'délai dépassé'})")
+                missing.append(shard)
+        return responses, missing
+
+    def _request(self, queries, model_name: str, threshold: float, top_k: int, criminals=None) -> dict:
+        return {
+            "op": "search",
+            "queries": np.stack([np.asarray(q, dtype=np.float32) for q in queries]),
+            "model_name": model_name,
+            "threshold": float(threshold),
+            "top_k": int(top_k),
+            "criminals": np.asarray(criminals, dtype=np.int64) if criminals is not None else None,
+        }
+
+    def search_many(self, queries, model_name: str, threshold: float, top_k: int, criminals=None):
+        """Retourne (une liste de correspondances par requête, shards manquants).
+
+        ``criminals`` : identifiants auxquels limiter la recherche (filtres d'attributs).
+        """
+        if not len(queries):
+            return [], []
+        request = self._request(queries, model_name, threshold, top_k, criminals)
+        deadline = monotonic() + self.timeout
+        responses, missing = self._collect(self._broadcast(request, deadline), deadline)
+        results = [
+            merge_matches([r["results"][j] for r in responses], top_k)
+            for j in range(len(queries))
+        ]
+        return results, missing
+
+    def search_fused(self, queries, model_name: str, threshold: float, top_k: int, fusion: str = "min",
+                     weights=None, criminals=None):
+        """Recherche fusionnée de plusieurs photos d'une même personne : (correspondances, shards manquants)."""
+        request = self._request(queries, model_name, threshold, top_k, criminals)
+        request.update(op="search_fused", fusion=fusion, weights=weights)
+        deadline = monotonic() + self.timeout
+        responses, missing = self._collect(self._broadcast(request, deadline), deadline)
+        return merge_matches([r["results"] for r in responses], top_k), missing
+
+    def search(self, query, model_name: str, threshold: float, top_k: int, criminals=None):
+        results, missing = self.search_many([query], model_name, threshold, top_k, criminals)
+        return results[0], missing
+
+    def search_stream(self, query, model_name: str, threshold: float, top_k: int, criminals=None, timeout: float = None):
+        """Produit (top-k fusionné, shards sans réponse) à chaque réponse de shard.
+
+        ``timeout`` (au plus le délai du coordinateur) borne l'attente : les shards encore
+        en attente sont alors comptés comme manquants dans le dernier résultat.
+        """
+        request = self._request([query], model_name, threshold, top_k, criminals)
+        timeout = self.timeout if timeout is None else min(timeout, self.timeout)
+        deadline = monotonic() + timeout
+        futures = self._broadcast(request, deadline)
+        pending = set(futures.values())
+        found, missing = [], []
+        try:
+            for future in as_completed(futures, timeout=max(0.0, deadline - monotonic())):
+                shard = futures[future]
+                pending.discard(shard)
+                try:
+                    found = merge_matches([found, future.result()["results"][0]], top_k)
+                except ShardUnavailable as e:
+                    print(f"Shard {shard} ignoré ({e})")
+                    missing.append(shard)
+                yield found, missing + sorted(pending)
+        except FutureTimeout:
+            yield found, missing + sorted(pending)
+
+    def ping(self):
+        """Shards qui répondent dans le délai."""
+        deadline = monotonic() + self.timeout
+        _, missing = self._collect(self._broadcast({"op": "ping"}, deadline), deadline)
+        return [shard for shard in range(len(self.addresses)) if shard not in missing]
+
+
+_coordinator = None
+_lock = threading.Lock()
+
+
+def get_coordinator():
+    """Coordinateur configuré par DGSN_SHARD_ADDRESSES, ou None si la galerie n'est pas répartie."""
+    global _coordinator
+    if not SHARD_ADDRESSES:
+        return None
+    with _lock:
+        if _coordinator is None:
+            _coordinator = ShardCoordinator(SHARD_ADDRESSES)
+        return _coordinator
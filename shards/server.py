@@ -0,0 +1,125 @@
+"""Serveur d'un shard de la galerie.
+
+Le shard ``index`` sur ``count`` sert les criminels dont ``id % count == index`` :
+il ne charge que leurs embeddings et gabarits. Le coordinateur lui envoie les
+embeddings des requêtes (multiprocessing.connection, authentifié par la clé
+DGSN_SHARD_AUTHKEY, obligatoire : ne l'exposer que sur un réseau de confiance).
+
+Usage : DGSN_SHARD_AUTHKEY=... python -m shards.server --index 0 --count 4 [--host 10.0.0.5] [--port 8700]
+        python -m shards.server --count 4 --local [--port 8700]   (4 processus, ports 8700 à 8703)
+"""
+import argparse
+import multiprocessing
+import threading
+import traceback
+from multiprocessing.connection import Listener
+
+from config import SHARD_AUTHKEY
+
+
+class ShardServer:
+    """Répond aux recherches sur la partie ``(index, count)`` de la galerie."""
+
+    def __init__(self, index: int, count: int, address, authkey: bytes = SHARD_AUTHKEY):
+        if not authkey:
+            raise ValueError("Clé des shards manquante (DGSN_SHARD_AUTHKEY)")
+        self.shard = (index, count)
+        self.address = address
+        self.authkey = authkey
+        self._cursor = None
+
+    def cursor(self):
+        if self._cursor is None:
+            from database import connect
+            self._cursor = connect().cursor()
+        return self._cursor
+
+    def handle(self, request: dict) -> dict:
+        if request.get("op") == "ping":
+            return {"shard": self.shard[0]}
+        if request.get("op") not in ("search", "search_fused"):
+            raise ValueError(f"Opération inconnue : {request.get('op')}")
+        from recognition import get_gallery_index
+        index = get_gallery_index(self.cursor(), request["model_name"], shard=self.shard)
+        if request["op"] == "search_fused":
+            results = index.search_fused(
+                list(request["queries"]), request["threshold"], request["top_k"], request.get("fusion", "min"),
+                request.get("weights"), criminals=request.get("criminals"),
+            )
+        else:
+            results = index.search_many(
+                list(request["queries"]), request["threshold"], request["top_k"], criminals=request.get("criminals")
+            )
+        return {"shard": self.shard[0], "version": index.version, "results": results}
+
+    def _serve_connection(self, conn) -> None:
+        with conn:
+            while True:
+                try:
+                    request = conn.recv()
+                except (EOFError, OSError):
+                    return
+                try:
+                    response = self.handle(request)
+                except Exception as e:
+                    traceback.print_exc()
+                    response = {"shard": self.shard[0], "error": str(e)}
+                try:
+                    conn.send(response)
+                except OSError:
+                    # Le coordinateur a abandonné la requête (délai dépassé)
+                    return
+
+    def serve_forever(self) -> None:
+        with Listener(self.address, authkey=self.authkey) as listener:
+            print(f"Shard {self.shard[0]}/{self.shard[1]} à l'écoute sur {self.address[0]}:{self.address[1]}")
+            while True:
+                try:
+                    conn = listener.accept()
+                except Exception as e:
+                    # Clé invalide ou connexion interrompue pendant l'authentification
+                    print(f"Connexion refusée : {e}")
+                    continue
+                threading.Thread(target=self._serve_connection, args=(conn,), daemon=True).start()
+
+
+def run_shard(index: int, count: int, host: str, port: int) -> None:
+    from utils import initialize_deepface
+    initialize_deepface()
+    ShardServer(index, count, (host, port)).serve_forever()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Serveur de shard de la galerie")
+    parser.add_argument("--index", type=int, default=0)
+    parser.add_argument("--count", type=int, required=True)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8700)
+    parser.add_argument("--local", action="store_true",
+                        help="Lance les --count shards sur cette machine (ports consécutifs)")
+    args = parser.parse_args()
+
+    if not SHARD_AUTHKEY:
+        parser.error("DGSN_SHARD_AUTHKEY doit être définie (clé secrète partagée avec le coordinateur)")
+    if not args.local:
+        run_shard(args.index, args.count, args.host, args.port)
+        return
+    ctx = multiprocessing.get_context("spawn")
+    processes = [
+        ctx.Process(target=run_shard, args=(i, args.count, args.host, args.port + i))
+        for i in range(args.count)
+    ]
+    for p in processes:
+        p.start()
+    addresses = ",".join(f"{args.host}:{args.port + i}" for i in range(args.count))
+    print(f"DGSN_SHARD_ADDRESSES={addresses}")
+    try:
+        for p in processes:
+            p.join()
+    except KeyboardInterrupt:
+        for p in processes:
+            p.terminate()
+
+
+if __name__ == "__main__":
+    main()
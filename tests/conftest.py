@@ -0,0 +1,31 @@
+"""Configuration commune des tests.
+
+Les tests qui ont besoin de PostgreSQL utilisent la base désignée par
+DGSN_TEST_DSN (DSN libpq, base jetable) ; ils sont ignorés sans elle.
+"""
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+TEST_DSN = os.environ.get("DGSN_TEST_DSN", "")
+if TEST_DSN:
+    # Avant tout import de ``database`` : la connexion partagée est ouverte à l'import
+    os.environ["DGSN_PRIMARY_DSN"] = TEST_DSN
+os.environ.setdefault("DGSN_GALLERY_NOTIFY", "0")
+
+
+@pytest.fixture
+def db():
+    """Curseur de la base de test, schéma créé ; le test est ignoré sans DGSN_TEST_DSN."""
+    if not TEST_DSN:
+        pytest.skip("DGSN_TEST_DSN non définie")
+    from database import cursor, setup_db
+
+    if cursor is None:
+        pytest.skip("base de test injoignable")
+    setup_db()
+    return cursor
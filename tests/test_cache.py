@@ -0,0 +1,50 @@
+from recognition import cache as cache_module
+from recognition.cache import TTLCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache_module, "monotonic", clock)
+    cache = TTLCache(maxsize=4, ttl=10)
+    cache.set("a", 1)
+    clock.now += 9
+    assert cache.get("a") == 1
+    clock.now += 2
+    assert cache.get("a", "absent") == "absent"
+    assert len(cache) == 0
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1  # "b" devient la plus ancienne
+    cache.set("c", 3)
+    assert cache.keys() == ["a", "c"]
+    assert cache.get("b") is None
+
+
+def test_bump_rejects_results_computed_before_a_change():
+    cache = TTLCache()
+    generation = cache.generation
+    cache.bump()
+    assert not cache.set("stale", 1, generation)
+    assert cache.get("stale") is None
+    assert cache.set("fresh", 2, cache.generation)
+    assert cache.get("fresh") == 2
+
+
+def test_discard_if_removes_matching_entries():
+    cache = TTLCache()
+    for key in range(5):
+        cache.set(key, key * 10)
+    assert cache.discard_if(lambda key, value: value >= 30) == 2
+    assert sorted(cache.keys()) == [0, 1, 2]
@@ -0,0 +1,52 @@
+import numpy as np
+
+from recognition.dedup import cluster_pairs, similar_pairs
+
+
+def test_cluster_pairs_groups_connected_criminals():
+    pairs = {(1, 2): None, (2, 5): None, (7, 8): None, (5, 1): None}
+    assert cluster_pairs(pairs) == [[1, 2, 5], [7, 8]]
+
+
+def test_cluster_pairs_joins_chains_through_larger_ids():
+    assert cluster_pairs([(4, 9), (3, 9), (1, 3)]) == [[1, 3, 4, 9]]
+
+
+def test_cluster_pairs_without_pairs():
+    assert cluster_pairs({}) == []
+
+
+def test_similar_pairs_across_blocks_ignores_same_criminal():
+    rng = np.random.default_rng(1)
+    base = rng.normal(size=(3, 64)).astype(np.float32)
+    # Deux photos du criminel 1, une copie proche chez le criminel 2, le criminel 3 distinct
+    vectors = np.stack([base[0], base[0] + 0.01, base[1], base[0] + 0.02, base[2]])
+    criminal_ids = [1, 1, 3, 2, 4]
+    image_ids = [10, 11, 30, 20, 40]
+    pairs = similar_pairs(criminal_ids, image_ids, vectors, threshold=0.05, block_size=2)
+    assert set(pairs) == {(1, 2)}
+    distance, image_a, image_b = pairs[(1, 2)]
+    assert image_a in (10, 11) and image_b == 20
+    assert distance < 0.05
+
+
+def test_merge_keeps_source_fields(db):
+    from database import merge_criminals, merge_differences
+
+    db.execute("INSERT INTO criminals (nom, crime, description) VALUES ('Fusion', 'Vol', 'Cible') RETURNING id")
+    target = db.fetchone()[0]
+    db.execute("INSERT INTO criminals (nom, alias, crime) VALUES ('fusion', 'Le Renard', 'Fraude') RETURNING id")
+    source = db.fetchone()[0]
+    db.execute("INSERT INTO images_criminels (criminal_id, image) VALUES (%s, %s)", (source, b"\x00"))
+    try:
+        assert merge_differences(target, [source]) == {"crime": {target: "Vol", source: "Fraude"}}
+        assert merge_criminals(target, [target, source], merged_by="pytest") == 1
+        db.execute("SELECT alias, crime, description FROM criminals WHERE id = %s", (target,))
+        alias, crime, description = db.fetchone()
+        assert (alias, crime) == ("Le Renard", "Vol")
+        assert description == f"Cible\n\nFusion du dossier #{source} — crime : Fraude"
+        db.execute("SELECT target_id, record->>'alias', merged_by FROM criminals_merged WHERE source_id = %s", (source,))
+        assert db.fetchone() == (target, "Le Renard", "pytest")
+    finally:
+        db.execute("DELETE FROM criminals WHERE id = ANY(%s)", ([target, source],))
+        db.execute("DELETE FROM criminals_merged WHERE source_id = %s", (source,))
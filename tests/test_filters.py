@@ -0,0 +1,48 @@
+from datetime import date
+
+import pytest
+
+from database.filters import filter_clause, filters_key, normalize_filters
+
+
+def test_empty_filters_are_none():
+    assert normalize_filters(None) is None
+    assert normalize_filters({"crimes": [], "nationalite": "  ", "age_min": None}) is None
+
+
+def test_normalize_filters_canonical_form():
+    filters = normalize_filters({
+        "crimes": ["Vol", "Escroquerie", "Vol"],
+        "nationalite": " Marocaine ",
+        "age_min": "18",
+        "arrested_from": date(2020, 1, 31),
+        "arrested_to": "2021-06-01",
+    })
+    assert filters == {
+        "crimes": ["Escroquerie", "Vol"],
+        "nationalite": "Marocaine",
+        "age_min": 18,
+        "arrested_from": "2020-01-31",
+        "arrested_to": "2021-06-01",
+    }
+    assert filters_key(filters) == filters_key(normalize_filters({
+        "arrested_to": "2021-06-01", "crimes": ["Vol", "Escroquerie"], "nationalite": "Marocaine",
+        "age_min": 18, "arrested_from": "2020-01-31",
+    }))
+
+
+def test_normalize_filters_rejects_unknown_keys():
+    with pytest.raises(ValueError):
+        normalize_filters({"taille": 180})
+
+
+def test_normalize_filters_rejects_invalid_date():
+    with pytest.raises(ValueError):
+        normalize_filters({"arrested_from": "31/01/2020"})
+
+
+def test_filter_clause_parameters_follow_conditions():
+    clause, params = filter_clause(normalize_filters({"crimes": ["Vol"], "age_max": 40}))
+    assert clause == "c.crime = ANY(%s) AND c.age <= %s"
+    assert params == [["Vol"], 40]
+    assert filter_clause({}) == ("TRUE", [])
@@ -0,0 +1,23 @@
+import numpy as np
+import pytest
+
+from recognition.fusion import fuse
+
+
+def test_fuse_modes():
+    distances = np.array([[0.2, 0.4, 0.6], [0.3, 0.3, 0.3]], dtype=np.float32)
+    assert np.allclose(fuse(distances, "min"), [0.2, 0.3])
+    assert np.allclose(fuse(distances, "mean"), [0.4, 0.3])
+    assert np.allclose(fuse(distances, "learned", (0.5, 0.0, 0.5)), [0.4, 0.3])
+    # Poids par défaut : équivalent au minimum
+    assert np.allclose(fuse(distances, "learned"), fuse(distances, "min"))
+
+
+def test_fuse_ignores_zero_weight_on_missing_query():
+    distances = np.array([[0.2, np.inf]], dtype=np.float32)
+    assert np.allclose(fuse(distances, "learned", (1.0, 0.0, 0.0)), [0.2])
+
+
+def test_fuse_rejects_unknown_mode():
+    with pytest.raises(ValueError):
+        fuse(np.zeros((1, 2)), "max")
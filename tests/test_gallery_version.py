@@ -0,0 +1,82 @@
+import threading
+
+import numpy as np
+
+from recognition.cache import gallery_version
+
+
+def enroll(cur, name: str, vectors):
+    """Fiche, photos et embeddings dans la transaction de ``cur`` (sans DeepFace)."""
+    from recognition.embeddings import store_embeddings
+
+    cur.execute("INSERT INTO criminals (nom, crime) VALUES (%s, 'Vol') RETURNING id", (name,))
+    criminal_id = cur.fetchone()[0]
+    rows = []
+    for vec in vectors:
+        cur.execute(
+            "INSERT INTO images_criminels (criminal_id, image) VALUES (%s, %s) RETURNING id", (criminal_id, b"\x00")
+        )
+        rows.append((cur.fetchone()[0], vec, 1.0))
+    store_embeddings(cur, "Facenet", rows)
+    return criminal_id
+
+
+def test_version_is_bumped_once_per_transaction(db):
+    from database import transaction
+
+    before = gallery_version(db)
+    with transaction() as cur:
+        criminal_id = enroll(cur, "Version", np.eye(3, 128, dtype=np.float32))
+    try:
+        assert gallery_version(db) == before + 1
+    finally:
+        db.execute("DELETE FROM criminals WHERE id = %s", (criminal_id,))
+    assert gallery_version(db) == before + 2
+
+
+def test_text_only_update_keeps_the_version(db):
+    from database import transaction
+
+    with transaction() as cur:
+        criminal_id = enroll(cur, "Texte", [np.ones(128, dtype=np.float32)])
+    try:
+        before = gallery_version(db)
+        db.execute("UPDATE criminals SET telephone = '0600000000', adresse = 'Rabat' WHERE id = %s", (criminal_id,))
+        assert gallery_version(db) == before
+        db.execute("UPDATE criminals SET crime = 'Escroquerie' WHERE id = %s", (criminal_id,))
+        assert gallery_version(db) == before + 1
+    finally:
+        db.execute("DELETE FROM criminals WHERE id = %s", (criminal_id,))
+
+
+def test_parallel_enrollments_do_not_block_each_other(db):
+    from database import connect
+
+    first, second = connect(autocommit=False), connect(autocommit=False)
+    ids = []
+    try:
+        before = gallery_version(db)
+        cur1, cur2 = first.cursor(), second.cursor()
+        ids.append(enroll(cur1, "Parallèle 1", [np.ones(128, dtype=np.float32)]))
+        # La première transaction reste ouverte : la seconde ne doit pas l'attendre
+        cur2.execute("SET LOCAL lock_timeout = '2s'")
+        done = threading.Event()
+
+        def second_enrollment():
+            ids.append(enroll(cur2, "Parallèle 2", [np.full(128, 2, dtype=np.float32)]))
+            second.commit()
+            done.set()
+
+        thread = threading.Thread(target=second_enrollment)
+        thread.start()
+        thread.join(timeout=10)
+        assert done.is_set()
+        first.commit()
+        assert gallery_version(db) == before + 2
+    finally:
+        first.rollback()
+        second.rollback()
+        if ids:
+            db.execute("DELETE FROM criminals WHERE id = ANY(%s)", (ids,))
+        first.close()
+        second.close()
@@ -0,0 +1,82 @@
+import threading
+from time import monotonic
+
+import numpy as np
+import pytest
+
+from recognition.index import best_per_person, get_gallery_index, merge_matches
+
+
+def test_best_per_person_keeps_closest_photo_under_threshold():
+    criminal_ids = np.array([1, 1, 2, 3, 3])
+    image_ids = np.array([10, 11, 20, 30, 31])
+    distances = np.array([0.35, 0.15, 0.50, 0.25, 0.05])
+    assert best_per_person(criminal_ids, image_ids, distances, threshold=0.4, top_k=5) == [
+        (3, 31, 0.05),
+        (1, 11, 0.15),
+    ]
+
+
+def test_best_per_person_applies_top_k():
+    criminal_ids = np.arange(5)
+    distances = np.array([0.5, 0.1, 0.3, 0.2, 0.4])
+    found = best_per_person(criminal_ids, criminal_ids * 10, distances, threshold=1.0, top_k=2)
+    assert [cid for cid, _, _ in found] == [1, 3]
+
+
+def test_merge_matches_sorts_by_distance_and_truncates():
+    merged = merge_matches([[(1, 10, 0.30), (2, 20, 0.10)], [], [(3, 30, 0.20)]], top_k=2)
+    assert merged == [(2, 20, 0.10), (3, 30, 0.20)]
+
+
+def test_merge_matches_keeps_at_least_one_result():
+    assert merge_matches([[(1, 10, 0.3)], [(2, 20, 0.1)]], top_k=0) == [(2, 20, 0.1)]
+
+
+@pytest.fixture
+def fake_gallery(monkeypatch):
+    """Index construits sans base : le chargement du modèle "Lent" attend ``release``."""
+    from recognition import index as index_module
+
+    release = threading.Event()
+    loads = []
+
+    def load_embeddings(cursor, model_name, shard=None, criminals=None):
+        loads.append(model_name)
+        if model_name == "Lent":
+            assert release.wait(10)
+        return [1, 2], [1, 2], np.eye(2, 4, dtype=np.float32)
+
+    monkeypatch.setattr(index_module, "_indexes", {})
+    monkeypatch.setattr(index_module, "_build_locks", {})
+    monkeypatch.setattr(index_module, "_pending", {})
+    monkeypatch.setattr(index_module, "INDEX_SNAPSHOTS", False)
+    monkeypatch.setattr(index_module, "watch_gallery", lambda: None)
+    monkeypatch.setattr(index_module, "gallery_version", lambda cursor: 1)
+    monkeypatch.setattr(index_module, "backfill_async", lambda model_name, shard=None: None)
+    monkeypatch.setattr(index_module, "load_embeddings", load_embeddings)
+    monkeypatch.setattr(index_module, "load_templates", lambda cursor, model_name, shard=None: {})
+    return release, loads
+
+
+def test_loading_one_index_does_not_block_others(fake_gallery):
+    release, loads = fake_gallery
+    slow = [None, None]
+
+    def search(i):
+        slow[i] = get_gallery_index(None, "Lent")
+
+    threads = [threading.Thread(target=search, args=(i,)) for i in range(2)]
+    for thread in threads:
+        thread.start()
+    try:
+        started = monotonic()
+        assert len(get_gallery_index(None, "Rapide")) == 2
+        assert monotonic() - started < 1.0
+    finally:
+        release.set()
+        for thread in threads:
+            thread.join(10)
+    # Un seul chargement pour les deux recherches concurrentes du même index
+    assert loads.count("Lent") == 1
+    assert slow[0] is slow[1] is get_gallery_index(None, "Lent")
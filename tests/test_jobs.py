@@ -0,0 +1,119 @@
+import time
+
+import pytest
+
+from jobs.queue import (
+    MAX_ATTEMPTS,
+    JobCancelled,
+    JobContext,
+    JobLost,
+    cancel_job,
+    claim_job,
+    finish_job,
+    get_job,
+    requeue_stale,
+    submit_job,
+)
+
+USER = "pytest-jobs"
+
+
+@pytest.fixture
+def queue(db):
+    """Curseur de la base de test, vidée des tâches actives (la base est jetable)."""
+    db.execute("DELETE FROM jobs WHERE created_by = %s OR status IN ('queued', 'running')", (USER,))
+    yield db
+    db.execute("DELETE FROM jobs WHERE created_by = %s", (USER,))
+
+
+def claim(cursor, worker: str, min_interval: float = 0):
+    job = claim_job(cursor, worker)
+    assert job is not None
+    return JobContext(cursor, *job, worker, min_interval=min_interval)
+
+
+def test_claim_and_finish(queue):
+    job_id = submit_job(queue, "search", {"top_k": 3}, [b"image"], created_by=USER)
+    job = claim(queue, "w1")
+    assert (job.id, job.kind, job.payload, job.inputs) == (job_id, "search", {"top_k": 3}, [b"image"])
+    assert claim_job(queue, "w2") is None
+    assert get_job(queue, job_id)["attempts"] == 1
+    assert not finish_job(queue, job_id, "w2", "succeeded", result={"results": []})
+    assert finish_job(queue, job_id, "w1", "succeeded", result={"results": []})
+    row = get_job(queue, job_id)
+    assert (row["status"], row["progress"], row["result"]) == ("succeeded", 1, {"results": []})
+
+
+def test_requeued_job_is_lost_by_its_first_worker(queue):
+    job_id = submit_job(queue, "search", created_by=USER)
+    first = claim(queue, "w1")
+    assert requeue_stale(queue, -1) == 1
+    second = claim(queue, "w2")
+    assert second.id == job_id
+    with pytest.raises(JobLost):
+        first.progress(0.5)
+    assert not finish_job(queue, job_id, "w1", "succeeded", result={"results": "stale"})
+    second.progress(0.5)
+    assert finish_job(queue, job_id, "w2", "succeeded", result={"results": []})
+    assert get_job(queue, job_id)["result"] == {"results": []}
+
+
+def test_job_fails_after_max_attempts(queue):
+    job_id = submit_job(queue, "search", created_by=USER)
+    for attempt in range(MAX_ATTEMPTS):
+        assert claim(queue, f"w{attempt}").id == job_id
+        requeue_stale(queue, -1)
+    row = get_job(queue, job_id)
+    assert row["status"] == "failed"
+    assert row["attempts"] == MAX_ATTEMPTS
+    assert claim_job(queue, "w") is None
+
+
+def test_cancellation(queue):
+    queued = submit_job(queue, "search", created_by=USER)
+    assert cancel_job(queue, queued)
+    assert get_job(queue, queued)["status"] == "cancelled"
+    assert not cancel_job(queue, queued)
+
+    running = submit_job(queue, "search", created_by=USER)
+    job = claim(queue, "w1")
+    assert cancel_job(queue, running)
+    with pytest.raises(JobCancelled):
+        job.progress(0.5)
+    # Un worker arrêté avant de voir l'annulation : la tâche est annulée, pas reprise
+    requeue_stale(queue, -1)
+    assert get_job(queue, running)["status"] == "cancelled"
+
+
+def test_heartbeat_reports_cancellation(queue):
+    from database import connect
+
+    submit_job(queue, "search", created_by=USER)
+    # ``progress`` n'interroge plus la base : seul le battement de cœur voit l'annulation
+    job = claim(queue, "w1", min_interval=3600)
+    job._last_update = time.monotonic()
+    with job.heartbeat(connect, 0.05):
+        cancel_job(queue, job.id)
+        with pytest.raises(JobCancelled):
+            for _ in range(100):
+                job.progress(0.5)
+                time.sleep(0.05)
+
+
+def test_checkpoint_is_rolled_back_when_the_job_is_lost(queue):
+    from database import transaction
+
+    job_id = submit_job(queue, "enroll", created_by=USER)
+    job = claim(queue, "w1")
+    with transaction() as cur:
+        job.checkpoint(cur, {"id": 42})
+    assert job.checkpointed() == {"id": 42}
+
+    requeue_stale(queue, -1)
+    with pytest.raises(JobLost):
+        with transaction() as cur:
+            cur.execute("UPDATE jobs SET message = 'écrit avant la perte' WHERE id = %s", (job_id,))
+            job.checkpoint(cur, {"id": 43})
+    row = get_job(queue, job_id)
+    assert row["result"] == {"id": 42}
+    assert row["message"] is None
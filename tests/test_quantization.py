@@ -0,0 +1,26 @@
+import numpy as np
+import pytest
+
+from recognition.quantization import QuantizedMatrix
+
+
+@pytest.mark.parametrize("mode", ["int8", "float16"])
+def test_quantized_dot_error_is_bounded(mode):
+    rng = np.random.default_rng(0)
+    matrix = rng.normal(size=(500, 128)).astype(np.float32)
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+    queries = rng.normal(size=(8, 128)).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+    quantized = QuantizedMatrix.quantize(matrix, mode)
+    exact = matrix @ queries.T
+    approx = quantized.dot(queries)
+    assert np.all(np.abs(approx - exact) <= quantized.error[:, None])
+
+    rows = np.array([7, 3, 499])
+    assert np.allclose(quantized.dot(queries, rows), approx[rows])
+
+
+def test_quantize_rejects_unknown_mode():
+    with pytest.raises(ValueError):
+        QuantizedMatrix.quantize(np.zeros((2, 4), dtype=np.float32), "int4")
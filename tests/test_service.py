@@ -0,0 +1,58 @@
+import json
+import threading
+import urllib.error
+import urllib.request
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+from service.server import IdentificationHandler, serve
+
+TOKEN = "test-service"
+
+
+class StubPool:
+    workers = 2
+
+
+@pytest.fixture
+def base_url():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), IdentificationHandler)
+    httpd.daemon_threads = True
+    httpd.pool = StubPool()
+    httpd.token = TOKEN.encode()
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    try:
+        yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+def get(url: str, token: str = None):
+    headers = {"X-DGSN-Token": token} if token is not None else {}
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, headers=headers), timeout=5) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+
+
+def test_requests_without_the_token_are_refused(base_url):
+    assert get(base_url + "/health")[0] == 401
+    assert get(base_url + "/health", "wrong")[0] == 401
+    assert get(base_url + "/criminals/1", "wrong")[0] == 401
+    request = urllib.request.Request(base_url + "/enroll", data=b"{}", method="POST")
+    with pytest.raises(urllib.error.HTTPError) as error:
+        urllib.request.urlopen(request, timeout=5)
+    assert error.value.code == 401
+
+
+def test_requests_with_the_token_are_routed(base_url):
+    assert get(base_url + "/health", TOKEN) == (200, {"status": "ok", "workers": 2})
+    assert get(base_url + "/unknown", TOKEN)[0] == 404
+
+
+def test_service_refuses_to_start_without_a_token():
+    with pytest.raises(ValueError):
+        serve("127.0.0.1", 0, 1, 1, token="")
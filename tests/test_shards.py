@@ -0,0 +1,170 @@
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+from time import monotonic, sleep
+
+import numpy as np
+import pytest
+
+from shards.coordinator import ShardCoordinator
+from shards.server import ShardServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+AUTHKEY = b"test-shards"
+
+
+def free_ports(count: int):
+    """Ports consécutifs libres sur la boucle locale."""
+    for _ in range(50):
+        with socket.socket() as probe:
+            probe.bind(("127.0.0.1", 0))
+            start = probe.getsockname()[1]
+        if start + count > 65535:
+            continue
+        sockets = []
+        try:
+            for port in range(start, start + count):
+                s = socket.socket()
+                s.bind(("127.0.0.1", port))
+                sockets.append(s)
+        except OSError:
+            continue
+        finally:
+            for s in sockets:
+                s.close()
+        return list(range(start, start + count))
+    raise RuntimeError("aucun port libre")
+
+
+class StubShard(ShardServer):
+    """Shard sans base : réponses fixes, éventuellement retardées."""
+
+    def __init__(self, index: int, count: int, address, results, delay: float = 0.0):
+        super().__init__(index, count, address, AUTHKEY)
+        self.results = results
+        self.delay = delay
+
+    def handle(self, request: dict) -> dict:
+        if request["op"] == "ping":
+            return {"shard": self.shard[0]}
+        sleep(self.delay)
+        return {"shard": self.shard[0], "version": 1, "results": [self.results for _ in request["queries"]]}
+
+
+def start_stub(*args, **kwargs) -> StubShard:
+    shard = StubShard(*args, **kwargs)
+    threading.Thread(target=shard.serve_forever, daemon=True).start()
+    return shard
+
+
+def wait_for(ping, expected, timeout: float = 30.0):
+    deadline = monotonic() + timeout
+    while monotonic() < deadline:
+        if ping() == expected:
+            return
+        sleep(0.2)
+    raise AssertionError(f"shards attendus {expected}, joignables {ping()}")
+
+
+def test_missing_and_slow_shards_give_partial_results():
+    ports = free_ports(3)
+    addresses = [("127.0.0.1", port) for port in ports]
+    start_stub(0, 3, addresses[0], [(3, 30, 0.10), (6, 60, 0.30)])
+    start_stub(1, 3, addresses[1], [(1, 10, 0.05)], delay=5.0)
+    # Shard 2 : rien n'écoute sur son port
+    coordinator = ShardCoordinator(addresses, AUTHKEY, timeout=0.5)
+    wait_for(coordinator.ping, [0, 1], timeout=5)
+
+    started = monotonic()
+    results, missing = coordinator.search_many([np.ones(4), np.zeros(4)], "Facenet", 0.4, top_k=5)
+    assert monotonic() - started < 2.0
+    assert missing == [1, 2]
+    assert results == [[(3, 30, 0.10), (6, 60, 0.30)]] * 2
+
+
+def test_results_of_all_shards_are_merged():
+    ports = free_ports(2)
+    addresses = [("127.0.0.1", port) for port in ports]
+    start_stub(0, 2, addresses[0], [(2, 20, 0.20), (4, 40, 0.35)])
+    start_stub(1, 2, addresses[1], [(1, 10, 0.05), (3, 30, 0.30)])
+    coordinator = ShardCoordinator(addresses, AUTHKEY, timeout=2.0)
+    wait_for(coordinator.ping, [0, 1], timeout=5)
+
+    found, missing = coordinator.search(np.ones(4), "Facenet", 0.4, top_k=3)
+    assert missing == []
+    assert found == [(1, 10, 0.05), (2, 20, 0.20), (3, 30, 0.30)]
+
+    streamed = list(coordinator.search_stream(np.ones(4), "Facenet", 0.4, top_k=3))
+    assert len(streamed) == 2
+    assert streamed[-1] == (found, [])
+
+
+def test_coordinator_requires_a_key():
+    with pytest.raises(ValueError):
+        ShardCoordinator([("127.0.0.1", 1)], b"")
+
+
+@pytest.fixture
+def local_shards(tmp_path):
+    """``python -m shards.server --count 2 --local`` : deux processus de shard."""
+    ports = free_ports(2)
+    env = {
+        **os.environ,
+        "DGSN_SHARD_AUTHKEY": AUTHKEY.decode(),
+        "DGSN_INDEX_DIR": str(tmp_path / "index"),
+        "PYTHONPATH": ROOT,
+    }
+    process = subprocess.Popen(
+        [sys.executable, "-m", "shards.server", "--count", "2", "--local", "--port", str(ports[0])],
+        cwd=ROOT, env=env, start_new_session=True,
+    )
+    try:
+        coordinator = ShardCoordinator([("127.0.0.1", port) for port in ports], AUTHKEY, timeout=2.0)
+        wait_for(coordinator.ping, [0, 1])
+        yield process, coordinator
+    finally:
+        # Le lanceur et ses processus de shard forment un groupe
+        try:
+            os.killpg(process.pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+        process.wait(timeout=10)
+
+
+def test_local_shard_processes_answer(local_shards):
+    process, coordinator = local_shards
+    assert coordinator.ping() == [0, 1]
+    os.killpg(process.pid, signal.SIGKILL)
+    process.wait(timeout=10)
+    sleep(0.5)
+    assert coordinator.ping() == []
+
+
+def test_local_shards_search_the_gallery(db, local_shards):
+    from database import transaction
+    from recognition.embeddings import store_embeddings
+
+    _, coordinator = local_shards
+    rng = np.random.default_rng(7)
+    vectors = rng.normal(size=(10, 128)).astype(np.float32)
+    with transaction() as cur:
+        ids = []
+        for n, vec in enumerate(vectors):
+            cur.execute("INSERT INTO criminals (nom) VALUES (%s) RETURNING id", (f"Shard{n}",))
+            criminal_id = cur.fetchone()[0]
+            cur.execute(
+                "INSERT INTO images_criminels (criminal_id, image) VALUES (%s, %s) RETURNING id",
+                (criminal_id, b"\x00"),
+            )
+            store_embeddings(cur, "Facenet", [(cur.fetchone()[0], vec, 1.0)])
+            ids.append(criminal_id)
+    try:
+        for n in (0, 1, 5):
+            found, missing = coordinator.search(vectors[n] + 0.01, "Facenet", 0.4, top_k=3)
+            assert missing == []
+            assert found[0][0] == ids[n]
+    finally:
+        db.execute("DELETE FROM criminals WHERE id = ANY(%s)", (ids,))
@@ -2,11 +2,13 @@
 import streamlit as st
 
 from auth import authenticate_user
-from database import cursor
+from database import cursor, session_lsn, set_session_lsn
+from utils import preload_heavy_modules
 from .utils import load_css, show_running_ui, app_header
 from .add import add_criminal_page
 from .search import search_criminal_page
 from .criminals import list_criminals_page, edit_criminal_page
+from .jobs import jobs_page
 
 __all__ = ["load_css", "show_running_ui", "app_header", "login_page", "main_page"]
 
@@ -44,10 +46,14 @@ def _view_page() -> None:
 
 
 def main_page() -> None:
+    # Utilisateur authentifié : DeepFace et ReportLab se chargent en arrière-plan
+    preload_heavy_modules()
+
     pages = {
         "search": {"icon": "🔍", "label": "Recherche", "func": search_criminal_page},
         "add": {"icon": "➕", "label": "Enregistrement", "func": add_criminal_page},
         "view": {"icon": "📄", "label": "Rapports", "func": _view_page},
+        "jobs": {"icon": "⏳", "label": "Tâches", "func": jobs_page},
     }
 
     if "active_page" not in st.session_state:
@@ -76,7 +82,12 @@ def main_page() -> None:
         st.rerun()
     st.sidebar.markdown("<div class='sidebar-footer'>v1.0</div>", unsafe_allow_html=True)
 
-    st.markdown("<div class='card'>", unsafe_allow_html=True)
-    pages[st.session_state["active_page"]]["func"]()
-    st.markdown("</div>", unsafe_allow_html=True)
+    # Lecture de ses propres écritures : la position WAL suit la session entre les reruns
+    set_session_lsn(st.session_state.get("db_lsn"))
+    try:
+        st.markdown("<div class='card'>", unsafe_allow_html=True)
+        pages[st.session_state["active_page"]]["func"]()
+        st.markdown("</div>", unsafe_allow_html=True)
+    finally:
+        st.session_state["db_lsn"] = session_lsn()
 
@@ -1,13 +1,16 @@
 """Pages et formulaires pour l'ajout de criminels."""
-import io
 from datetime import date
 
-import psycopg2
 import streamlit as st
 from PIL import Image
 
-from database import cursor
-from utils import image_to_bytes
+from config import SERVICE_URL
+from database import cursor, insert_criminal, add_photos, read_cursor
+from jobs import submit_job
+from recognition import embed_images
+from service import IdentificationClient, ServiceError
+from utils import encode_images, find_duplicates
+from .utils import audit
 
 
 def add_criminal_page() -> None:
@@ -74,7 +77,84 @@ def step1_form() -> None:
                 st.rerun()
 
 
+def duplicate_review() -> None:
+    """Propose de fusionner avec un criminel existant plutôt que de créer un doublon."""
+    pending = st.session_state["pending_enrollment"]
+    st.warning("⚠️ Ce visage correspond à des criminels déjà enregistrés. Fusionnez les photos plutôt que de créer un doublon.")
+    for dup in pending["duplicates"]:
+        col1, col2, col3 = st.columns([1, 3, 1])
+        with col1:
+            st.image(dup["reference_image"], width=100)
+        with col2:
+            st.markdown(f"**{dup['nom']}** (ID {dup['id']})")
+            st.write(f"**Crime :** {dup['crime']}")
+            st.write(f"**Correspondance :** {dup['similarity']:.2f}%")
+        with col3:
+            if st.button("🔗 Fusionner", key=f"merge_into_{dup['id']}"):
+                with st.spinner("Ajout des photos..."):
+                    added = add_photos(
+                        dup["id"], pending["images"], embeddings=pending["embeddings"], encoded=pending["encoded"]
+                    )
+                audit("photo_add", dup["id"], photos=added)
+                st.success(f"✅ {added} photo(s) ajoutée(s) au criminel ID {dup['id']}.")
+                _reset_enrollment()
+                st.rerun()
+
+    col_new, col_cancel = st.columns([1, 1])
+    with col_new:
+        if st.button("➕ Créer un nouveau dossier"):
+            with st.spinner("Enregistrement..."):
+                created = _create_record(pending)
+            if created:
+                _reset_enrollment()
+                st.rerun()
+    with col_cancel:
+        if st.button("Annuler"):
+            del st.session_state["pending_enrollment"]
+            st.rerun()
+
+
+def _create_record(pending) -> bool:
+    """Crée le dossier (tâche en arrière-plan, service ou base locale) après la vérification des doublons."""
+    if pending["background"]:
+        job_id = submit_job(
+            cursor,
+            "enroll",
+            payload={"criminal": pending["data"]},
+            inputs=pending["inputs"],
+            created_by=st.session_state.get("username"),
+        )
+        st.success(f"✅ Tâche #{job_id} soumise. Suivez-la dans la page « Tâches ».")
+        return True
+    if SERVICE_URL:
+        try:
+            # Journalisé par le service, pour le compte de l'utilisateur
+            criminal_id = IdentificationClient(username=st.session_state.get("username")).enroll(
+                pending["data"], pending["images"]
+            )
+        except ServiceError as e:
+            st.error(f"❌ {e}")
+            return False
+    else:
+        criminal_id = insert_criminal(
+            pending["data"], pending["images"], embeddings=pending["embeddings"], encoded=pending["encoded"]
+        )
+        audit("criminal_create", criminal_id, photos=len(pending["images"]))
+    added = len(pending["images"])
+    st.success(f"✅ Criminel ajouté (ID {criminal_id}). Photos : {added}.")
+    return True
+
+
+def _reset_enrollment() -> None:
+    st.session_state.pop("pending_enrollment", None)
+    st.session_state["add_criminal_step"] = 1
+    st.session_state["form_data"] = {}
+
+
 def step2_form() -> None:
+    if "pending_enrollment" in st.session_state:
+        duplicate_review()
+        return
     with st.form("add_criminal_form_step2", clear_on_submit=True):
         st.markdown("### Étape 2 : Informations judiciaires et images")
         st.info("Fournissez les détails judiciaires et chargez au moins une image. *Champs obligatoires.")
@@ -82,8 +162,9 @@ def step2_form() -> None:
         date_arrestation = st.date_input("Date d'arrestation *", value=st.session_state["form_data"].get("date_arrestation", date.today()))
         implication = st.text_input("Implication", value=st.session_state["form_data"].get("implication", ""), placeholder="Niveau d'implication")
 
-        cursor.execute("SELECT name FROM crime_types ORDER BY name")
-        crime_types = [row[0] for row in cursor.fetchall()]
+        with read_cursor() as cur:
+            cur.execute("SELECT name FROM crime_types ORDER BY name")
+            crime_types = [row[0] for row in cur.fetchall()]
         crime = st.selectbox(
             "Infractioncrime *",
             crime_types,
@@ -103,6 +184,8 @@ def step2_form() -> None:
             accept_multiple_files=True,
         )
 
+        background = st.checkbox("⏳ Enregistrer en arrière-plan")
+
         col1, col2 = st.columns([1, 1])
         with col1:
             if st.form_submit_button("Précédent"):
@@ -114,43 +197,35 @@ def step2_form() -> None:
                     st.error("⚠️ Au moins une image et un Infractioncrime sont requis.")
                 else:
                     with st.spinner("Enregistrement..."):
-                        first_img_bytes = image_to_bytes(Image.open(images_files[0]).convert("RGB"))
-                        data = (
-                            st.session_state["form_data"]["nom"],
-                            st.session_state["form_data"]["prenom"],
-                            st.session_state["form_data"]["alias"],
-                            st.session_state["form_data"]["age"],
-                            st.session_state["form_data"]["date_naissance"],
-                            st.session_state["form_data"]["lieu_naissance"],
-                            st.session_state["form_data"]["nationalite"],
-                            st.session_state["form_data"]["telephone"],
-                            st.session_state["form_data"]["adresse"],
-                            date_arrestation,
-                            implication,
-                            crime,
-                            description,
-                            psycopg2.Binary(first_img_bytes),
-                        )
-                        cursor.execute(
-                            """
-                            INSERT INTO criminals (nom, prenom, alias, age, date_naissance, lieu_naissance, nationalite, telephone, adresse, date_arrestation, implication, crime, description, image)
-                            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s) RETURNING id
-                            """,
-                            data,
-                        )
-                        criminal_id = cursor.fetchone()[0]
-
-                        added = 0
-                        for f in images_files[:5]:
-                            img_bytes = image_to_bytes(Image.open(f).convert("RGB"))
-                            cursor.execute(
-                                "INSERT INTO images_criminels (criminal_id, image) VALUES (%s, %s)",
-                                (criminal_id, psycopg2.Binary(img_bytes)),
-                            )
-                            added += 1
-
-                    st.success(f"✅ Criminel ajouté (ID {criminal_id}). Photos : {added}.")
+                        data = {
+                            **st.session_state["form_data"],
+                            "date_arrestation": date_arrestation,
+                            "implication": implication,
+                            "crime": crime,
+                            "description": description,
+                        }
+                        images = [Image.open(f) for f in images_files[:5]]
+                        # Recherche des doublons avant insertion, quel que soit le mode
+                        # d'enregistrement ; les embeddings sont réutilisés en local
+                        encoded = encode_images(images)
+                        embeddings = embed_images([full for full, _ in encoded], with_quality=True)
+                        pending = {
+                            "data": data,
+                            "images": images,
+                            "inputs": [f.getvalue() for f in images_files[:5]],
+                            "encoded": encoded,
+                            "embeddings": embeddings,
+                            "background": background,
+                        }
+                        duplicates = find_duplicates([vec for vec, _ in embeddings], cursor)
+                        if duplicates:
+                            st.session_state["pending_enrollment"] = {**pending, "duplicates": duplicates}
+                            st.rerun()
+                        if not _create_record(pending):
+                            return
+
                     st.session_state["add_criminal_step"] = 1
                     st.session_state["form_data"] = {}
-                    st.rerun()
+                    if not background:
+                        st.rerun()
 
@@ -4,13 +4,20 @@ import io
 import streamlit as st
 from PIL import Image
 
-from database import cursor, delete_photo, get_criminal_by_id, update_criminal
+from database import cursor, delete_criminal, delete_photo, get_criminal_by_id, read_cursor, update_criminal
+from jobs import submit_job
+from .utils import audit
 
 
 def list_criminals_page() -> None:
     st.header("📄 Liste des criminels enregistrés")
-    cursor.execute("SELECT id, nom, crime, description, image FROM criminals ORDER BY id DESC")
-    rows = cursor.fetchall()
+    if st.session_state.get("is_admin"):
+        if st.button("🧬 Rechercher les doublons de la galerie"):
+            job_id = submit_job(cursor, "dedup", created_by=st.session_state.get("username"))
+            st.success(f"✅ Tâche #{job_id} soumise. Le rapport sera disponible dans la page « Tâches ».")
+    with read_cursor() as cur:
+        cur.execute("SELECT id, nom, crime, description, image FROM criminals ORDER BY id DESC")
+        rows = cur.fetchall()
     if rows:
         for row in rows:
             id_criminal, nom, crime, desc, img_bytes = row
@@ -37,7 +44,8 @@ def list_criminals_page() -> None:
                 if st.session_state.get("is_admin"):
                     if st.button("🗑️ Supprimer", key=f"delete_{id_criminal}"):
                         with st.spinner(f"Suppression de {nom}..."):
-                            cursor.execute("DELETE FROM criminals WHERE id = %s", (id_criminal,))
+                            delete_criminal(id_criminal)
+                        audit("criminal_delete", id_criminal, nom=nom)
                         st.success(f"✅ Criminel {nom} supprimé.")
                         st.rerun()
     else:
@@ -87,8 +95,9 @@ def edit_criminal_page(criminal_id):
             date_arrestation = st.date_input("Date d'arrestation", value=criminal_dict['date_arrestation'])
 
         st.markdown("### Informations judiciaires")
-        cursor.execute("SELECT name FROM crime_types ORDER BY name")
-        crime_types = [row[0] for row in cursor.fetchall()]
+        with read_cursor() as cur:
+            cur.execute("SELECT name FROM crime_types ORDER BY name")
+            crime_types = [row[0] for row in cur.fetchall()]
         crime_index = crime_types.index(criminal_dict['crime']) if criminal_dict['crime'] in crime_types else 0
         crime = st.selectbox("Infractioncrime *", crime_types, index=crime_index)
         implication = st.text_input("Implication", value=criminal_dict['implication'])
@@ -117,6 +126,9 @@ def edit_criminal_page(criminal_id):
                     }
                     with st.spinner("Mise à jour..."):
                         update_criminal(criminal_id, updated_data)
+                    audit("criminal_update", criminal_id, fields=sorted(
+                        key for key, value in updated_data.items() if value != criminal_dict.get(key)
+                    ))
                     st.success("✅ Informations mises à jour.")
                     st.session_state.editing_criminal_id = None
                     st.rerun()
@@ -128,8 +140,12 @@ def edit_criminal_page(criminal_id):
 
 def manage_photos(criminal_id):
     st.header("🖼️ Gérer les photos")
-    cursor.execute("SELECT id, image FROM images_criminels WHERE criminal_id = %s ORDER BY id DESC", (criminal_id,))
-    photos = cursor.fetchall()
+    with read_cursor() as cur:
+        cur.execute(
+            "SELECT id, COALESCE(thumbnail, image) FROM images_criminels WHERE criminal_id = %s ORDER BY id DESC",
+            (criminal_id,),
+        )
+        photos = cur.fetchall()
     if photos:
         cols = st.columns(3)
         for idx, (pid, pbytes) in enumerate(photos):
@@ -139,5 +155,6 @@ def manage_photos(criminal_id):
                     if st.button("🗑️", key=f"del_{pid}"):
                         with st.spinner("Suppression..."):
                             delete_photo(pid)
+                        audit("photo_delete", criminal_id, photo_id=pid)
                         st.rerun()
 
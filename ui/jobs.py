@@ -0,0 +1,109 @@
+"""Suivi des tâches en arrière-plan."""
+import streamlit as st
+
+from database import cursor, merge_criminals, merge_differences
+from jobs import ACTIVE_STATES, cancel_job, get_job, list_jobs
+from utils import deserialize_match
+from .search import display_search_results
+from .utils import audit, fragment
+
+STATUS_LABELS = {
+    "queued": "⏳ En attente",
+    "running": "⚙️ En cours",
+    "succeeded": "✅ Terminée",
+    "failed": "❌ Échec",
+    "cancelled": "🚫 Annulée",
+}
+KIND_LABELS = {"search": "Recherche faciale", "enroll": "Enregistrement", "dedup": "Doublons de la galerie"}
+RESULT_KINDS = ("search", "dedup")
+
+
+def jobs_page() -> None:
+    st.header("⏳ Tâches en arrière-plan")
+    _jobs_list()
+
+    job_id = st.session_state.get("job_results")
+    if job_id is not None:
+        job = get_job(cursor, job_id)
+        if job and job["status"] == "succeeded" and job["kind"] == "search":
+            st.markdown(f"### Résultats de la tâche #{job_id}")
+            results = [deserialize_match(r) for r in job["result"]["results"]]
+            if results:
+                display_search_results(results)
+            else:
+                st.info("Aucune correspondance trouvée.")
+        elif job and job["status"] == "succeeded" and job["kind"] == "dedup":
+            dedup_report(job)
+
+
+def dedup_report(job) -> None:
+    """Revue des groupes de doublons présumés, avec fusion dans le plus ancien dossier."""
+    report = job["result"]
+    clusters = report["clusters"]
+    st.markdown(f"### Doublons présumés (tâche #{job['id']})")
+    st.caption(f"{report['embeddings']} photos comparées — seuil de distance {report['threshold']}")
+    if not clusters:
+        st.info("Aucun doublon détecté.")
+        return
+    merged = st.session_state.setdefault("merged_clusters", set())
+    for cluster in clusters:
+        ids = tuple(m["id"] for m in cluster["members"])
+        with st.container():
+            st.markdown(f"**{len(ids)} dossiers — correspondance max {cluster['best_similarity']:.2f}%**")
+            for m in cluster["members"]:
+                target = " (cible)" if m["id"] == cluster["target"] else ""
+                st.write(f"ID {m['id']}{target} — {m['nom']} {m['prenom'] or ''} — {m['crime']} — {m['photos']} photo(s)")
+            if ids in merged:
+                st.success("✅ Fusionné.")
+            elif st.session_state.get("is_admin") and _merge_review(job, cluster, ids):
+                with st.spinner("Fusion..."):
+                    moved = merge_criminals(cluster["target"], ids, merged_by=st.session_state.get("username"))
+                audit("criminal_merge", cluster["target"], sources=[i for i in ids if i != cluster["target"]],
+                      photos=moved, job=job["id"])
+                merged.add(ids)
+                st.rerun()
+
+
+def _merge_review(job, cluster, ids) -> bool:
+    """Champs divergents du groupe, puis bouton de fusion (après confirmation s'il y en a)."""
+    key = f"merge_{job['id']}_{ids[0]}"
+    differences = merge_differences(cluster["target"], ids)
+    confirmed = True
+    if differences:
+        st.warning("Champs divergents — les valeurs des doublons seront ajoutées à la description de la cible :")
+        st.table({
+            field: {f"#{i}": values.get(i, "") for i in ids}
+            for field, values in differences.items()
+        })
+        confirmed = st.checkbox("J'ai vérifié les différences", key=f"{key}_checked")
+    return st.button(f"🔗 Fusionner dans #{cluster['target']}", key=key, disabled=not confirmed)
+
+
+@fragment(run_every=2)
+def _jobs_list() -> None:
+    """Liste rafraîchie périodiquement : l'état est relu en base, il survit au rechargement."""
+    jobs = list_jobs(cursor, st.session_state.get("username"))
+    if not jobs:
+        st.info("ℹ️ Aucune tâche.")
+        return
+    for job in jobs:
+        col1, col2, col3 = st.columns([3, 2, 1])
+        with col1:
+            st.markdown(f"**#{job['id']} — {KIND_LABELS.get(job['kind'], job['kind'])}**")
+            st.caption(f"Soumise le {job['created_at']:%d/%m/%Y à %H:%M}")
+        with col2:
+            st.write(STATUS_LABELS.get(job["status"], job["status"]))
+            if job["status"] in ACTIVE_STATES:
+                st.progress(float(job["progress"]), text=job["message"] or "")
+            elif job["status"] == "failed":
+                st.caption(job["error"])
+            elif job["kind"] == "enroll" and job["result"]:
+                st.caption(f"Criminel ID {job['result']['id']}")
+        with col3:
+            if job["status"] in ACTIVE_STATES and not job["cancel_requested"]:
+                if st.button("Annuler", key=f"cancel_job_{job['id']}"):
+                    cancel_job(cursor, job["id"])
+            elif job["status"] == "succeeded" and job["kind"] in RESULT_KINDS:
+                if st.button("Résultats", key=f"show_job_{job['id']}"):
+                    st.session_state["job_results"] = job["id"]
+                    st.rerun()
@@ -1,13 +1,18 @@
 """Recherche et affichage des criminels."""
 import io
-from datetime import datetime
+import html
+import hashlib
+from datetime import date, datetime
 
 import streamlit as st
 from PIL import Image
 
-from database import cursor, search_criminals_by_text
-from utils import generate_pdf, find_match, image_to_bytes
-from .utils import _logo_b64
+from config import SEARCH_DEADLINE, SERVICE_URL
+from database import cursor, list_crime_types, normalize_filters, read_cursor, search_criminals_by_text
+from jobs import submit_job
+from service import IdentificationClient, ServiceError
+from utils import generate_pdf, find_match_fused, find_match_stream, image_to_bytes
+from .utils import _logo_b64, audit, fragment, load_template
 
 
 def search_criminal_page() -> None:
@@ -15,249 +20,299 @@ def search_criminal_page() -> None:
     tab1, tab2 = st.tabs(["🖼️ Par image", "🔎 Par mots-clés"])
     with tab1:
         st.markdown("### 📸 Recherche par reconnaissance faciale")
-        uploaded_file = st.file_uploader("Choisir une image", type=["jpg", "jpeg", "png"])
-        if uploaded_file and st.button("🔍 Rechercher", key="search_face"):
-            with st.spinner("Recherche en cours..."):
-                input_img = Image.open(uploaded_file).convert("RGB")
-                results = find_match(input_img, cursor)
-                if results:
-                    st.success(f"✅ {len(results)} correspondance(s) trouvée(s) !")
-                    display_search_results(results)
-                else:
-                    st.info("Aucune correspondance trouvée.")
+        uploaded_files = st.file_uploader(
+            "Choisir une image (ou plusieurs photos de la même personne)",
+            type=["jpg", "jpeg", "png"],
+            accept_multiple_files=True,
+        )
+        fusion = _fusion_choice(uploaded_files)
+        filters = _face_filters()
+        background = st.checkbox("⏳ Exécuter en arrière-plan", key="search_face_background")
+        if uploaded_files and st.button("🔍 Rechercher", key="search_face"):
+            audit(
+                "face_search",
+                probe=_upload_digest(uploaded_files), photos=len(uploaded_files), fusion=fusion,
+                background=background, filters=filters,
+            )
+            if background:
+                job_id = submit_job(
+                    cursor,
+                    "search",
+                    payload={"filters": filters, "fusion": fusion},
+                    inputs=[f.getvalue() for f in uploaded_files],
+                    created_by=st.session_state.get("username"),
+                )
+                st.success(f"✅ Tâche #{job_id} soumise. Suivez-la dans la page « Tâches ».")
+            else:
+                with st.spinner("Recherche en cours..."):
+                    images = [Image.open(f).convert("RGB") for f in uploaded_files]
+                    try:
+                        results, complete = _identify(images, filters, fusion)
+                        st.session_state["face_search"] = {
+                            "probe": _upload_digest(uploaded_files),
+                            "filters": filters,
+                            "fusion": fusion,
+                            "results": results,
+                            "complete": complete,
+                        }
+                    except ServiceError as e:
+                        st.error(f"❌ {e}")
+        # Les résultats sont conservés en session : un rerun (export PDF,
+        # ouverture d'un expander) ne relance pas la recherche.
+        face_search = st.session_state.get("face_search")
+        if (
+            uploaded_files
+            and face_search
+            and face_search["probe"] == _upload_digest(uploaded_files)
+            and face_search.get("filters") == filters
+            and face_search.get("fusion") == fusion
+        ):
+            results = face_search["results"]
+            if not face_search.get("complete", True):
+                st.warning("⚠️ Délai dépassé : meilleurs résultats trouvés sur une partie de la galerie.")
+            if results:
+                st.success(f"✅ {len(results)} correspondance(s) trouvée(s) !")
+                display_search_results(results)
+            else:
+                st.info("Aucune correspondance trouvée.")
     with tab2:
         st.markdown("### 🔍 Recherche par nom/mots-clés")
         search_term = st.text_input("Entrez un nom, crime, ou mot-clé:")
         if search_term and st.button("🔍 Rechercher", key="search_text"):
+            audit("text_search", term=search_term)
             with st.spinner("Recherche en cours..."):
-                results = search_criminals_by_text(search_term)
-                if results:
-                    st.success(f"✅ {len(results)} résultat(s) trouvé(s) !")
-                    display_text_search_results(results)
-                else:
-                    st.info("Aucun résultat trouvé.")
+                st.session_state["text_search"] = {
+                    "term": search_term,
+                    "results": search_criminals_by_text(search_term),
+                }
+        text_search = st.session_state.get("text_search")
+        if search_term and text_search and text_search["term"] == search_term:
+            results = text_search["results"]
+            if results:
+                st.success(f"✅ {len(results)} résultat(s) trouvé(s) !")
+                display_text_search_results(results)
+            else:
+                st.info("Aucun résultat trouvé.")
+
+
+def _face_filters():
+    """Critères facultatifs sur la fiche, appliqués avant la comparaison des visages (None si aucun)."""
+    with st.expander("🎯 Filtres (facultatifs)"):
+        with read_cursor() as cur:
+            crime_types = list_crime_types(cur) if cur else []
+        crimes = st.multiselect("Infractions", crime_types, key="filter_crimes")
+        nationalite = st.text_input("Nationalité", key="filter_nationalite")
+        col1, col2 = st.columns(2)
+        age_min = col1.number_input("Âge minimum", min_value=0, max_value=120, value=0, key="filter_age_min")
+        age_max = col2.number_input(
+            "Âge maximum", min_value=0, max_value=120, value=0, key="filter_age_max", help="0 : sans limite"
+        )
+        arrested = ()
+        if st.checkbox("Fenêtre de date d'arrestation", key="filter_use_dates"):
+            today = date.today()
+            arrested = st.date_input(
+                "Arrêté entre", value=(today.replace(year=today.year - 1), today), key="filter_arrested"
+            )
+    return normalize_filters({
+        "crimes": crimes,
+        "nationalite": nationalite,
+        "age_min": age_min or None,
+        "age_max": age_max or None,
+        "arrested_from": arrested[0] if len(arrested) > 0 else None,
+        "arrested_to": arrested[1] if len(arrested) > 1 else None,
+    })
+
+
+def _fusion_choice(uploaded_files):
+    """Fusion des scores quand plusieurs photos sont fournies, sinon None."""
+    if not uploaded_files or len(uploaded_files) < 2:
+        return None
+    labels = {
+        "min": "Meilleure photo (minimum)",
+        "mean": "Moyenne des photos",
+        "learned": "Fusion apprise",
+    }
+    st.caption(f"🧩 {len(uploaded_files)} photos : un seul classement pour la même personne.")
+    return st.selectbox(
+        "Fusion des scores", list(labels), format_func=labels.get, key="search_face_fusion"
+    )
+
+
+def _identify(images, filters=None, fusion=None):
+    """(résultats, complet) via le service d'identification s'il est configuré, sinon localement.
+
+    Avec ``fusion``, les photos sont celles d'une même personne (find_match_fused).
+    En local, les correspondances provisoires d'une photo unique s'affichent au fil de la recherche.
+    """
+    if fusion:
+        if SERVICE_URL:
+            return IdentificationClient(username=st.session_state.get("username")).identify_fused(images, fusion, filters=filters), True
+        with read_cursor() as cur:
+            return find_match_fused(images, cur, fusion=fusion, filters=filters)
+    input_img = images[0]
+    if SERVICE_URL:
+        return IdentificationClient(username=st.session_state.get("username")).identify(input_img, filters=filters), True
+    placeholder = st.empty()
+    results, complete = [], True
+    with read_cursor() as cur:
+        for results, complete in find_match_stream(
+            input_img, cur, filters=filters, deadline=SEARCH_DEADLINE or None
+        ):
+            with placeholder.container():
+                _preview(results)
+    placeholder.empty()
+    return results, complete
+
+
+def _preview(results) -> None:
+    """Aperçu léger (sans widgets) des correspondances provisoires."""
+    if not results:
+        st.caption("Recherche en cours… aucune correspondance pour l'instant.")
+        return
+    st.caption(f"Recherche en cours… {len(results)} correspondance(s) provisoire(s)")
+    for column, r in zip(st.columns(len(results)), results):
+        with column:
+            st.image(r["reference_image"], width=120)
+            st.markdown(f"**{html.escape(str(r['nom']))}** — {r['similarity']}%")
+
+
+def _upload_digest(uploaded_files) -> str:
+    """Empreinte de la photo (ou de la suite de photos) recherchée."""
+    if len(uploaded_files) == 1:
+        return hashlib.sha256(uploaded_files[0].getvalue()).hexdigest()
+    digest = hashlib.sha256()
+    for uploaded_file in uploaded_files:
+        digest.update(hashlib.sha256(uploaded_file.getvalue()).digest())
+    return digest.hexdigest()
+
+
+# Clé de session du dernier PDF généré : (clé de la fiche, contenu)
+PDF_STATE = "casier_pdf"
+IDENTITY_FIELDS = [
+    ("👤 Nom complet", lambda d: f"{d.get('nom', '')} {d.get('prenom', '')}"),
+    ("🎭 Alias/Surnom", lambda d: d.get('alias', 'N/A')),
+    ("📅 Âge", lambda d: f"{d.get('age', 'N/A')} ans"),
+    ("🎂 Date de naissance", lambda d: d.get('date_naissance', 'N/A')),
+    ("🏙️ Lieu de naissance", lambda d: d.get('lieu_naissance', 'N/A')),
+    ("🌍 Nationalité", lambda d: d.get('nationalite', 'N/A')),
+    ("📞 Téléphone", lambda d: d.get('telephone', 'N/A')),
+    ("🏠 Adresse", lambda d: d.get('adresse', 'N/A')),
+]
+
+JUDICIAL_FIELDS = [
+    ("⚖️ Infractioncrime", lambda d: d.get('crime', 'N/A')),
+    ("🚔 Date d'arrestation", lambda d: d.get('date_arrestation', 'N/A')),
+    ("⚖️ Niveau d'implication", lambda d: d.get('implication', 'N/A')),
+    ("📝 Description détaillée", lambda d: d.get('description', 'N/A')),
+]
+
+DETAIL_COLUMNS = [
+    'nom', 'prenom', 'alias', 'crime', 'description', 'implication', 'age', 'date_naissance',
+    'lieu_naissance', 'nationalite', 'telephone', 'adresse', 'date_arrestation',
+]
+
+
+def _render_section(title: str, fields, criminal_data) -> str:
+    field_template = load_template("casier_field")
+    rows = "".join(
+        field_template.format(label=label, value=html.escape(str(getter(criminal_data))))
+        for label, getter in fields
+    )
+    return load_template("casier_section").format(title=title, fields=rows)
+
+
+def _as_bytes(image_data):
+    if isinstance(image_data, memoryview):
+        return image_data.tobytes()
+    return image_data
 
 
 def display_casier_judiciaire(criminal_data, image_data=None, similarity=None):
     """Affiche un format A4 compact et uniforme, exportable en PDF"""
     current_date = datetime.now().strftime("%d/%m/%Y à %H:%M")
+    img_bytes = _as_bytes(image_data)
 
     _logo = _logo_b64()
-
-    st.markdown(
-        """
-    <div style="
-        max-width: 794px;
-        margin: 20px auto;
-        background: #ffffff;
-        color: #000;
-        font-family: Arial, sans-serif;
-        border: 1px solid #e0e0e0;
-        border-radius: 8px;
-        box-shadow: 0 4px 12px rgba(0,0,0,0.1);
-        padding: 20px;
-        overflow: hidden;
-    ">
-    """,
-        unsafe_allow_html=True,
-    )
-
     if _logo:
-        st.markdown(
-            f"""
-        <div style="text-align: center; padding: 10px;">
-            <img src='data:image/png;base64,{_logo}' style='height:100px;'>
-        </div>
-        """,
-            unsafe_allow_html=True,
-        )
+        st.markdown(load_template("casier_logo").format(logo=_logo), unsafe_allow_html=True)
 
-    if image_data:
+    if img_bytes:
         try:
-            if isinstance(image_data, memoryview):
-                img_bytes = image_data.tobytes()
-            elif isinstance(image_data, bytes):
-                img_bytes = image_data
-            else:
-                img = Image.open(io.BytesIO(image_data)).convert("RGB")
-                img_bytes = image_to_bytes(img)
-            img = Image.open(io.BytesIO(img_bytes))
-            st.markdown(
-                """
-                <style>
-                    div.stImage > img {
-                        display: block;
-                        margin-left: auto;
-                        margin-right: auto;
-                    }
-                </style>
-                """,
-                unsafe_allow_html=True,
-            )
-            st.image(img, width=200)
+            st.image(Image.open(io.BytesIO(img_bytes)), width=200)
         except Exception:
             st.info("📷 Photo non disponible")
     else:
         st.info("📷 Pas de photo disponible")
 
+    st.markdown(_render_section("👤 IDENTITÉ", IDENTITY_FIELDS, criminal_data), unsafe_allow_html=True)
     st.markdown(
-        """
-    <div style="
-        padding: 15px;
-        background: #ffffff;
-        border-left: 4px solid #d32f2f;
-        border-radius: 4px;
-        margin-bottom: 15px;
-    ">
-    <h3 style="
-        color: #d32f2f;
-        font-size: 16px;
-        font-weight: bold;
-        margin-bottom: 10px;
-        border-bottom: 2px solid #d32f2f;
-    ">👤 IDENTITÉ</h3>
-    """,
+        _render_section("⚖️ INFORMATIONS JUDICIAIRES", JUDICIAL_FIELDS, criminal_data),
         unsafe_allow_html=True,
     )
-    info_html = f"""
-    <div style="margin-bottom: 10px;">
-        <div style="font-weight: bold; color: #495057; font-size: 12px; text-transform: uppercase;">👤 Nom complet</div>
-        <div style="color: #212529; font-size: 14px; padding: 5px 0; border-bottom: 1px solid #e9ecef;">{criminal_data.get('nom', '')} {criminal_data.get('prenom', '')}</div>
-    </div>
-    <div style="margin-bottom: 10px;">
-        <div style="font-weight: bold; color: #495057; font-size: 12px; text-transform: uppercase;">🎭 Alias/Surnom</div>
-        <div style="color: #212529; font-size: 14px; padding: 5px 0; border-bottom: 1px solid #e9ecef;">{criminal_data.get('alias', 'N/A')}</div>
-    </div>
-    <div style="margin-bottom: 10px;">
-        <div style="font-weight: bold; color: #495057; font-size: 12px; text-transform: uppercase;">📅 Âge</div>
-        <div style="color: #212529; font-size: 14px; padding: 5px 0; border-bottom: 1px solid #e9ecef;">{criminal_data.get('age', 'N/A')} ans</div>
-    </div>
-    <div style="margin-bottom: 10px;">
-        <div style="font-weight: bold; color: #495057; font-size: 12px; text-transform: uppercase;">🎂 Date de naissance</div>
-        <div style="color: #212529; font-size: 14px; padding: 5px 0; border-bottom: 1px solid #e9ecef;">{criminal_data.get('date_naissance', 'N/A')}</div>
-    </div>
-    <div style="margin-bottom: 10px;">
-        <div style="font-weight: bold; color: #495057; font-size: 12px; text-transform: uppercase;">🏙️ Lieu de naissance</div>
-        <div style="color: #212529; font-size: 14px; padding: 5px 0; border-bottom: 1px solid #e9ecef;">{criminal_data.get('lieu_naissance', 'N/A')}</div>
-    </div>
-    <div style="margin-bottom: 10px;">
-        <div style="font-weight: bold; color: #495057; font-size: 12px; text-transform: uppercase;">🌍 Nationalité</div>
-        <div style="color: #212529; font-size: 14px; padding: 5px 0; border-bottom: 1px solid #e9ecef;">{criminal_data.get('nationalite', 'N/A')}</div>
-    </div>
-    <div style="margin-bottom: 10px;">
-        <div style="font-weight: bold; color: #495057; font-size: 12px; text-transform: uppercase;">📞 Téléphone</div>
-        <div style="color: #212529; font-size: 14px; padding: 5px 0; border-bottom: 1px solid #e9ecef;">{criminal_data.get('telephone', 'N/A')}</div>
-    </div>
-    <div style="margin-bottom: 10px;">
-        <div style="font-weight: bold; color: #495057; font-size: 12px; text-transform: uppercase;">🏠 Adresse</div>
-        <div style="color: #212529; font-size: 14px; padding: 5px 0; border-bottom: 1px solid #e9ecef;">{criminal_data.get('adresse', 'N/A')}</div>
-    </div>
-    """
-    st.markdown(info_html, unsafe_allow_html=True)
-    st.markdown("</div>", unsafe_allow_html=True)
+    st.markdown(load_template("casier_footer").format(date=current_date), unsafe_allow_html=True)
 
-    st.markdown(
-        """
-    <div style="
-        padding: 15px;
-        background: #ffffff;
-        border-left: 4px solid #d32f2f;
-        border-radius: 4px;
-    ">
-    <h3 style="
-        color: #d32f2f;
-        font-size: 16px;
-        font-weight: bold;
-        margin-bottom: 10px;
-        border-bottom: 2px solid #d32f2f;
-    ">⚖️ INFORMATIONS JUDICIAIRES</h3>
-    """,
-        unsafe_allow_html=True,
-    )
-    crime_html = f"""
-    <div style="margin-bottom: 10px;">
-        <div style="font-weight: bold; color: #495057; font-size: 12px; text-transform: uppercase;">⚖️ Infractioncrime</div>
-        <div style="color: #212529; font-size: 14px; padding: 5px 0; border-bottom: 1px solid #e9ecef;">{criminal_data.get('crime', 'N/A')}</div>
-    </div>
-    <div style="margin-bottom: 10px;">
-        <div style="font-weight: bold; color: #495057; font-size: 12px; text-transform: uppercase;">🚔 Date d'arrestation</div>
-        <div style="color: #212529; font-size: 14px; padding: 5px 0; border-bottom: 1px solid #e9ecef;">{criminal_data.get('date_arrestation', 'N/A')}</div>
-    </div>
-    <div style="margin-bottom: 10px;">
-        <div style="font-weight: bold; color: #495057; font-size: 12px; text-transform: uppercase;">⚖️ Niveau d'implication</div>
-        <div style="color: #212529; font-size: 14px; padding: 5px 0; border-bottom: 1px solid #e9ecef;">{criminal_data.get('implication', 'N/A')}</div>
-    </div>
-    <div style="margin-bottom: 10px;">
-        <div style="font-weight: bold; color: #495057; font-size: 12px; text-transform: uppercase;">📝 Description détaillée</div>
-        <div style="color: #212529; font-size: 14px; padding: 5px 0; border-bottom: 1px solid #e9ecef;">{criminal_data.get('description', 'N/A')}</div>
-    </div>
-    """
-    st.markdown(crime_html, unsafe_allow_html=True)
-    st.markdown("</div>", unsafe_allow_html=True)
+    # Le PDF n'est généré qu'à la demande ; la session n'en garde qu'un (le dernier
+    # généré), libéré dès son téléchargement
+    digest = hashlib.md5(repr((sorted(criminal_data.items()), similarity)).encode()).hexdigest()[:8]
+    pdf_key = f"pdf_{criminal_data.get('id', 'unknown')}_{digest}"
+    stored = st.session_state.get(PDF_STATE)
+    if stored is None or stored[0] != pdf_key:
+        if st.button("📄 Générer le PDF", key=f"make_{pdf_key}"):
+            with st.spinner("Génération du PDF..."):
+                pdf = generate_pdf(criminal_data, img_bytes, similarity, current_date).getvalue()
+            stored = st.session_state[PDF_STATE] = (pdf_key, pdf)
+    if stored is not None and stored[0] == pdf_key:
+        file_name = f"{criminal_data.get('nom', 'unknown')}_{criminal_data.get('prenom', '')}.pdf"
+        st.download_button(
+            label="📄 Exporter en PDF",
+            data=stored[1],
+            file_name=file_name,
+            mime="application/pdf",
+            key=f"export_{pdf_key}",
+            on_click=_pdf_downloaded,
+            args=(criminal_data.get('id'),),
+        )
 
-    st.markdown(
-        f"""
-    <div style="
-        border-top: 2px solid #d32f2f;
-        padding: 15px;
-        text-align: center;
-        font-size: 11px;
-        color: #666;
-        margin-top: 15px;
-    ">
-        📅 <strong>Document généré le {current_date}</strong><br>
-        <strong style=\"font-size: 16px; color: red;\">⚖️ DOCUMENT CONFIDENTIEL</strong>
-    </div>
-    """,
-        unsafe_allow_html=True,
-    )
 
-    img_bytes = image_data if isinstance(image_data, bytes) else None
-    file_name = f"{criminal_data.get('nom', 'unknown')}_{criminal_data.get('prenom', '')}.pdf"
-    pdf_buffer = generate_pdf(criminal_data, img_bytes, similarity, current_date)
-    st.download_button(
-        label="📄 Exporter en PDF",
-        data=pdf_buffer,
-        file_name=file_name,
-        mime="application/pdf",
-        key=f"export_pdf_{criminal_data.get('id', 'unknown')}",
-    )
+def _pdf_downloaded(criminal_id) -> None:
+    audit("pdf_export", criminal_id)
+    st.session_state.pop(PDF_STATE, None)
 
-    st.markdown("</div>", unsafe_allow_html=True)
+
+@fragment
+def _result_card(criminal_data, img_bytes, similarity=None):
+    """Carte de résultat : ses interactions ne relancent qu'elle-même."""
+    with st.container():
+        st.markdown(f"#### {criminal_data['nom']} {criminal_data['prenom']}")
+        if img_bytes:
+            try:
+                st.image(img_bytes, width=100)
+            except Exception as e:
+                st.warning(f"Impossible d'afficher l'image : {e}")
+        if similarity is not None:
+            st.write(f"**Correspondance :** {similarity:.2f}%")
+        with st.expander("Voir les détails"):
+            display_casier_judiciaire(criminal_data, img_bytes, similarity)
 
 
 def display_search_results(results):
+    ids = [r['id'] for r in results]
+    with read_cursor() as cur:
+        cur.execute(
+            f"SELECT id, {', '.join(DETAIL_COLUMNS)} FROM criminals WHERE id = ANY(%s)",
+            (ids,),
+        )
+        details_by_id = {row[0]: row[1:] for row in cur.fetchall()}
+
     st.markdown("<div class='results-container'>", unsafe_allow_html=True)
     for r in results:
-        cursor.execute(
-            "SELECT nom, prenom, alias, crime, description, implication, age, date_naissance, lieu_naissance, nationalite, telephone, adresse, date_arrestation FROM criminals WHERE id = %s",
-            (r['id'],),
-        )
-        details = cursor.fetchone()
-        if details:
-            criminal_data = {
-                'id': r['id'],
-                'nom': details[0],
-                'prenom': details[1],
-                'alias': details[2],
-                'crime': details[3],
-                'description': details[4],
-                'implication': details[5],
-                'age': details[6],
-                'date_naissance': details[7],
-                'lieu_naissance': details[8],
-                'nationalite': details[9],
-                'telephone': details[10],
-                'adresse': details[11],
-                'date_arrestation': details[12],
-            }
-            ref_img_bytes = image_to_bytes(r['reference_image']) if r.get('reference_image') else None
-            with st.container():
-                st.markdown(f"#### {criminal_data['nom']} {criminal_data['prenom']}")
-                st.image(ref_img_bytes, width=100)
-                st.write(f"**Correspondance :** {r['similarity']:.2f}%")
-                with st.expander("Voir les détails"):
-                    display_casier_judiciaire(criminal_data, ref_img_bytes, r['similarity'])
+        details = details_by_id.get(r['id'])
+        if not details:
+            continue
+        criminal_data = {'id': r['id'], **dict(zip(DETAIL_COLUMNS, details))}
+        if r.get('reference_image') and 'reference_bytes' not in r:
+            r['reference_bytes'] = image_to_bytes(r['reference_image'])
+        _result_card(criminal_data, r.get('reference_bytes'), r['similarity'])
     st.markdown("</div>", unsafe_allow_html=True)
 
 
@@ -280,18 +335,5 @@ def display_text_search_results(results):
             'adresse': row[12],
             'date_arrestation': row[13],
         }
-        img_bytes = row[14]
-
-        with st.container():
-            st.markdown(f"#### {criminal_data['nom']} {criminal_data['prenom']}")
-            if img_bytes:
-                try:
-                    img = Image.open(io.BytesIO(img_bytes))
-                    st.image(img, width=100)
-                except Exception as e:
-                    st.warning(f"Impossible d'afficher l'image : {e}")
-
-            with st.expander("Voir les détails"):
-                display_casier_judiciaire(criminal_data, img_bytes)
+        _result_card(criminal_data, _as_bytes(row[14]))
     st.markdown("</div>", unsafe_allow_html=True)
-
@@ -1,17 +1,24 @@
 """UI helper functions."""
 import os
 import base64
+from functools import lru_cache
+
 import streamlit as st
 
+from audit import audit_event
+
+TEMPLATES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates")
+
+# Fragments : rerun partiel d'un bloc sans réexécuter toute la page
+fragment = getattr(st, "fragment", None) or st.experimental_fragment
+
+
+def audit(action: str, target=None, **details) -> None:
+    """Journalise une action de l'utilisateur connecté (écriture différée)."""
+    audit_event(action, st.session_state.get("username"), target, details or None)
 
-def load_css(file_name: str = "style.css") -> None:
-    """Injecte le CSS de base et applique le thème de l'application."""
-    base_css = ""
-    if os.path.exists(file_name):
-        with open(file_name, "r") as f:
-            base_css = f.read()
 
-    theme_css = """
+THEME_CSS = """
 :root {
   --brand-bg: #0d1b2a;
   --brand-surface: #1b263b;
@@ -112,7 +119,24 @@ html, body, [data-testid="stAppViewContainer"] {
 }
 """
 
-    st.markdown(f"<style>{base_css}\n{theme_css}</style>", unsafe_allow_html=True)
+
+@lru_cache(maxsize=None)
+def _read_text(path: str) -> str:
+    """Lit un fichier statique une seule fois par processus."""
+    if not os.path.exists(path):
+        return ""
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read()
+
+
+def load_template(name: str) -> str:
+    """Retourne le gabarit HTML ``ui/templates/<name>.html``."""
+    return _read_text(os.path.join(TEMPLATES_DIR, f"{name}.html"))
+
+
+def load_css(file_name: str = "style.css") -> None:
+    """Injecte le CSS de base et applique le thème de l'application."""
+    st.markdown(f"<style>{_read_text(file_name)}\n{THEME_CSS}</style>", unsafe_allow_html=True)
 
 
 def show_running_ui(state: bool) -> None:
@@ -130,6 +154,7 @@ def show_running_ui(state: bool) -> None:
         )
 
 
+@lru_cache(maxsize=None)
 def _logo_b64(path: str = "logo.png"):
     try:
         with open(path, "rb") as f:
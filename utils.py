@@ -2,15 +2,49 @@
 import io
 import os
 import base64
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 from PIL import Image
 from datetime import date
-from deepface import DeepFace
-from reportlab.lib.pagesizes import A4
-from reportlab.lib import colors
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Image as ReportLabImage, Table, TableStyle, Frame, PageTemplate
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.units import cm
+from time import monotonic
+
+from config import ENCODE_WORKERS, THUMBNAIL_SIZE
+
+from recognition import (
+    search_cache,
+    probe_hash,
+    gallery_token,
+    compute_embedding,
+    embed_images,
+    get_gallery_index,
+    match_threshold,
+)
+from shards import get_coordinator
+
+# DeepFace (TensorFlow) et ReportLab sont importés à la première utilisation :
+# la page de connexion ne doit dépendre que de Streamlit et de la base.
+_preload_lock = threading.Lock()
+_preload_thread = None
+
+
+def preload_heavy_modules(model_name: str = "Facenet") -> None:
+    """Charge DeepFace, le modèle et ReportLab en arrière-plan (une fois par processus)."""
+    global _preload_thread
+    with _preload_lock:
+        if _preload_thread is not None:
+            return
+        _preload_thread = threading.Thread(target=_preload, args=(model_name,), name="preload-heavy", daemon=True)
+        _preload_thread.start()
+
+
+def _preload(model_name: str) -> None:
+    try:
+        import reportlab.platypus  # noqa: F401
+        from deepface import DeepFace
+        DeepFace.build_model(model_name)
+    except Exception as e:
+        print(f"Préchargement des modèles incomplet : {e}")
 
 # Initialisation DeepFace
 def initialize_deepface():
@@ -25,6 +59,23 @@ def image_to_bytes(img: Image.Image) -> bytes:
     img.save(buffered, format="JPEG")
     return buffered.getvalue()
 
+def make_thumbnail(img: Image.Image, size: int = THUMBNAIL_SIZE) -> bytes:
+    thumb = img.convert("RGB")
+    thumb.thumbnail((size, size))
+    return image_to_bytes(thumb)
+
+def _encode(img: Image.Image):
+    img = img.convert("RGB")
+    return image_to_bytes(img), make_thumbnail(img)
+
+def encode_images(images):
+    """[(JPEG, vignette JPEG)] pour chaque image ; l'encodage (hors GIL) se fait en parallèle."""
+    images = list(images)
+    if len(images) <= 1:
+        return [_encode(img) for img in images]
+    with ThreadPoolExecutor(max_workers=min(len(images), ENCODE_WORKERS)) as executor:
+        return list(executor.map(_encode, images))
+
 def preprocess_image(image: Image.Image) -> np.ndarray:
     return np.array(image.convert("RGB"))
 
@@ -36,57 +87,293 @@ def is_valid_image(image_bytes: bytes) -> bool:
         return False
 
 # Reconnaissance faciale
-def find_match(uploaded_image: Image.Image, cursor, model_name: str = "Facenet", threshold: float = 0.40, top_k: int = 3):
-    uploaded_array = preprocess_image(uploaded_image)
-    cursor.execute("""
-        SELECT c.id, c.nom, c.crime, c.description, ic.image
-        FROM criminals c
-        JOIN images_criminels ic ON ic.criminal_id = c.id
-        ORDER BY c.id
-    """)
-    rows = cursor.fetchall()
-    if not rows:
+def find_match(uploaded_image: Image.Image, cursor, model_name: str = "Facenet", threshold: float = None, top_k: int = 3, use_cache: bool = True, filters=None):
+    """Recherche les criminels correspondant au visage de l'image.
+
+    Les résultats sont mis en cache par (empreinte de l'image, modèle, seuil, top_k,
+    jeton de la galerie) : les notifications des autres instances retirent les
+    entrées touchées, sinon toute écriture dans la galerie invalide le cache.
+    La requête est comparée aux embeddings stockés (distance cosinus), meilleure
+    photo par criminel ; les photos sans embedding sont calculées en arrière-plan
+    (recognition.backfill) et ignorées d'ici là.
+    Sans ``threshold``, le seuil calibré du modèle est utilisé (recognition.calibration).
+    ``cursor`` peut être un réplica (``database.read_cursor``).
+    ``filters`` : critères sur la fiche (database.filters), appliqués avant la comparaison.
+    """
+    from database.filters import filters_key, normalize_filters
+
+    if threshold is None:
+        threshold = match_threshold(model_name)
+    filters = normalize_filters(filters)
+    # Lue avant la recherche : une notification reçue pendant celle-ci empêche la mise en cache
+    generation = search_cache.generation
+    version = gallery_token(cursor) if use_cache else None
+    if version is None:
+        return _find_match(uploaded_image, cursor, model_name, threshold, top_k, filters)[1]
+
+    key = (probe_hash(uploaded_image), model_name, float(threshold), int(top_k), version, filters_key(filters))
+    entry = search_cache.get(key)
+    if entry is None:
+        query, results, complete = _find_match(uploaded_image, cursor, model_name, threshold, top_k, filters)
+        # Un résultat partiel (shard indisponible) n'est pas mis en cache ; l'embedding de
+        # la requête est conservé pour l'invalidation (recognition.index.apply_gallery_changes)
+        if complete:
+            search_cache.set(key, (query, results), generation)
+        return list(results)
+    return list(entry[1])
+
+
+def _find_match(uploaded_image: Image.Image, cursor, model_name: str, threshold: float, top_k: int, filters=None):
+    """(embedding de la requête ou None, résultats, complet)."""
+    query = compute_embedding(preprocess_image(uploaded_image), model_name)
+    if query is None:
+        return None, [], True
+    (matches,), complete = search_gallery(cursor, model_name, [query], threshold, top_k, filters)
+    return query, build_results(cursor, matches), complete
+
+
+def search_gallery(cursor, model_name: str, queries, threshold: float, top_k: int, filters=None):
+    """Meilleures correspondances de chaque requête : (listes [(criminal_id, image_id, distance)], complet).
+
+    Si la galerie est répartie (DGSN_SHARD_ADDRESSES), la recherche passe par le
+    coordinateur des shards ; ``complet`` est faux si un shard n'a pas répondu.
+    ``filters`` est résolu en SQL en une liste de criminels : l'index ne compare
+    que leurs photos.
+    """
+    from database.filters import filter_criminal_ids
+
+    criminals = filter_criminal_ids(cursor, filters)
+    if criminals is not None and not len(criminals):
+        return [[] for _ in queries], True
+    coordinator = get_coordinator()
+    if coordinator is not None:
+        results, missing = coordinator.search_many(queries, model_name, threshold, top_k, criminals)
+        return results, not missing
+    index = get_gallery_index(cursor, model_name)
+    return index.search_many(queries, threshold, top_k, criminals=criminals), True
+
+
+def find_match_stream(uploaded_image: Image.Image, cursor, model_name: str = "Facenet", threshold: float = None, top_k: int = 3, deadline: float = None, filters=None, use_cache: bool = True):
+    """Version progressive de ``find_match`` : produit (résultats provisoires, complet).
+
+    Le top-k est mis à jour à chaque partition de la galerie (ou réponse de shard) ;
+    le dernier élément produit est le résultat définitif. Passé ``deadline`` secondes,
+    la recherche s'arrête sur le meilleur top-k trouvé (``complet`` faux).
+    Seuls les résultats complets sont mis en cache (sauf ``use_cache`` faux).
+    """
+    from database.filters import filters_key, normalize_filters
+
+    stop = monotonic() + deadline if deadline else None
+    if threshold is None:
+        threshold = match_threshold(model_name)
+    filters = normalize_filters(filters)
+    generation = search_cache.generation
+    version = gallery_token(cursor) if use_cache else None
+    key = (probe_hash(uploaded_image), model_name, float(threshold), int(top_k), version, filters_key(filters))
+    entry = search_cache.get(key) if version is not None else None
+    if entry is not None:
+        yield list(entry[1]), True
+        return
+
+    query = compute_embedding(preprocess_image(uploaded_image), model_name)
+    if query is None:
+        yield [], True
+        return
+    # Les fiches déjà affichées ne sont pas relues à chaque mise à jour
+    built = {}
+    results, complete = [], False
+    for matches, complete in search_gallery_stream(cursor, model_name, query, threshold, top_k, stop, filters):
+        new = [m for m in matches if m[1] not in built]
+        rows = _result_rows(cursor, [image_id for _, image_id, _ in new])
+        built.update((image_id, _result(cid, dist, rows[image_id])) for cid, image_id, dist in new if image_id in rows)
+        results = [built[image_id] for _, image_id, _ in matches if image_id in built]
+        if stop is not None and monotonic() >= stop:
+            break
+        yield list(results), False
+    if complete and version is not None:
+        search_cache.set(key, (query, results), generation)
+    yield list(results), complete
+
+
+def search_gallery_stream(cursor, model_name: str, query, threshold: float, top_k: int, stop: float = None, filters=None):
+    """Top-k provisoires d'une requête : (liste [(criminal_id, image_id, distance)], complet).
+
+    Le dernier élément est complet si toute la galerie a été parcourue (et que tous
+    les shards ont répondu) ; ``stop`` (horloge ``time.monotonic``) borne l'attente des shards.
+    """
+    from database.filters import filter_criminal_ids
+
+    criminals = filter_criminal_ids(cursor, filters)
+    if criminals is not None and not len(criminals):
+        yield [], True
+        return
+    coordinator = get_coordinator()
+    if coordinator is not None:
+        timeout = max(0.0, stop - monotonic()) if stop is not None else None
+        matches, missing = [], []
+        for matches, missing in coordinator.search_stream(query, model_name, threshold, top_k, criminals, timeout):
+            yield matches, False
+        yield matches, not missing
+        return
+    index = get_gallery_index(cursor, model_name)
+    matches = []
+    for matches in index.search_stream(query, threshold, top_k, criminals=criminals):
+        yield matches, False
+    yield matches, True
+
+
+def find_matches(images, cursor, model_name: str = "Facenet", threshold: float = None, top_k: int = 3, progress=None, filters=None):
+    """Identification par lot : une liste de résultats par image, embeddings calculés en parallèle."""
+    if threshold is None:
+        threshold = match_threshold(model_name)
+    probes = [image_to_bytes(img.convert("RGB")) for img in images]
+    vectors = embed_images(probes, model_name, progress=progress)
+    found, _ = search_gallery(
+        cursor, model_name, [vec for vec in vectors if vec is not None], threshold, top_k, filters=filters
+    )
+    matches = iter(found)
+    return [build_results(cursor, next(matches)) if vec is not None else [] for vec in vectors]
+
+
+def find_match_fused(images, cursor, model_name: str = "Facenet", threshold: float = None, top_k: int = 3,
+                     fusion: str = "min", filters=None):
+    """Plusieurs photos d'une même personne inconnue : un seul classement, (résultats, complet).
+
+    Les photos (pixels, comme ``find_match``) passent dans le modèle par lot ; les distances de chaque criminel aux photos sont
+    fusionnées (``min``, ``mean`` ou ``learned``, voir recognition.fusion) en une seule
+    recherche. ``similarity`` et ``distance`` portent sur le score fusionné. Sans
+    ``threshold``, le seuil de la fusion est utilisé. ``complet`` est faux si un shard
+    n'a pas répondu ; seuls les résultats complets sont mis en cache.
+    """
+    from database.filters import filters_key, normalize_filters
+    from recognition.batching import embed_batch
+    from recognition.fusion import FUSIONS, fusion_threshold, fusion_weights
+
+    if fusion not in FUSIONS:
+        raise ValueError(f"Fusion inconnue : {fusion}")
+    images = [img.convert("RGB") for img in images]
+    if threshold is None:
+        threshold = fusion_threshold(model_name, fusion)
+    filters = normalize_filters(filters)
+    generation = search_cache.generation
+    version = gallery_token(cursor)
+    key = (
+        tuple(probe_hash(img) for img in images), model_name, float(threshold), int(top_k), version,
+        filters_key(filters), fusion,
+    )
+    entry = search_cache.get(key) if version is not None else None
+    if entry is not None:
+        return list(entry[1]), True
+    vectors = [vec for vec in embed_batch([preprocess_image(img) for img in images], model_name) if vec is not None]
+    if not vectors:
+        return [], True
+    weights = fusion_weights(model_name) if fusion == "learned" else None
+    matches, complete = search_gallery_fused(
+        cursor, model_name, vectors, threshold, top_k, fusion, weights, filters
+    )
+    results = build_results(cursor, matches)
+    # Toutes les requêtes sont conservées pour l'invalidation (apply_gallery_changes)
+    if complete and version is not None:
+        search_cache.set(key, (np.stack(vectors), results), generation)
+    return list(results), complete
+
+
+def search_gallery_fused(cursor, model_name: str, queries, threshold: float, top_k: int, fusion: str = "min",
+                         weights=None, filters=None):
+    """Correspondances fusionnées de plusieurs requêtes : ([(criminal_id, image_id, score)], complet)."""
+    from database.filters import filter_criminal_ids
+
+    criminals = filter_criminal_ids(cursor, filters)
+    if criminals is not None and not len(criminals):
+        return [], True
+    coordinator = get_coordinator()
+    if coordinator is not None:
+        matches, missing = coordinator.search_fused(queries, model_name, threshold, top_k, fusion, weights, criminals)
+        return matches, not missing
+    index = get_gallery_index(cursor, model_name)
+    return index.search_fused(queries, threshold, top_k, fusion, weights, criminals=criminals), True
+
+
+def find_duplicates(vectors, cursor, model_name: str = "Facenet", threshold: float = None, top_k: int = 5):
+    """Criminels déjà enregistrés ressemblant à l'une des photos d'un nouvel enregistrement.
+
+    Réutilise les embeddings calculés pour l'enregistrement : le coût se limite à
+    un produit matriciel sur l'index en mémoire.
+    """
+    if threshold is None:
+        threshold = match_threshold(model_name)
+    best = {}
+    found, _ = search_gallery(cursor, model_name, [vec for vec in vectors if vec is not None], threshold, top_k)
+    for matches in found:
+        for cid, image_id, dist in matches:
+            if cid not in best or dist < best[cid][2]:
+                best[cid] = (cid, image_id, dist)
+    return build_results(cursor, sorted(best.values(), key=lambda m: m[2])[:top_k])
+
+
+def build_results(cursor, matches):
+    """Complète [(criminal_id, image_id, distance)] avec la fiche et la photo de référence."""
+    if not matches:
         return []
-    
-    by_person = {}
-    for cid, nom, crime, desc, img_bytes in rows:
-        if not img_bytes or not is_valid_image(img_bytes):
-            continue
-        ref_img = Image.open(io.BytesIO(img_bytes)).convert("RGB")
-        by_person.setdefault(cid, {"nom": nom, "crime": crime, "description": desc, "refs": []})
-        by_person[cid]["refs"].append(ref_img)
-        
-    results = []
-    for cid, info in by_person.items():
-        best_dist, best_ref = None, None
-        for ref_img in info["refs"]:
-            ref_arr = preprocess_image(ref_img)
-            try:
-                res = DeepFace.verify(uploaded_array, ref_arr, model_name=model_name, enforce_detection=False)
-                dist = res.get("distance", 1.0)
-                if best_dist is None or dist < best_dist:
-                    best_dist, best_ref = dist, ref_img
-            except Exception:
-                continue
-        
-        if best_dist is not None and best_dist <= threshold:
-            similarity = round((1 - best_dist) * 100, 2)
-            results.append({
-                "id": cid,
-                "nom": info["nom"],
-                "crime": info["crime"],
-                "description": info["description"],
-                "similarity": similarity,
-                "distance": best_dist,
-                "reference_image": best_ref
-            })
-            
-    results.sort(key=lambda x: x["similarity"], reverse=True)
-    return results[:max(1, int(top_k))]
+    rows = _result_rows(cursor, [image_id for _, image_id, _ in matches])
+    return [_result(cid, dist, rows[image_id]) for cid, image_id, dist in matches if image_id in rows]
+
+
+def _result_rows(cursor, image_ids):
+    """{image_id: (nom, crime, description, photo)} des photos demandées."""
+    if not image_ids:
+        return {}
+    cursor.execute(
+        """
+        SELECT ic.id, c.nom, c.crime, c.description, ic.image
+        FROM images_criminels ic
+        JOIN criminals c ON c.id = ic.criminal_id
+        WHERE ic.id = ANY(%s)
+        """,
+        (list(image_ids),),
+    )
+    return {row[0]: row[1:] for row in cursor.fetchall()}
+
+
+def _result(cid, dist, row) -> dict:
+    nom, crime, desc, img_bytes = row
+    return {
+        "id": cid,
+        "nom": nom,
+        "crime": crime,
+        "description": desc,
+        "similarity": round((1 - dist) * 100, 2),
+        "distance": dist,
+        "reference_image": Image.open(io.BytesIO(img_bytes)).convert("RGB"),
+    }
+
+
+def serialize_match(result: dict) -> dict:
+    """Version JSON d'un résultat de ``find_match`` (image de référence en base64)."""
+    data = {k: v for k, v in result.items() if k not in ("reference_image", "reference_bytes")}
+    ref_bytes = result.get("reference_bytes")
+    if ref_bytes is None and result.get("reference_image") is not None:
+        ref_bytes = image_to_bytes(result["reference_image"])
+    data["reference_image"] = base64.b64encode(ref_bytes).decode() if ref_bytes else None
+    return data
+
+
+def deserialize_match(data: dict) -> dict:
+    """Inverse de ``serialize_match`` : l'image est restituée dans ``reference_bytes``."""
+    result = dict(data)
+    ref = result.pop("reference_image", None)
+    result["reference_bytes"] = base64.b64decode(ref) if ref else None
+    return result
 
 
 # Génération PDF
 def generate_pdf(criminal_data, image_data, similarity, current_date):
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib import colors
+    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Image as ReportLabImage, Table, TableStyle, Frame, PageTemplate
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+    from reportlab.lib.units import cm
+
     buffer = io.BytesIO()
     doc = SimpleDocTemplate(buffer, pagesize=A4, topMargin=1*cm, bottomMargin=3*cm, leftMargin=1.5*cm, rightMargin=1.5*cm)
     styles = getSampleStyleSheet()